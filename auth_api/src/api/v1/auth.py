@@ -4,7 +4,8 @@ from fastapi import APIRouter, Depends, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
 
 from core.config import settings
-from schemas.base import SignUpUser, UserInDB, Tokens, RefreshToken, SignInUserResponse
+from schemas.base import SignUpUser, UserInDB, Tokens, RefreshToken, SignInUserResponse, \
+    ValidateTokens, TokensValidation, TokenValidation
 from services.auth import AbstractAsyncAuthService
 from services.auth import get_auth_service
 
@@ -56,3 +57,20 @@ async def validate_token(access_token: str,
     logger.info('Request user validate token with access token [%s]', access_token)
     token_detail = await auth_service.check_token(access_token, 'access')
     return {"user_id": token_detail.get("user_id")}
+
+
+@router.post('/validate_tokens', response_model=TokensValidation,
+             status_code=status.HTTP_200_OK,
+             description="Пакетная валидация access токенов, "
+                         "результаты в порядке запроса",
+             tags=["Авторизация"])
+async def validate_tokens(body: ValidateTokens,
+                          auth_service: AbstractAsyncAuthService = Depends(
+                              get_auth_service)) -> TokensValidation:
+    logger.info('Request validate %d access tokens', len(body.access_tokens))
+    payloads = await auth_service.check_tokens(body.access_tokens, 'access')
+    return TokensValidation(results=[
+        TokenValidation(valid=True, user_id=payload.get('user_id'))
+        if payload else TokenValidation(valid=False)
+        for payload in payloads
+    ])
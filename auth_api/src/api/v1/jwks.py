@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Response
+
+from core.config import settings
+from services.keys import keys
+
+router = APIRouter()
+
+
+@router.get('/.well-known/jwks.json',
+            description="Открытые ключи для проверки подписи токенов",
+            tags=["Авторизация"])
+async def jwks() -> Response:
+    return Response(
+        content=keys.jwks,
+        media_type='application/json',
+        headers={'Cache-Control':
+                 f'public, max-age={settings.jwks_cache_seconds}'},
+    )
@@ -5,10 +5,9 @@ from typing import List
 from fastapi import APIRouter, Depends, HTTPException
 
 from core.config import settings
-from models.base import User
 from schemas.base import Roles
-from services.auth import get_current_user
-from services.roles import role_services, RolesService, check_admin_permission
+from services.auth import get_token_payload
+from services.roles import role_services, RolesService, require_admin
 
 router = APIRouter()
 
@@ -21,14 +20,14 @@ logger = logging.getLogger(f'{settings.app_name}.{__name__}')
     status_code=HTTPStatus.CREATED,
     summary="Создать роль",
     tags=["Роли"],
+    dependencies=[Depends(require_admin)],
 )
-@check_admin_permission
 async def create_role(
         role: Roles,
         role_service: RolesService = Depends(role_services),
-        user: User = Depends(get_current_user),
+        payload: dict = Depends(get_token_payload),
 ):
-    logger.info(f"Creating role: {role} by {user.email}")
+    logger.info(f"Creating role: {role} by {payload['email']}")
     
     role = await role_service.create_role(
         name=role.name,
@@ -53,16 +52,16 @@ async def create_role(
     status_code=HTTPStatus.ACCEPTED,
     summary="Изменить роль",
     tags=["Роли"],
+    dependencies=[Depends(require_admin)],
 )
-@check_admin_permission
 async def change_role(
         name: str,
         new_name: str,
         new_description: str,
         role_service: RolesService = Depends(role_services),
-        user: User = Depends(get_current_user),
+        payload: dict = Depends(get_token_payload),
 ):
-    logger.info(f"Change role {name} by {user.email}")
+    logger.info(f"Change role {name} by {payload['email']}")
     
     role = await role_service.change_role(
         name=name,
@@ -88,13 +87,11 @@ async def change_role(
     status_code=HTTPStatus.ACCEPTED,
     summary="Получить роли",
     tags=["Роли"],
+    dependencies=[Depends(require_admin)],
 )
-@check_admin_permission
 async def get_roles(
         role_service: RolesService = Depends(role_services),
-        user: User = Depends(get_current_user),
 ):
-    await role_service.check_permission(user, 'admin')
     result = await role_service.get_roles()
     if not result:
         raise HTTPException(
@@ -109,14 +106,12 @@ async def get_roles(
     status_code=HTTPStatus.ACCEPTED,
     summary="Удалить роль",
     tags=["Роли"],
+    dependencies=[Depends(require_admin)],
 )
-@check_admin_permission
 async def delete_role(
         name: str,
         role_service: RolesService = Depends(role_services),
-        user: User = Depends(get_current_user),
 ):
-    await role_service.check_permission(user, 'admin')
     role = await role_service.delete_role(
         name=name,
     )
@@ -139,15 +134,13 @@ async def delete_role(
     status_code=HTTPStatus.ACCEPTED,
     summary="Назначить роль пользователю",
     tags=["Роли"],
+    dependencies=[Depends(require_admin)],
 )
-@check_admin_permission
 async def set_role_to_user(
         email: str,
         role_name: str,
         role_service: RolesService = Depends(role_services),
-        user: User = Depends(get_current_user),
 ):
-    await role_service.check_permission(user, 'admin')
     role = await role_service.set_role_to_user(
         email=email,
         role_name=role_name,
@@ -176,15 +169,13 @@ async def set_role_to_user(
     status_code=HTTPStatus.ACCEPTED,
     summary="Удалить роль у пользователя",
     tags=["Роли"],
+    dependencies=[Depends(require_admin)],
 )
-@check_admin_permission
 async def delete_role_from_user(
         email: str,
         role_name: str,
         role_service: RolesService = Depends(role_services),
-        user: User = Depends(get_current_user),
 ):
-    await role_service.check_permission(user, 'admin')
     role = await role_service.delete_role_to_user(
         email=email,
         role_name=role_name,
@@ -216,9 +207,9 @@ async def delete_role_from_user(
 )
 async def get_my_roles(
         role_service: RolesService = Depends(role_services),
-        user: User = Depends(get_current_user),
+        payload: dict = Depends(get_token_payload),
 ):
-    result = await role_service.get_user_roles(user)
+    result = await role_service.get_user_roles(payload['user_id'])
     if not result:
         raise HTTPException(
             status_code=HTTPStatus.BAD_GATEWAY,
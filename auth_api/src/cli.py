@@ -4,7 +4,9 @@ import logging
 import typer
 from fastapi import HTTPException
 from pydantic.error_wrappers import ValidationError
-from redis.client import Redis
+from redis.asyncio import Redis
+
+from core.config import settings
 from db.postgres import DbService, async_session
 from schemas.base import SignUpUser
 from services.auth import AuthService
@@ -25,8 +27,10 @@ async def main():
 
             async with async_session() as session:
                 ds = DbService(db=session)
-                auth_serv = AuthService(ds, Redis())
-                role_serv = RolesService(ds)
+                redis = Redis(host=settings.redis_host,
+                              port=settings.redis_port)
+                auth_serv = AuthService(ds, redis)
+                role_serv = RolesService(ds, redis)
                 await role_serv.create_role('admin', 'admin role')
                 await auth_serv.create_user(admin)
                 await role_serv.set_role_to_user(admin.email, 'admin')
@@ -40,11 +40,30 @@ class Settings(BaseSettings):
     postgres_port: int = 5432
     postgres_db: str = 'auth_db'
     db_echo: bool = False
+    # DSN реплик для чтения через запятую, пусто - только основная база
+    db_replica_dsns: str = ''
+    db_replica_max_lag_seconds: float = 5.0
+    db_replica_check_interval: float = 5.0
 
-    JWT_SECRET_KEY: str
     REFRESH_TOKEN_EXPIRES_IN: int = 60
     ACCESS_TOKEN_EXPIRES_IN: int = 10
-    JWT_ALGORITHM: str = 'HS256'
+    # Ключи подписи токенов, см. services/keys.py
+    jwt_keys_dir: str = 'keys'
+    jwt_active_kid: str | None = None
+    jwks_cache_seconds: int = 300
+    deny_list_key: str = 'auth:deny_list'
+    deny_list_channel: str = 'auth:deny_list:events'
+    # Время выхода со всех устройств: sorted set user_id -> timestamp,
+    # токены, выданные раньше, недействительны
+    revoked_before_key: str = 'auth:revoked_before'
+    revoked_before_channel: str = 'auth:revoked_before:events'
+    # Счетчик версии ролей пользователя, см. RolesService.check_permission
+    role_version_key_prefix: str = 'auth:role_version:'
+    # Максимум токенов в одном запросе validate_tokens
+    validate_tokens_max_batch: int = 1000
+    # Процессов для хэширования паролей, по умолчанию - по числу ядер
+    password_hash_workers: int | None = None
+    password_hash_max_pending: int = 256
 
     @property
     def dsl_database(self) -> str:
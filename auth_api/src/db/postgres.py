@@ -1,10 +1,11 @@
-from typing import Union
+from typing import Any, Callable, Union
 
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, \
     async_sessionmaker
 from sqlalchemy.sql import select, update, delete
 from core.config import settings
 from db.base import AsyncDbServiceBase
+from db.replica import ReplicaPool, replicas as default_replicas
 from models.base import Base
 
 dsn = (f'postgresql+asyncpg://{settings.postgres_user}:{settings.postgres_password}@'
@@ -20,8 +21,13 @@ async def get_session() -> AsyncSession:
 
 
 class DbService(AsyncDbServiceBase):
-    def __init__(self, db: AsyncSession) -> None:
+    def __init__(self, db: AsyncSession,
+                 replicas: ReplicaPool = default_replicas) -> None:
         self.db = db
+        self.replicas = replicas
+        # После первой записи чтения этого сервиса идут только в основную
+        # базу: реплика может еще не получить только что записанное
+        self._wrote = False
 
     @staticmethod
     def _prepare_select_sql_query(
@@ -68,9 +74,27 @@ class DbService(AsyncDbServiceBase):
                 )
         return default_sql
 
+    async def _commit(self) -> None:
+        self._wrote = True
+        await self.db.commit()
+
+    async def _read(self, sql, consume: Callable[[Any], Any],
+                    primary: bool = False) -> Any:
+        if primary or self._wrote:
+            return consume(await self.db.execute(sql))
+        return await self.replicas.read(sql, consume, self.db)
+
+    async def read(self, sql, primary: bool = False) -> list:
+        """
+        Выполняет запрос только на чтение и возвращает строки результата.
+        Запрос уходит на реплику, если она есть и не отстала; primary=True
+        - для чтений, которым нужны только что записанные данные.
+        """
+        return await self._read(sql, lambda result: result.all(), primary)
+
     async def insert_data(self, data) -> None:
         self.db.add(data)
-        await self.db.commit()
+        await self._commit()
         await self.db.refresh(data)
 
     async def select(
@@ -79,15 +103,19 @@ class DbService(AsyncDbServiceBase):
             where_select=None,
             order_select=None,
             join_with=None,
+            primary: bool = False,
     ):
+        """
+        Как и read, читает с реплики, если не указано primary=True.
+        """
         sql = self._prepare_select_sql_query(
             what_select=what_select,
             where_select=where_select,
             order_select=order_select,
             join_with=join_with,
         )
-        data = await self.db.execute(sql)
-        return list(data.scalars())
+        return await self._read(sql, lambda result: list(result.scalars()),
+                                primary)
 
     async def update(
             self,
@@ -101,7 +129,7 @@ class DbService(AsyncDbServiceBase):
             where_update=where_update,
         )
         await self.db.execute(sql)
-        await self.db.commit()
+        await self._commit()
 
     async def insert(
             self,
@@ -110,7 +138,7 @@ class DbService(AsyncDbServiceBase):
     ):
         new_object = what_insert(**values_insert)
         self.db.add(new_object)
-        await self.db.commit()
+        await self._commit()
         return new_object
 
     async def delete(
@@ -123,4 +151,4 @@ class DbService(AsyncDbServiceBase):
             where_delete=where_delete,
         )
         await self.db.execute(sql)
-        await self.db.commit()
+        await self._commit()
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Union
+
+from sqlalchemy import text
+from sqlalchemy.exc import DataError, DBAPIError, ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, \
+    async_sessionmaker, create_async_engine
+
+from core.config import settings
+
+logger = logging.getLogger('auth_api')
+
+# На самой реплике: принимает ли она WAL от основной базы и отставание -
+# 0, если все полученные WAL уже применены, иначе время с последней
+# примененной транзакции. Без потока WAL отставание тоже 0, поэтому
+# важен streaming. Статус WAL receiver видят только роли
+# с pg_read_all_stats: без нее реплика всегда считается неисправной
+LAG_SQL = text("""
+    SELECT
+        COALESCE((SELECT status = 'streaming' FROM pg_stat_wal_receiver),
+                 false),
+        CASE
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM
+                          now() - pg_last_xact_replay_timestamp()), 0)
+        END
+""")
+
+
+class Replica:
+    def __init__(self, name: str, engine: AsyncEngine) -> None:
+        self.name = name
+        self.engine = engine
+        self.session = async_sessionmaker(engine, expire_on_commit=False)
+        self.healthy = False
+        self.streaming = False
+        self.lag: Union[None, float] = None
+
+
+class ReplicaPool:
+    """
+    Реплики для чтения.
+
+    Отставание каждой реплики проверяется в фоне не чаще раза
+    в check_interval секунд. Реплика отдается под чтение, только если
+    проверка прошла, реплика принимает поток WAL и отставание не больше
+    max_lag. Пока ни одной
+    такой реплики нет (в том числе до первой проверки), чтение идет
+    в основную базу. Ошибка соединения с репликой выводит ее из работы
+    до следующей успешной проверки, а запрос повторяется в основной базе.
+    """
+
+    def __init__(
+            self,
+            dsns: list[str],
+            max_lag: float = settings.db_replica_max_lag_seconds,
+            check_interval: float = settings.db_replica_check_interval,
+    ) -> None:
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.replicas = []
+        for number, dsn in enumerate(dsns):
+            name = f'replica{number}'
+            engine = create_async_engine(dsn, echo=settings.db_echo,
+                                         future=True)
+            self.replicas.append(Replica(name, engine))
+        self._next = 0
+        self._checked_at = 0.0
+        self._check_task: Union[None, asyncio.Task] = None
+
+    async def check(self) -> None:
+        for replica in self.replicas:
+            try:
+                async with replica.session() as session:
+                    streaming, lag = (await session.execute(LAG_SQL)).one()
+                replica.streaming = streaming
+                replica.lag = float(lag)
+                healthy = streaming and replica.lag <= self.max_lag
+            except Exception as err:
+                logger.error('Replica %s check failed: %r', replica.name, err)
+                replica.streaming = False
+                replica.lag = None
+                healthy = False
+            if healthy != replica.healthy:
+                logger.warning('Replica %s is %s, streaming %s, lag %s',
+                               replica.name,
+                               'healthy' if healthy else 'unhealthy',
+                               replica.streaming, replica.lag)
+            replica.healthy = healthy
+
+    def _schedule_check(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        if self._check_task is not None and not self._check_task.done():
+            return
+        self._checked_at = now
+        self._check_task = asyncio.create_task(self.check())
+
+    def choose(self) -> Union[None, Replica]:
+        if not self.replicas:
+            return None
+        self._schedule_check()
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        self._next = (self._next + 1) % len(healthy)
+        return healthy[self._next]
+
+    def mark_failed(self, replica: Replica, err: Exception) -> None:
+        logger.error('Replica %s failed, reading from primary: %r',
+                     replica.name, err)
+        replica.healthy = False
+
+    async def read(self, sql, consume: Callable[[Any], Any],
+                   primary: AsyncSession) -> Any:
+        """
+        Выполняет чтение на реплике, а если подходящей нет или она
+        ответила ошибкой соединения - в сессии основной базы primary.
+        consume забирает строки из результата, пока сессия открыта.
+        """
+        replica = self.choose()
+        if replica is not None:
+            try:
+                async with replica.session() as session:
+                    return consume(await session.execute(sql))
+            except (DBAPIError, OSError) as err:
+                # Ошибка в самом запросе повторится и в основной базе
+                if isinstance(err, (DataError, ProgrammingError)):
+                    raise
+                self.mark_failed(replica, err)
+        return consume(await primary.execute(sql))
+
+    async def dispose(self) -> None:
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    def status(self) -> dict:
+        return {
+            replica.name: {
+                'healthy': replica.healthy,
+                'streaming': replica.streaming,
+                'lag': replica.lag,
+            }
+            for replica in self.replicas
+        }
+
+
+replicas = ReplicaPool([
+    dsn.strip() for dsn in settings.db_replica_dsns.split(',') if dsn.strip()
+])
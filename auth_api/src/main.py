@@ -12,11 +12,14 @@ from redis.asyncio import Redis
 from starlette.middleware.sessions import SessionMiddleware
 import sentry_sdk
 
-from api.v1 import auth, roles, account, oauth
+from api.v1 import auth, roles, account, oauth, jwks
 from core.config import settings
 from core.jaeger import configure_tracer
 from core.logger import LoggerSetup
 from db import redis
+from db.replica import replicas
+from services.keys import keys
+from services.passwords import password_hasher
 
 logging_setup = LoggerSetup()
 logger = logging.getLogger('auth_api')
@@ -35,9 +38,13 @@ async def lifespan(app: FastAPI):
         port=settings.redis_port,
     )
     await FastAPILimiter.init(redis.redis)
+    keys.load()
+    password_hasher.start()
     
     yield
+    password_hasher.stop()
     await redis.redis.close()
+    await replicas.dispose()
 
 
 dependencies = []
@@ -63,6 +70,8 @@ app.include_router(oauth.router, prefix='/api/v1/oauth')
 app.include_router(auth.router, prefix='/api/v1/auth')
 app.include_router(roles.router, prefix='/api/v1/roles')
 app.include_router(account.router, prefix='/api/v1/account')
+# Без префикса: стандартный адрес, по которому сервисы забирают ключи
+app.include_router(jwks.router)
 
 app.add_middleware(SessionMiddleware, secret_key=settings.session_secret_key)
 app.add_middleware(asgi_correlation_id.CorrelationIdMiddleware)
@@ -0,0 +1,36 @@
+"""token pair active user index
+
+Revision ID: b4e6d2a9c173
+Revises: f88885364854
+Create Date: 2026-10-18 21:07:12.408315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4e6d2a9c173'
+down_revision = 'f88885364854'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_token_pair_active_user_id',
+            'token_pair',
+            ['user_id'],
+            postgresql_where=sa.text('logout_at IS NULL'),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_token_pair_active_user_id',
+            table_name='token_pair',
+            postgresql_concurrently=True,
+        )
@@ -2,10 +2,9 @@ import uuid
 from datetime import datetime
 from typing import Any, Union
 
-from sqlalchemy import Column, ForeignKey, DateTime, String
+from sqlalchemy import Column, ForeignKey, DateTime, Index, String, text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import declarative_base
-from werkzeug.security import check_password_hash, generate_password_hash
 
 Base: Any = declarative_base()
 
@@ -33,21 +32,24 @@ class User(UUidMixin, TimestampMixin, Base):
     def __init__(self, login: str, email: str, password: str,
                  first_name: Union[str, None] = None,
                  last_name: Union[str, None] = None) -> None:
+        # password - уже посчитанный хэш, см. services/passwords.py
         self.login = login
         self.email = email
-        self.password = generate_password_hash(password)
+        self.password = password
         self.first_name = first_name
         self.last_name = last_name
 
-    def check_password(self, password: str) -> bool:
-        return check_password_hash(self.password, password)
-
     def __repr__(self) -> str:
         return f'<User {self.login}>'
 
 
 class TokenPair(UUidMixin, TimestampMixin, Base):
     __tablename__ = 'token_pair'
+    # Закрытие всех сессий пользователя при выходе со всех устройств
+    __table_args__ = (
+        Index('ix_token_pair_active_user_id', 'user_id',
+              postgresql_where=text('logout_at IS NULL')),
+    )
 
     user_id = Column(UUID(as_uuid=True), nullable=False)
     jti = Column(UUID(as_uuid=True), nullable=False)
@@ -2,7 +2,9 @@ from datetime import datetime
 from typing import Union
 from uuid import UUID
 
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
+
+from core.config import settings
 
 
 class SignInUser(BaseModel):
@@ -49,6 +51,20 @@ class RefreshToken(BaseModel):
     refresh_token: str
 
 
+class ValidateTokens(BaseModel):
+    access_tokens: list[str] = Field(
+        min_length=1, max_length=settings.validate_tokens_max_batch)
+
+
+class TokenValidation(BaseModel):
+    valid: bool
+    user_id: Union[str, None] = None
+
+
+class TokensValidation(BaseModel):
+    results: list[TokenValidation]
+
+
 class ChangeLogin(BaseModel):
     new_login: str
 
@@ -7,7 +7,6 @@ from fastapi import Depends, HTTPException
 from redis.client import Redis
 from sqlalchemy import select, and_, update, desc
 from sqlalchemy.ext.asyncio import AsyncSession
-from werkzeug.security import generate_password_hash
 
 from core.config import settings
 from db.postgres import get_session, DbService
@@ -15,6 +14,7 @@ from db.redis import get_redis
 from models.base import TokenPair, User
 from schemas.base import Session, ChangeLogin, ChangePassword
 from services.auth import AuthService
+from services.passwords import password_hasher
 
 logger = logging.getLogger(f'{settings.app_name}.{__name__}')
 
@@ -63,19 +63,7 @@ class AccountService(AbstractAccountService):
         offset = (page - 1) * page_size
         sql = select(TokenPair).filter_by(user_id=user_id).offset(
             offset).limit(page_size).order_by(desc(TokenPair.created_at))
-        result = await self.db_service.db.execute(sql)
-        return result.all()
-    
-    async def get_active_token_pairs(self, user_id: str):
-        """
-        Получение активных пар токенов пользователя.
-
-        :param user_id: Идентификатор пользователя.
-        :return: Список активных пар токенов пользователя.
-        """
-        sql = select(TokenPair).filter_by(user_id=user_id, logout_at=None)
-        result = await self.db_service.db.execute(sql)
-        return result.all()
+        return await self.db_service.read(sql)
     
     async def update_active_token_pairs_as_logout(self, user_id: str):
         """
@@ -101,7 +89,7 @@ class AccountService(AbstractAccountService):
         :param page: Номер страницы (пагинация).
         :return: Список сессий пользователя с учетом пагинации.
         """
-        token_pairs = await self.get_token_pairs_with_pagination(User.id, page)
+        token_pairs = await self.get_token_pairs_with_pagination(user.id, page)
         logger.debug('Got taken pairs [%s]', token_pairs)
         history = []
         for token_pair_data in token_pairs:
@@ -140,13 +128,14 @@ class AccountService(AbstractAccountService):
         """
         Разлогинивание пользователя со всех устройств.
 
+        Токены отзываются одной записью времени отзыва в Redis,
+        сессии закрываются одним UPDATE - независимо от их числа.
+
         :param user: Пользователь, который выходит из всех аккаунтов
         """
         logger.info('Request to logout with all devices for user [%s]', user.email)
-        for token_pair_data in await self.get_active_token_pairs(user.id):
-            token_pair: TokenPair = token_pair_data[0]
-            await self.set_jti_in_deny_list(token_pair.jti)
-            await self.update_active_token_pairs_as_logout(user.id)
+        await self.set_user_revoked_before(user.id)
+        await self.update_active_token_pairs_as_logout(user.id)
     
     async def change_login(self, user: User,
                            change_login_data: ChangeLogin) -> User:
@@ -170,7 +159,8 @@ class AccountService(AbstractAccountService):
         :param change_password_data: Данные для смены пароля.
         :return: True, если операция успешна.
         """
-        hash_password = generate_password_hash(change_password_data.new_password)
+        hash_password = await password_hasher.hash(
+            change_password_data.new_password)
         await self.db_service.update(
             User,
             {'password': hash_password},
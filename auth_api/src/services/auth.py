@@ -7,7 +7,7 @@ from typing import Union
 
 from fastapi import Depends, status, HTTPException, Request
 from fastapi.security import OAuth2PasswordBearer
-from jose import jwt, JWTError
+from jose import JWTError
 from redis.asyncio import Redis
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -17,6 +17,8 @@ from db.postgres import get_session, DbService
 from db.redis import get_redis
 from models.base import TokenPair, User
 from schemas.base import SignUpUser, Tokens, RefreshToken, SignInUser, SignInUserResponse
+from services.keys import keys
+from services.passwords import password_hasher
 
 
 
@@ -41,6 +43,11 @@ class AbstractAsyncAuthService(abc.ABC):
     async def check_token(self, token: str, token_type: str) -> dict:
         pass
 
+    @abc.abstractmethod
+    async def check_tokens(self, tokens: list[str],
+                           token_type: str) -> list[Union[dict, None]]:
+        pass
+
 
 class AuthService(AbstractAsyncAuthService):
     def __init__(self, db_service: DbService, redis: Redis) -> None:
@@ -48,17 +55,21 @@ class AuthService(AbstractAsyncAuthService):
         self.redis = redis
     
     async def create_user(self, signup_user: SignUpUser) -> User:
+        user_data = signup_user.dict()
+        user_data['password'] = await password_hasher.hash(
+            signup_user.password)
         try:
-            return await self.db_service.insert(User,
-                                                signup_user.dict())
+            return await self.db_service.insert(User, user_data)
         except IntegrityError:
             logger.error('User already exists with data %s', signup_user.dict())
             raise HTTPException(status.HTTP_409_CONFLICT,
                                 'User with login or email already exists.')
     
-    async def get_db_user_by_email(self, email: str) -> User:
+    async def get_db_user_by_email(self, email: str,
+                                   primary: bool = False) -> User:
         result = await self.db_service.select(User,
-                                              [(User.email, email)])
+                                              [(User.email, email)],
+                                              primary=primary)
         if not result:
             logger.error('User does not exist with email %s', email)
             raise HTTPException(status.HTTP_401_UNAUTHORIZED,
@@ -79,8 +90,11 @@ class AuthService(AbstractAsyncAuthService):
 
         from services.roles import RolesService
 
-        user: User = await self.get_db_user_by_email(form_data.username)
-        if not user.check_password(form_data.password):
+        # Вход сразу после регистрации не должен зависеть от отставания реплики
+        user: User = await self.get_db_user_by_email(form_data.username,
+                                                     primary=True)
+        if not await password_hasher.verify(user.password,
+                                            form_data.password):
             logger.error('Invalid user password %s', form_data.password)
             raise HTTPException(status.HTTP_401_UNAUTHORIZED,
                                 "Login or Password not valid.")
@@ -90,8 +104,11 @@ class AuthService(AbstractAsyncAuthService):
             logging.error('User agent is undefined [%s]', request)
             raise HTTPException(status.HTTP_400_BAD_REQUEST, 'User agent is undefined.')
 
-        tokens = await self.create_new_tokens(user, user_agent)
-        roles = await RolesService(db_service=self.db_service).get_user_roles(user)
+        roles_claims = await RolesService(
+            db_service=self.db_service, redis=self.redis,
+        ).get_roles_claims(user.id)
+        tokens = await self.create_new_tokens(user, user_agent, roles_claims)
+        roles = roles_claims['roles']
 
         return SignInUserResponse(
             access_token=tokens.access_token,
@@ -108,15 +125,25 @@ class AuthService(AbstractAsyncAuthService):
         to_encode = data.copy()
         expires_delta = timedelta(minutes=expires_min)
         expire = datetime.now(timezone.utc) + expires_delta
+        # iat дробный: выход со всех устройств и новый вход
+        # могут прийтись на одну секунду
         to_encode.update(
-            {'jti': str(jti), 'exp': expire, 'token_type': token_type})
-        encoded_jwt = jwt.encode(to_encode, settings.JWT_SECRET_KEY,
-                                 algorithm=settings.JWT_ALGORITHM)
-        return encoded_jwt
+            {'jti': str(jti), 'exp': expire, 'token_type': token_type,
+             'iat': datetime.now(timezone.utc).timestamp()})
+        return keys.sign(to_encode)
     
-    async def create_access_token(self, user: User, jti: uuid.UUID) -> str:
+    async def create_access_token(
+            self, user: User, jti: uuid.UUID,
+            roles_claims: Union[dict, None] = None,
+    ) -> str:
+        from services.roles import RolesService
+
+        if roles_claims is None:
+            roles_claims = await RolesService(
+                db_service=self.db_service, redis=self.redis,
+            ).get_roles_claims(user.id)
         user_id = str(user.id)
-        token_data = {'user_id': user_id, 'email': user.email}
+        token_data = {'user_id': user_id, 'email': user.email, **roles_claims}
         return self.create_token('access', token_data,
                                  settings.ACCESS_TOKEN_EXPIRES_IN, jti)
     
@@ -126,16 +153,22 @@ class AuthService(AbstractAsyncAuthService):
         return self.create_token('refresh', token_data,
                                  settings.REFRESH_TOKEN_EXPIRES_IN, jti)
     
-    async def create_tokens(self, user: User) -> tuple[Tokens, uuid.UUID]:
+    async def create_tokens(
+            self, user: User, roles_claims: Union[dict, None] = None,
+    ) -> tuple[Tokens, uuid.UUID]:
         jti = uuid.uuid4()
         tokens = Tokens(
             refresh_token=await self.create_refresh_token(user, jti),
-            access_token=await self.create_access_token(user, jti),
+            access_token=await self.create_access_token(user, jti,
+                                                        roles_claims),
         )
         return tokens, jti
     
-    async def create_new_tokens(self, user: User, user_agent: Union[str, None]) -> Tokens:
-        tokens_data = await self.create_tokens(user)
+    async def create_new_tokens(
+            self, user: User, user_agent: Union[str, None],
+            roles_claims: Union[dict, None] = None,
+    ) -> Tokens:
+        tokens_data = await self.create_tokens(user, roles_claims)
         tokens = tokens_data[0]
         await self.create_db_token_pair(user.id, tokens_data[1], user_agent)
         return tokens
@@ -159,18 +192,57 @@ class AuthService(AbstractAsyncAuthService):
         """
         Установка токена доступа как разлогиненного.
 
+        Кроме ключа jti токен попадает в sorted set (score - время
+        истечения) и публикуется в канал: по ним сервисы держат копию
+        списка в памяти, не обращаясь в Redis на каждый запрос.
+
         :param jti: id токенов.
         """
         logger.debug('Setting jti [%s] in deny list', str(jti))
-        await self.redis.set(str(jti), 'logout')
         expire_in = settings.REFRESH_TOKEN_EXPIRES_IN * 60
         logger.debug('Setting jti [%s] expire in [%s]', str(jti), expire_in)
-        await self.redis.expire(str(jti), expire_in)
+        now = datetime.now(timezone.utc).timestamp()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(str(jti), 'logout', ex=expire_in)
+            pipe.zadd(settings.deny_list_key, {str(jti): now + expire_in})
+            pipe.zremrangebyscore(settings.deny_list_key, '-inf', now)
+            pipe.publish(settings.deny_list_channel, str(jti))
+            await pipe.execute()
     
-    async def is_token_in_deny_list(self, jti: uuid.UUID) -> bool:
-        return bool(
-            await self.redis.exists(str(jti))
-        )
+    async def set_user_revoked_before(self, user_id: str) -> None:
+        """
+        Отзыв всех токенов пользователя, выданных до текущего момента.
+
+        Одна запись в sorted set вместо ключа на каждый jti. Запись
+        старше срока жизни refresh-токена уже ничего не отзывает
+        и удаляется.
+        """
+        now = datetime.now(timezone.utc).timestamp()
+        logger.debug('Revoking tokens of user [%s] issued before %s',
+                     user_id, now)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(settings.revoked_before_key, {str(user_id): now},
+                      gt=True)
+            pipe.zremrangebyscore(settings.revoked_before_key, '-inf',
+                                  now - settings.REFRESH_TOKEN_EXPIRES_IN * 60)
+            pipe.publish(settings.revoked_before_channel, f'{user_id} {now}')
+            await pipe.execute()
+
+    @staticmethod
+    def is_issued_before(payload: dict,
+                         revoked_before: Union[float, None]) -> bool:
+        # Токены без iat выданы до появления отзыва по времени
+        if revoked_before is None:
+            return False
+        return payload.get('iat', 0) < revoked_before
+
+    async def is_token_revoked(self, payload: dict) -> bool:
+        """Проверка jti и времени отзыва за один запрос в Redis."""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.exists(str(payload['jti']))
+            pipe.zscore(settings.revoked_before_key, str(payload['user_id']))
+            denied, revoked_before = await pipe.execute()
+        return bool(denied) or self.is_issued_before(payload, revoked_before)
     
     async def check_token(self, token: str, token_type: str) -> dict:
         """
@@ -183,26 +255,69 @@ class AuthService(AbstractAsyncAuthService):
         """
         error = HTTPException(status.HTTP_401_UNAUTHORIZED,
                               f'{token_type} not valid')
+        payload = self.decode_token(token, token_type)
+        if payload is None:
+            raise error
+        
+        if await self.is_token_revoked(payload):
+            logger.info('JWT token with %s is revoked', payload['jti'])
+            raise error
         
+        return payload
+
+    @staticmethod
+    def decode_token(token: str, token_type: str) -> Union[dict, None]:
+        """Проверка подписи, срока и типа токена без обращения в Redis."""
         try:
-            payload = jwt.decode(token, settings.JWT_SECRET_KEY,
-                                 algorithms=[settings.JWT_ALGORITHM])
+            payload = keys.verify(token)
             logger.debug('JWT decoded - %s', payload)
         except JWTError:
             logger.error('JWT error - %s [%s]', token, token_type)
-            raise error
-        
-        if payload['token_type'] != token_type:
-            logger.error('JWT error - token_type [%s] != [%s]', payload['token_type'], token_type)
-            raise error
-        
-        jti = payload['jti']
-        if await self.is_token_in_deny_list(jti):
-            logger.info('JWT token with %s exists in deny list', jti)
-            raise error
+            return None
         
+        if payload.get('token_type') != token_type:
+            logger.error('JWT error - token_type [%s] != [%s]',
+                         payload.get('token_type'), token_type)
+            return None
         return payload
 
+    async def check_tokens(self, tokens: list[str],
+                           token_type: str) -> list[Union[dict, None]]:
+        """
+        Пакетная проверка токенов.
+
+        Все токены декодируются локально, затем jti всех годных токенов
+        проверяются в deny list одним MGET, а время отзыва их владельцев -
+        одним ZMSCORE: один запрос в Redis на пакет вместо запросов
+        на каждый токен.
+
+        Returns:
+            - payload или None для каждого токена, в порядке tokens
+        """
+        payloads = [self.decode_token(token, token_type) for token in tokens]
+        jtis = list({str(payload['jti']) for payload in payloads if payload})
+        user_ids = list({str(payload['user_id'])
+                         for payload in payloads if payload})
+        denied = set()
+        revoked_before = {}
+        if jtis:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.mget(jtis)
+                pipe.zmscore(settings.revoked_before_key, user_ids)
+                values, scores = await pipe.execute()
+            denied = {jti for jti, value in zip(jtis, values)
+                      if value is not None}
+            revoked_before = dict(zip(user_ids, scores))
+        results = []
+        for payload in payloads:
+            if payload:
+                user_revoked_before = revoked_before.get(str(payload['user_id']))
+                if str(payload['jti']) in denied or self.is_issued_before(payload, user_revoked_before):
+                    logger.info('JWT token with %s is revoked', payload['jti'])
+                    payload = None
+            results.append(payload)
+        return results
+
 
 @lru_cache()
 def get_auth_service(
@@ -218,9 +333,15 @@ def get_auth_service(
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/signin")
 
 
-async def get_current_user(
+async def get_token_payload(
         auth_service: AuthService = Depends(get_auth_service),
         token=Depends(oauth2_scheme),
+) -> dict:
+    return await auth_service.check_token(token, 'access')
+
+
+async def get_current_user(
+        auth_service: AuthService = Depends(get_auth_service),
+        payload: dict = Depends(get_token_payload),
 ) -> User:
-    payload = await auth_service.check_token(token, 'access')
     return await auth_service.get_db_user_by_email(payload['email'])
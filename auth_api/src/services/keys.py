@@ -0,0 +1,101 @@
+import json
+import logging
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Union
+
+import rsa
+from jose import jwk, jwt, JWTError
+from jose.backends.base import Key
+
+from core.config import settings
+
+logger = logging.getLogger('auth_api.services.keys')
+
+
+class KeyStore:
+    """
+    Ключи подписи JWT (RS256): файлы <kid>.pem в keys_dir.
+
+    Токены подписываются ключом active_kid, в заголовке токена
+    передается его kid; если ключей больше одного, active_kid
+    (AUTH_API_JWT_ACTIVE_KID) обязателен. В JWKS публикуются открытые
+    части всех ключей каталога. Смена ключа: положить новый файл
+    и перезапустить auth_api с прежним jwt_active_kid - ключ попадет
+    в JWKS; когда истечет время кэширования JWKS у потребителей,
+    указать новый ключ в jwt_active_kid auth_api; старый файл удалить,
+    когда истекут подписанные им refresh-токены.
+    """
+
+    algorithm = 'RS256'
+
+    def __init__(
+            self,
+            keys_dir: str = settings.jwt_keys_dir,
+            active_kid: Union[None, str] = settings.jwt_active_kid,
+    ) -> None:
+        self.keys_dir = Path(keys_dir)
+        self.active_kid = active_kid
+        self._private: dict[str, Key] = {}
+        self._public: dict[str, Key] = {}
+        self.jwks = b''
+
+    def _generate(self) -> None:
+        # Для локального запуска: в окружениях с несколькими
+        # экземплярами ключи кладутся в каталог заранее
+        kid = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
+        logger.warning('No JWT keys in %s, generating key %s',
+                       self.keys_dir, kid)
+        _, private_key = rsa.newkeys(2048)
+        self.keys_dir.mkdir(parents=True, exist_ok=True)
+        path = self.keys_dir / f'{kid}.pem'
+        path.write_bytes(private_key.save_pkcs1())
+        path.chmod(0o600)
+
+    def load(self) -> None:
+        if not sorted(self.keys_dir.glob('*.pem')):
+            self._generate()
+        paths = sorted(self.keys_dir.glob('*.pem'))
+        self._private = {
+            path.stem: jwk.construct(path.read_text(), self.algorithm)
+            for path in paths
+        }
+        self._public = {
+            kid: key.public_key() for kid, key in self._private.items()
+        }
+        if self.active_kid is None:
+            # Новый ключ не должен начать подписывать токены раньше,
+            # чем потребители получат его из JWKS
+            if len(paths) > 1:
+                raise RuntimeError(f'Several JWT keys in {self.keys_dir}, '
+                                   'set jwt_active_kid')
+            self.active_kid = paths[0].stem
+        if self.active_kid not in self._private:
+            raise RuntimeError(f'JWT key {self.active_kid} not found '
+                               f'in {self.keys_dir}')
+        self.jwks = json.dumps({'keys': [
+            {**key.to_dict(), 'kid': kid, 'use': 'sig'}
+            for kid, key in self._public.items()
+        ]}).encode()
+        logger.info('JWT keys loaded: %s, active %s',
+                    list(self._private), self.active_kid)
+
+    def _ensure_loaded(self) -> None:
+        if not self._private:
+            self.load()
+
+    def sign(self, claims: dict) -> str:
+        self._ensure_loaded()
+        return jwt.encode(claims, self._private[self.active_kid],
+                          algorithm=self.algorithm,
+                          headers={'kid': self.active_kid})
+
+    def verify(self, token: str) -> dict:
+        self._ensure_loaded()
+        key = self._public.get(jwt.get_unverified_header(token).get('kid'))
+        if key is None:
+            raise JWTError('Unknown key id')
+        return jwt.decode(token, key, algorithms=[self.algorithm])
+
+
+keys = KeyStore()
@@ -82,7 +82,7 @@ class SocialAuthService(AuthService):
             last_name=None,
         )
 
-        return await self.db_service.insert(User, signup_user.dict())
+        return await self.create_user(signup_user)
 
     async def create_social_user(
             self,
@@ -92,7 +92,7 @@ class SocialAuthService(AuthService):
     ) -> User:
         if email:
             user_data = await self.db_service.select(
-                User, [(User.email, email)],
+                User, [(User.email, email)], primary=True,
             )
             if not user_data:
                 user = await self.create_empty_user(email)
@@ -133,6 +133,7 @@ class SocialAuthService(AuthService):
             SocialAccount,
             [(SocialAccount.social_id, social_id),
              (SocialAccount.social_name, social_name)],
+            primary=True,
         )
         if not social_user_data:
             user = await self.create_social_user(
@@ -140,7 +141,7 @@ class SocialAuthService(AuthService):
         else:
             social_user: SocialAccount = social_user_data[0]
             user_data = await self.db_service.select(
-                User, [(User.id, social_user.user_id)],
+                User, [(User.id, social_user.user_id)], primary=True,
             )
             user = user_data[0]
 
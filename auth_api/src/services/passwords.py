@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Union
+
+from fastapi import HTTPException, status
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from core.config import settings
+
+logger = logging.getLogger('auth_api.services.passwords')
+
+
+class PasswordHasher:
+    """
+    Хэширование и проверка паролей в пуле процессов.
+
+    PBKDF2 занимает процессор на десятки и сотни миллисекунд, в event
+    loop это останавливает обработку всех остальных запросов. Пул
+    ограничен workers процессами, в очереди к нему - не больше
+    max_pending задач: сверх этого запрос сразу получает 503, а не
+    ждет, пока очередь разойдется.
+    """
+
+    def __init__(
+            self,
+            workers: Union[None, int] = settings.password_hash_workers,
+            max_pending: int = settings.password_hash_max_pending,
+    ) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self._pending = 0
+        self._executor: Union[None, ProcessPoolExecutor] = None
+
+    def start(self) -> None:
+        if self._executor is None:
+            # spawn: дочерние процессы не наследуют потоки и соединения
+            # приложения и импортируют только werkzeug
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+            logger.info('Password hasher started with %s workers',
+                        self.workers)
+
+    def stop(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, func: Callable, *args):
+        if self._pending >= self.max_pending:
+            logger.warning('Password hasher queue is full: %s', self._pending)
+            raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE,
+                                'Service is overloaded, try again later.',
+                                headers={'Retry-After': '1'})
+        self.start()
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, func, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(generate_password_hash, password)
+
+    async def verify(self, password_hash: str, password: str) -> bool:
+        return await self._run(check_password_hash, password_hash, password)
+
+
+password_hasher = PasswordHasher()
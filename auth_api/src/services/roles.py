@@ -1,31 +1,46 @@
 import logging
 from functools import lru_cache
-from functools import wraps
 from http import HTTPStatus
 from typing import List, Optional, Union
 
 from fastapi import Depends, HTTPException
+from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import select, delete
 
 from core.config import settings
 from db.postgres import get_session, DbService
+from db.redis import get_redis
 from models.base import Role, User, UserRole
 from schemas.base import Roles
-from services.auth import get_current_user
+from services.auth import get_token_payload
 from .base import AsyncRolesService
 
 logger = logging.getLogger(f'{settings.app_name}.{__name__}')
 
 
+def role_version_key(user_id) -> str:
+    return f'{settings.role_version_key_prefix}{user_id}'
+
+
 class RolesService(AsyncRolesService):
-    def __init__(self, db_service: DbService) -> None:
+    """
+    Роли пользователя передаются в access-токене (claim roles) вместе
+    с версией ролей на момент выдачи (roles_version). Версия - счетчик
+    в Redis, который увеличивается при каждом изменении ролей
+    пользователя. Проверка прав сравнивает claim и текущую версию;
+    если роли менялись после выдачи токена, роли читаются из БД.
+    """
+
+    def __init__(self, db_service: DbService, redis: Redis) -> None:
         self.db_service = db_service
+        self.redis = redis
     
     async def _check_role_by_name(self, name: str) -> Union[User, None]:
         role_exist = await self.db_service.select(
             what_select=Role,
-            where_select=[(Role.name, name)]
+            where_select=[(Role.name, name)],
+            primary=True,
         )
         if len(role_exist) > 0:
             return role_exist[0]
@@ -34,21 +49,48 @@ class RolesService(AsyncRolesService):
     async def _check_user_by_email(self, email: str) -> Union[User, None]:
         existing_user = await self.db_service.select(
             what_select=User,
-            where_select=[(User.email, email)]
+            where_select=[(User.email, email)],
+            primary=True,
         )
         if len(existing_user) > 0:
             return existing_user[0]
         return None
 
-    async def get_user_roles(self, user: User) -> list:
+    async def get_user_roles(self, user_id, primary: bool = False) -> list:
         user_roles = await self.db_service.select(
             what_select=Role.name,
-            where_select=[(UserRole.user_id, user.id)],
-            join_with=UserRole
+            where_select=[(UserRole.user_id, user_id)],
+            join_with=UserRole,
+            primary=primary,
         )
         logger.debug('Got user roles: %s', user_roles)
         return user_roles
 
+    async def get_roles_version(self, user_id) -> int:
+        return int(await self.redis.get(role_version_key(user_id)) or 0)
+
+    async def bump_roles_version(self, *user_ids) -> None:
+        if not user_ids:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.incr(role_version_key(user_id))
+            await pipe.execute()
+
+    async def get_roles_claims(self, user_id) -> dict:
+        # Версия читается до ролей: изменение между двумя чтениями
+        # увеличит счетчик, и claim будет считаться устаревшим
+        version = await self.get_roles_version(user_id)
+        roles = await self.get_user_roles(user_id, primary=True)
+        return {'roles': roles, 'roles_version': version}
+
+    async def _get_role_user_ids(self, role_id) -> list:
+        return await self.db_service.select(
+            what_select=UserRole.user_id,
+            where_select=[(UserRole.role_id, role_id)],
+            primary=True,
+        )
+
     async def create_role(
             self,
             name: str,
@@ -93,6 +135,9 @@ class RolesService(AsyncRolesService):
                 where_update=[Role.name, name],
                 values_update=values
             )
+            if new_name and new_name != name:
+                await self.bump_roles_version(
+                    *await self._get_role_user_ids(role_exist.id))
         except Exception as err:
             logging.info(
                 'Error updating role [%s] to new name [%s] with description [%s]',
@@ -118,10 +163,12 @@ class RolesService(AsyncRolesService):
             role_exist = await self._check_role_by_name(name=name)
             if role_exist is None:
                 return HTTPStatus.BAD_REQUEST
+            user_ids = await self._get_role_user_ids(role_exist.id)
             await self.db_service.delete(
                 what_delete=Role,
                 where_delete=[(Role.name, name)]
             )
+            await self.bump_roles_version(*user_ids)
             return HTTPStatus.ACCEPTED
         except Exception as err:
             logging.info('Error deleting role [%s]: %s', name)
@@ -165,6 +212,7 @@ class RolesService(AsyncRolesService):
         )
         
         await self.db_service.insert_data(data_insert)
+        await self.bump_roles_version(existing_user.id)
         user_roles = await self.db_service.select(
             what_select=Role,
             where_select=[(UserRole.user_id, existing_user.id)],
@@ -196,39 +244,50 @@ class RolesService(AsyncRolesService):
                 )
             )
             await self.db_service.db.commit()
+            await self.bump_roles_version(existing_user.id)
             return HTTPStatus.OK
         except Exception as err:
             logger.info('Error deleting role [%s] to user [%s]', role_name, email)
             logger.info('Reason: %s', err)
             return None
     
-    async def check_permission(self, user: User, role: str):
-        if role not in await self.get_user_roles(user):
+    async def check_permission(self, payload: dict, role: str):
+        """
+        :param payload: проверенный access-токен, см. get_token_payload.
+        """
+        user_id = payload['user_id']
+        if payload.get('roles_version') == await self.get_roles_version(
+                user_id):
+            roles = payload.get('roles', [])
+        else:
+            logger.debug('Roles claim of user [%s] is stale', user_id)
+            roles = await self.get_user_roles(user_id, primary=True)
+        if role not in roles:
             logger.info(
                 'Role %s does not exist in user [%s] role list',
-                role, user.email
+                role, payload.get('email')
             )
             raise HTTPException(403, 'Вы не являетесь админом.')
 
 
-def check_admin_permission(func):
-    @wraps(func)
-    async def wrapper(
-            *args,
-            user: User = Depends(get_current_user),
-            role_service: RolesService = Depends(role_services),
-            **kwargs):
-        await role_service.check_permission(user, 'admin')
-        return await func(*args, user=user, role_service=role_service,
-                          **kwargs)
-    
-    return wrapper
-
-
 @lru_cache()
 def role_services(
         db: AsyncSession = Depends(get_session),
+        redis: Redis = Depends(get_redis),
 ) -> RolesService:
     return RolesService(
         db_service=DbService(db=db),
+        redis=redis,
     )
+
+
+async def require_admin(
+        role_service: RolesService = Depends(role_services),
+        payload: dict = Depends(get_token_payload),
+) -> dict:
+    """
+    Зависимость для эндпоинтов администратора:
+    dependencies=[Depends(require_admin)].
+    """
+    await role_service.check_permission(payload, 'admin')
+    return payload
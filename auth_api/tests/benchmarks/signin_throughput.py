@@ -0,0 +1,96 @@
+"""
+Замер пропускной способности входа в зависимости от числа процессов
+хэширования паролей.
+
+Каждый вход - проверка пароля (PBKDF2, как в AuthService.signin).
+Для сравнения сначала проверки идут прямо в event loop, как раньше,
+затем через PasswordHasher с 1, 2, 4 ... процессами до числа ядер.
+Параллельно в том же loop тикает таймер каждые 10 мс: его максимальное
+опоздание - сколько ждали бы все остальные запросы, например проверка
+токенов.
+
+Запуск из директории auth_api (БД и Redis не нужны):
+
+    PYTHONPATH=src python -m tests.benchmarks.signin_throughput --signins 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from services.passwords import PasswordHasher
+
+TICK = 0.01
+
+
+async def watch_loop(stop: asyncio.Event) -> float:
+    """Максимальное опоздание тика таймера, в секундах."""
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        worst = max(worst, time.perf_counter() - started - TICK)
+    return worst
+
+
+async def run(verify, signins: int, concurrency: int) -> dict:
+    password_hash = generate_password_hash('password')
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def signin() -> None:
+        async with semaphore:
+            assert await verify(password_hash, 'password')
+
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(signin() for _ in range(signins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    worst_stall = await watcher
+    return {
+        'signins_per_second': round(signins / elapsed, 1),
+        'seconds': round(elapsed, 3),
+        'max_loop_stall_ms': round(worst_stall * 1000, 1),
+    }
+
+
+async def inline_verify(password_hash: str, password: str) -> bool:
+    """Прежняя реализация: проверка прямо в event loop."""
+    return check_password_hash(password_hash, password)
+
+
+async def main(signins: int, concurrency: int) -> None:
+    cpu_count = os.cpu_count() or 1
+    report = {
+        'cpu_count': cpu_count,
+        'signins': signins,
+        'concurrency': concurrency,
+        'inline': await run(inline_verify, signins, concurrency),
+    }
+    workers = 1
+    while True:
+        hasher = PasswordHasher(workers=workers, max_pending=signins)
+        hasher.start()
+        try:
+            # Первая задача поднимает процессы пула, в замер не входит
+            await hasher.verify(generate_password_hash('warmup'), 'warmup')
+            report[f'pool_{workers}'] = await run(hasher.verify, signins,
+                                                  concurrency)
+        finally:
+            hasher.stop()
+        if workers >= cpu_count:
+            break
+        workers = min(workers * 2, cpu_count)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--signins', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=64)
+    args = parser.parse_args()
+    asyncio.run(main(args.signins, args.concurrency))
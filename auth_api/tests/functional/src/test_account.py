@@ -47,6 +47,39 @@ async def test_logout_all_devices(
     assert response.status == HTTPStatus.UNAUTHORIZED
 
 
+@pytestmark
+async def test_logout_all_devices_keeps_new_tokens(
+        admin_auth_header,
+        make_request_with_session,
+):
+    # Arrange
+    sign_in_url = f'{settings.app_api_host}auth/signin'
+    history_url = f'{settings.app_api_host}account/login_history'
+    await make_request_with_session(
+        'post', f'{settings.app_api_host}account/logout_all_devices',
+        headers=admin_auth_header
+    )
+
+    # Act
+    # Вход сразу после выхода со всех устройств, в ту же секунду
+    response = await make_request_with_session('post', sign_in_url, data={
+        'username': 'test_admin@testadmin.com', 'password': 'test_admin'
+    })
+    new_auth_header = {
+        'Authorization': 'Bearer ' + (await response.json())['access_token']
+    }
+    old_response = await make_request_with_session(
+        'post', history_url, params={'page': 1}, headers=admin_auth_header
+    )
+    new_response = await make_request_with_session(
+        'post', history_url, params={'page': 1}, headers=new_auth_header
+    )
+
+    # Assert
+    assert old_response.status == HTTPStatus.UNAUTHORIZED
+    assert new_response.status == HTTPStatus.OK
+
+
 @pytestmark
 async def test_change_login_fake_user(
         admin_auth_header,
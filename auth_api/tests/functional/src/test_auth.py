@@ -2,7 +2,8 @@ import pytest
 
 from tests.functional.settings import settings, pytestmark
 from tests.functional.test_data.auth import REG_NEW_USER_DATA, \
-    FAKE_LOGIN_DATA, LOGIN_DATA, REG_EXIST_USER_DATA, TEST_REFRESH_DATA
+    FAKE_LOGIN_DATA, LOGIN_DATA, REG_EXIST_USER_DATA, TEST_REFRESH_DATA, \
+    VALIDATE_TOKENS_DATA
 
 
 @pytest.mark.parametrize(
@@ -121,3 +122,33 @@ async def test_refresh(
     # Assert
     assert response.status == expected_answer['status']
     assert len(data_response) == expected_answer['response_len']
+
+
+@pytest.mark.parametrize(
+    'query_data, expected_answer',
+    VALIDATE_TOKENS_DATA
+)
+@pytestmark
+async def test_validate_tokens(
+        make_request_with_session,
+        query_data,
+        expected_answer,
+        admin_auth_data
+):
+    # Arrange
+    access_token = admin_auth_data['access_token']
+    url = f'{settings.app_api_host}auth/validate_tokens'
+
+    # Act
+    response = await make_request_with_session(
+        'post',
+        url,
+        json={'access_tokens': [access_token, query_data['invalid_token'],
+                                access_token]}
+    )
+    data_response = await response.json()
+
+    # Assert
+    assert response.status == expected_answer['status']
+    assert [result['valid'] for result in data_response['results']] == \
+        expected_answer['results']
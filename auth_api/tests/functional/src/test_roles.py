@@ -1,6 +1,10 @@
+import base64
+import json
+from http import HTTPStatus
 from typing import Dict, Union
 
 import pytest
+from sqlalchemy import text
 
 from tests.functional.settings import settings, pytestmark
 from tests.functional.test_data.roles import (
@@ -18,6 +22,13 @@ from tests.functional.test_data.roles import (
     GET_MY_ROLES_POSITIVE_DATA
 )
 
+ADMIN_EMAIL = 'test_admin@testadmin.com'
+
+
+def token_claims(token: str) -> dict:
+    payload = token.split('.')[1]
+    return json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+
 
 @pytest.mark.parametrize(
     'query_data, expected_answer',
@@ -337,3 +348,60 @@ async def test_positive_get_my_roles(
 
     assert response.status == expected_answer.get('status')
     assert data_response == expected_answer.get('full_return')
+
+
+@pytestmark
+async def test_role_change_bumps_roles_version(
+        admin_auth_data,
+        make_request_with_session,
+):
+    # Arrange
+    version = token_claims(admin_auth_data['access_token'])['roles_version']
+    headers = {'Authorization': 'Bearer ' + admin_auth_data['access_token']}
+    url = f'{settings.app_api_host}roles/user'
+    params = {'email': ADMIN_EMAIL, 'role_name': 'user'}
+
+    # Act
+    await make_request_with_session('post', url, params=params,
+                                    headers=headers)
+    response = await make_request_with_session(
+        'post', f'{settings.app_api_host}auth/signin',
+        data={'username': ADMIN_EMAIL, 'password': 'test_admin'})
+    claims = token_claims((await response.json())['access_token'])
+    await make_request_with_session('delete', url, params=params,
+                                    headers=headers)
+
+    # Assert
+    assert claims['roles_version'] > version
+    assert 'user' in claims['roles']
+
+
+@pytestmark
+async def test_stale_roles_token_rejected(
+        db_session,
+        admin_auth_header,
+        make_request_with_session,
+):
+    # Arrange
+    await make_request_with_session(
+        'delete', f'{settings.app_api_host}roles/user',
+        params={'email': ADMIN_EMAIL, 'role_name': 'admin'},
+        headers=admin_auth_header)
+
+    # Act
+    # Токен выдан до изменения ролей, claim roles все еще содержит admin
+    response = await make_request_with_session(
+        'get', f'{settings.app_api_host}roles', headers=admin_auth_header)
+    await db_session.execute(text("""
+        INSERT INTO userrole (id, user_id, role_id)
+        VALUES (:user_role_id, :user_id, :role_id_admin)
+    """), {
+        'user_role_id': 'e0b42c00-4e0b-46ad-8f59-d7d3c9b9e777',
+        'role_id_admin': '28c3eb89-7c87-4382-8555-330a808f9a8d',
+        'user_id': 'c058891a-34ce-4985-b252-5ed1cd4497b4'})
+    await db_session.commit()
+
+    # Assert
+    assert 'admin' in token_claims(
+        admin_auth_header['Authorization'].split()[1])['roles']
+    assert response.status == HTTPStatus.FORBIDDEN
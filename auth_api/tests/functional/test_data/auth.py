@@ -53,3 +53,10 @@ TEST_REFRESH_DATA: list = [(
         'response_len': 2
     }
 )]
+VALIDATE_TOKENS_DATA: list = [(
+    {'invalid_token': 'not-a-token'},
+    {
+        'status': HTTPStatus.OK,
+        'results': [True, False, True]
+    }
+)]
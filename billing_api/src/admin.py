@@ -1,13 +1,30 @@
+import datetime
+import json
+import operator
 import requests
 import http
 import logging
+import uuid
+from dataclasses import dataclass
+from typing import Any, ClassVar, Union
 
 from sqladmin import ModelView
 from sqladmin.authentication import AuthenticationBackend
+from sqladmin.pagination import PageControl, Pagination
+from sqlalchemy import Select, and_, false, func, or_, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import joinedload
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from starlette.datastructures import URL
 from starlette.requests import Request
 
-from models.base import Subscriptions, Payments, UserSubscriptions
+from models.base import Subscriptions, Payments, UserSubscriptions, \
+    RevenueDaily, RevenueMonthly
 from core.config import settings
+from db import redis
+from db.replica import replicas
+from services.catalog import SubscriptionCatalog, catalog
+from services.entitlements import EntitlementStore
 
 logger = logging.getLogger('billing_api')
 
@@ -39,6 +56,199 @@ class AdminAuth(AuthenticationBackend):
         return True
 
 
+class Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement: Select) -> None:
+        self.statement = statement
+
+
+@compiles(Explain, 'postgresql')
+def _compile_explain(element, compiler, **kw):
+    return 'EXPLAIN (FORMAT JSON) ' + compiler.process(element.statement, **kw)
+
+
+@dataclass
+class KeysetPagination(Pagination):
+    """
+    Страницы по ключу последней строки: ссылки только на соседние
+    страницы, номер страницы нужен лишь для подписи.
+    """
+    previous_cursor: Union[None, str] = None
+    next_cursor: Union[None, str] = None
+
+    @property
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    def add_pagination_urls(self, base_url: URL) -> None:
+        base_url = base_url.remove_query_params(['after', 'before'])
+        if self.previous_cursor is not None:
+            self.page_controls.append(PageControl(
+                self.page - 1, str(base_url.include_query_params(
+                    page=self.page - 1, before=self.previous_cursor))))
+        self.page_controls.append(PageControl(self.page, str(base_url)))
+        if self.next_cursor is not None:
+            self.page_controls.append(PageControl(
+                self.page + 1, str(base_url.include_query_params(
+                    page=self.page + 1, after=self.next_cursor))))
+
+
+def _all_scalars(result) -> list:
+    return result.scalars().unique().all()
+
+
+class LargeTableView(ModelView):
+    """
+    Список для таблиц на миллионы строк.
+
+    Число строк берется из оценки планировщика (EXPLAIN), точный
+    COUNT(*) выполняется, только если оценка не больше
+    exact_count_threshold. Без явной сортировки страницы листаются
+    по ключу keyset_columns вместо OFFSET. Поиск по UUID - точное
+    равенство, по дате - диапазон суток, поэтому оба идут по индексам.
+    Список, оценка и счетчик читаются с реплики, если она доступна.
+    """
+
+    keyset_columns: ClassVar[list] = []
+    keyset_desc: ClassVar[bool] = True
+    exact_count_threshold: ClassVar[int] = settings.admin_exact_count_threshold
+
+    async def _run_list_query(self, stmt: ClauseElement,
+                              consume=_all_scalars) -> Any:
+        async with self.session_maker(expire_on_commit=False) as session:
+            return await replicas.read(stmt, consume, session)
+
+    async def _estimate_rows(self, stmt: Select) -> int:
+        plan = await self._run_list_query(
+            Explain(stmt), lambda result: result.scalar_one())
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    async def _count(self, stmt: Select) -> int:
+        estimate = await self._estimate_rows(stmt)
+        if estimate > self.exact_count_threshold:
+            return estimate
+        rows = await self._run_list_query(
+            select(func.count()).select_from(stmt.subquery()))
+        return rows[0]
+
+    @staticmethod
+    def _search_expression(column, term: str) -> Any:
+        python_type = column.type.python_type
+        try:
+            if python_type is uuid.UUID:
+                return column == uuid.UUID(term)
+            if python_type is datetime.datetime:
+                day = datetime.date.fromisoformat(term)
+                start = datetime.datetime(day.year, day.month, day.day,
+                                          tzinfo=datetime.timezone.utc)
+                return and_(column >= start,
+                            column < start + datetime.timedelta(days=1))
+            if python_type is str:
+                return column.ilike(f'%{term}%')
+            return column == python_type(term)
+        except ValueError:
+            return None
+
+    def search_query(self, stmt: Select, term: str) -> Select:
+        expressions = [
+            self._search_expression(getattr(self.model, field), term.strip())
+            for field in self._search_fields
+        ]
+        expressions = [item for item in expressions if item is not None]
+        return stmt.filter(or_(*expressions) if expressions else false())
+
+    def _encode_cursor(self, row) -> str:
+        values = [getattr(row, column.key) for column in self.keyset_columns]
+        return '|'.join(
+            value.isoformat() if isinstance(value, datetime.datetime)
+            else str(value)
+            for value in values
+        )
+
+    def _decode_cursor(self, cursor: str) -> list:
+        values = []
+        for column, value in zip(self.keyset_columns, cursor.split('|')):
+            python_type = column.type.python_type
+            if python_type is datetime.datetime:
+                values.append(datetime.datetime.fromisoformat(value))
+            else:
+                values.append(python_type(value))
+        return values
+
+    def _keyset_condition(self, values: list, backwards: bool):
+        compare = operator.lt if self.keyset_desc != backwards else operator.gt
+        columns = self.keyset_columns
+        condition = compare(columns[-1], values[-1])
+        for column, value in zip(columns[-2::-1], values[-2::-1]):
+            condition = or_(compare(column, value),
+                            and_(column == value, condition))
+        # Отдельное условие на первую колонку дает планировщику
+        # диапазон для индекса
+        first = operator.le if compare is operator.lt else operator.ge
+        return and_(first(columns[0], values[0]), condition)
+
+    async def list(self, request: Request) -> Pagination:
+        page = int(request.query_params.get('page', 1))
+        page_size = int(request.query_params.get('pageSize', 0))
+        page_size = min(page_size or self.page_size,
+                        max(self.page_size_options))
+        search = request.query_params.get('search')
+
+        stmt = self.list_query(request)
+        if search:
+            stmt = self.search_query(stmt=stmt, term=search)
+        count = await self._count(stmt)
+        for relation in self._list_relations:
+            stmt = stmt.options(joinedload(relation))
+
+        if request.query_params.get('sortBy') or not self.keyset_columns:
+            stmt = self.sort_query(stmt, request)
+            stmt = stmt.limit(page_size).offset((page - 1) * page_size)
+            rows = await self._run_list_query(stmt)
+            return Pagination(rows=rows, page=page,
+                              page_size=page_size, count=count)
+
+        before = request.query_params.get('before')
+        after = request.query_params.get('after')
+        backwards = before is not None
+        cursor = before if backwards else after
+        if cursor:
+            stmt = stmt.where(self._keyset_condition(
+                self._decode_cursor(cursor), backwards))
+        descending = self.keyset_desc != backwards
+        stmt = stmt.order_by(*(
+            column.desc() if descending else column.asc()
+            for column in self.keyset_columns
+        )).limit(page_size + 1)
+
+        rows = list(await self._run_list_query(stmt))
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if backwards:
+            rows.reverse()
+        previous_cursor = next_cursor = None
+        if rows:
+            if (has_more if backwards else cursor is not None):
+                previous_cursor = self._encode_cursor(rows[0])
+            if (cursor is not None if backwards else has_more):
+                next_cursor = self._encode_cursor(rows[-1])
+        return KeysetPagination(rows=rows, page=page, page_size=page_size,
+                                count=count, previous_cursor=previous_cursor,
+                                next_cursor=next_cursor)
+
+
+def _subscription_title(subscription_id) -> str:
+    plan = catalog.get(subscription_id)
+    return plan.title if plan else str(subscription_id)
+
+
 class SubscriptionAdmin(ModelView, model=Subscriptions):
     column_list = [Subscriptions.id, Subscriptions.title, Subscriptions.price, Subscriptions.duration]
     column_details_list = [Subscriptions.id, Subscriptions.title, Subscriptions.price, Subscriptions.duration]
@@ -50,8 +260,14 @@ class SubscriptionAdmin(ModelView, model=Subscriptions):
     icon = 'fa-solid fa-medal'
     form_columns = [Subscriptions.title, Subscriptions.price, Subscriptions.duration]
 
+    async def after_model_change(self, data, model, is_created, request) -> None:
+        await SubscriptionCatalog.invalidate(redis.redis)
+
+    async def after_model_delete(self, model, request) -> None:
+        await SubscriptionCatalog.invalidate(redis.redis)
+
 
-class PaymentsAdmin(ModelView, model=Payments):
+class PaymentsAdmin(LargeTableView, model=Payments):
     column_list = [Payments.id, Payments.user_id, Payments.date_create, Payments.Subscription, Payments.status]
     column_formatters = {Payments.Subscription: lambda m, a: m.Subscription.title if m.Subscription else None}
     column_details_list = [
@@ -59,8 +275,10 @@ class PaymentsAdmin(ModelView, model=Payments):
     ]
     name_plural = 'Payments'
     icon = 'fa-solid fa-wallet'
-    column_searchable_list = [Payments.date_create, Payments.subscription_id]
+    column_searchable_list = [Payments.id, Payments.service_payment_id, Payments.user_id,
+                              Payments.subscription_id, Payments.date_create]
     column_sortable_list = [Payments.date_create, Payments.subscription_id, Payments.status]
+    keyset_columns = [Payments.date_create, Payments.id]
     form_columns = [Payments.user_id, 'Subscription', Payments.status]
     form_ajax_refs = {
         'Subscription': {
@@ -69,7 +287,7 @@ class PaymentsAdmin(ModelView, model=Payments):
     }
 
 
-class UserSubscriptionsAdmin(ModelView, model=UserSubscriptions):
+class UserSubscriptionsAdmin(LargeTableView, model=UserSubscriptions):
     column_list = [
         UserSubscriptions.id,
         UserSubscriptions.user_id,
@@ -85,5 +303,52 @@ class UserSubscriptionsAdmin(ModelView, model=UserSubscriptions):
     ]
     name_plural = 'User Subscriptions'
     icon = 'fa-solid fa-user-plus'
-    column_searchable_list = [UserSubscriptions.user_id, UserSubscriptions.subscription_id]
+    column_searchable_list = [UserSubscriptions.id, UserSubscriptions.user_id,
+                              UserSubscriptions.subscription_id]
     column_sortable_list = [UserSubscriptions.user_id, UserSubscriptions.subscription_id]
+    keyset_columns = [UserSubscriptions.id]
+    keyset_desc = False
+
+    # Проекция подписок в Redis живет сутки: правка в админке
+    # сбрасывает ее и у прежнего владельца, и у нового
+    async def on_model_change(self, data, model, is_created, request) -> None:
+        request.state.previous_user_id = model.user_id
+
+    async def after_model_change(self, data, model, is_created, request) -> None:
+        user_ids = {model.user_id, request.state.previous_user_id} - {None}
+        await EntitlementStore(redis.redis).invalidate(user_ids)
+
+    async def after_model_delete(self, model, request) -> None:
+        await EntitlementStore(redis.redis).invalidate([model.user_id])
+
+
+class RevenueDailyAdmin(ModelView, model=RevenueDaily):
+    column_list = [RevenueDaily.day, RevenueDaily.subscription_id, RevenueDaily.status,
+                   RevenueDaily.payments_count, RevenueDaily.revenue]
+    column_formatters = {RevenueDaily.subscription_id: lambda m, a: _subscription_title(m.subscription_id)}
+    column_default_sort = [(RevenueDaily.day, True)]
+    column_sortable_list = [RevenueDaily.day, RevenueDaily.status, RevenueDaily.revenue]
+    column_searchable_list = [RevenueDaily.status]
+    name = 'Revenue by day'
+    name_plural = 'Revenue by day'
+    icon = 'fa-solid fa-chart-line'
+    can_create = False
+    can_edit = False
+    can_delete = False
+    can_view_details = False
+
+
+class RevenueMonthlyAdmin(ModelView, model=RevenueMonthly):
+    column_list = [RevenueMonthly.month, RevenueMonthly.subscription_id, RevenueMonthly.status,
+                   RevenueMonthly.payments_count, RevenueMonthly.revenue]
+    column_formatters = {RevenueMonthly.subscription_id: lambda m, a: _subscription_title(m.subscription_id)}
+    column_default_sort = [(RevenueMonthly.month, True)]
+    column_sortable_list = [RevenueMonthly.month, RevenueMonthly.status, RevenueMonthly.revenue]
+    column_searchable_list = [RevenueMonthly.status]
+    name = 'Revenue by month'
+    name_plural = 'Revenue by month'
+    icon = 'fa-solid fa-chart-column'
+    can_create = False
+    can_edit = False
+    can_delete = False
+    can_view_details = False
@@ -1,2 +1,44 @@
-from pydantic import BaseModel
+import datetime
+import uuid
+from typing import Union
 
+from pydantic import BaseModel, Field
+
+from core.config import settings
+
+
+class Entitlement(BaseModel):
+    subscription_id: uuid.UUID
+    expiration_time: datetime.datetime
+
+
+class UserEntitlements(BaseModel):
+    user_id: uuid.UUID
+    active: bool
+    subscriptions: list[Entitlement]
+
+
+class EntitlementsRequest(BaseModel):
+    user_ids: list[uuid.UUID] = Field(
+        min_length=1, max_length=settings.entitlements_bulk_limit)
+
+
+class PaymentHistoryItem(BaseModel):
+    id: uuid.UUID
+    subscription_id: uuid.UUID
+    price: int
+    status: str
+    date_create: datetime.datetime
+
+
+class PaymentsPage(BaseModel):
+    items: list[PaymentHistoryItem]
+    next_cursor: Union[None, str]
+
+
+class RevenueRow(BaseModel):
+    period: datetime.date
+    subscription_id: uuid.UUID
+    status: str
+    payments_count: int
+    revenue: int
@@ -1,12 +1,13 @@
 import uuid
 from typing import Any
 
-from fastapi import APIRouter, Depends, Body, HTTPException
+from fastapi import APIRouter, Depends, Body, HTTPException, status
 from yookassa.domain.notification import WebhookNotificationFactory
 
 from core.config import settings
 from services.auth import get_current_user_data
 from services.billing import get_billing_service, BillingService
+from services.notify_queue import NotifyQueue, get_notify_queue
 
 router = APIRouter()
 
@@ -39,18 +40,24 @@ async def create_payment(
 )
 async def notify(
         event_json: Any = Body(None),
-        billing_service: BillingService = Depends(get_billing_service)
+        billing_service: BillingService = Depends(get_billing_service),
+        notify_queue: NotifyQueue = Depends(get_notify_queue),
 ):  # Извлечение JSON объекта из тела запроса
-    notification_object = WebhookNotificationFactory().create(event_json)
-    response_object = notification_object.object
-    yookassa_payment_id = response_object.id
-    new_status = response_object.status
-    # try:
-    await billing_service.update_payment_status(yookassa_payment_id,
-                                                new_status)
-    # except Exception as err:
-    #     print(err)
-    #     return HTTPException(400)
+    try:
+        notification_object = WebhookNotificationFactory().create(event_json)
+        response_object = notification_object.object
+        yookassa_payment_id = uuid.UUID(response_object.id)
+        new_status = response_object.status
+    except (TypeError, ValueError):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST,
+                            'Invalid notification')
+
+    if settings.notify_queue_enabled:
+        # Статус применит воркер очереди, касса не ждет обращений к БД
+        await notify_queue.put(yookassa_payment_id, new_status)
+    else:
+        await billing_service.update_payment_status(yookassa_payment_id,
+                                                    new_status)
     return HTTPException(200)  # Сообщаем кассе, что все хорошо
 
 
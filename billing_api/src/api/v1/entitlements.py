@@ -0,0 +1,68 @@
+import datetime
+import uuid
+
+from fastapi import APIRouter, Depends, HTTPException
+
+from api.schemas.base import EntitlementsRequest, UserEntitlements
+from services.auth import AuthService, get_auth_service, \
+    get_current_service_data, get_current_user_data, is_service
+from services.entitlements import EntitlementService, get_entitlement_service
+
+router = APIRouter()
+
+
+def _user_entitlements(
+        user_id: uuid.UUID,
+        subscriptions: dict[uuid.UUID, datetime.datetime],
+) -> dict:
+    return {
+        'user_id': user_id,
+        'active': bool(subscriptions),
+        'subscriptions': [
+            {'subscription_id': subscription_id,
+             'expiration_time': expiration_time}
+            for subscription_id, expiration_time in subscriptions.items()
+        ],
+    }
+
+
+@router.get(
+    '/entitlements/{user_id}',
+    response_model=UserEntitlements,
+    summary="Действующие подписки пользователя",
+    description="Читается из проекции в Redis, при промахе - из БД. "
+                "Доступно самому пользователю и сервисам"
+)
+async def get_entitlements(
+        user_id: uuid.UUID,
+        entitlement_service: EntitlementService = Depends(
+            get_entitlement_service),
+        auth_service: AuthService = Depends(get_auth_service),
+        user_payload: dict = Depends(get_current_user_data),
+):
+    own = str(user_id) == user_payload['user_id']
+    if not own and not await is_service(auth_service, user_payload):
+        raise HTTPException(status_code=403, detail='Forbidden')
+    entitlements = await entitlement_service.get_entitlements([user_id])
+    return _user_entitlements(user_id, entitlements[user_id])
+
+
+@router.post(
+    '/entitlements',
+    response_model=list[UserEntitlements],
+    summary="Действующие подписки пачки пользователей",
+    description="Один pipeline в Redis и один запрос в БД на все промахи. "
+                "Только для сервисов"
+)
+async def get_bulk_entitlements(
+        entitlements_request: EntitlementsRequest,
+        entitlement_service: EntitlementService = Depends(
+            get_entitlement_service),
+        service_payload: dict = Depends(get_current_service_data),
+):
+    entitlements = await entitlement_service.get_entitlements(
+        entitlements_request.user_ids)
+    return [
+        _user_entitlements(user_id, subscriptions)
+        for user_id, subscriptions in entitlements.items()
+    ]
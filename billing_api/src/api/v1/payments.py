@@ -0,0 +1,39 @@
+import uuid
+from typing import Union
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import ORJSONResponse
+
+from api.schemas.base import PaymentsPage
+from core.config import settings
+from services.auth import get_current_user_data
+from services.payments import PaymentHistoryService, \
+    get_payment_history_service
+
+router = APIRouter()
+
+
+@router.get(
+    '/payments',
+    response_model=PaymentsPage,
+    summary="История платежей пользователя",
+    description="Новые платежи первыми. Следующая страница запрашивается "
+                "с cursor из next_cursor предыдущей"
+)
+async def get_payments(
+        cursor: Union[None, str] = None,
+        limit: int = Query(settings.payments_history_page_size, ge=1,
+                           le=settings.payments_history_max_page_size),
+        payment_status: Union[None, str] = None,
+        user_payload: dict = Depends(get_current_user_data),
+        payment_history_service: PaymentHistoryService = Depends(
+            get_payment_history_service),
+):
+    payments, next_cursor = await payment_history_service.get_user_payments(
+        uuid.UUID(user_payload['user_id']), limit, cursor, payment_status)
+    # Строки уже в нужном виде: orjson сериализует их сам, без
+    # промежуточных моделей pydantic
+    return ORJSONResponse({
+        'items': [payment._asdict() for payment in payments],
+        'next_cursor': next_cursor,
+    })
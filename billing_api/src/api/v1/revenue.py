@@ -0,0 +1,30 @@
+import datetime
+import uuid
+from typing import Literal, Union
+
+from fastapi import APIRouter, Depends
+
+from api.schemas.base import RevenueRow
+from services.auth import get_current_admin_data
+from services.revenue import RevenueService, get_revenue_service
+
+router = APIRouter()
+
+
+@router.get(
+    '/revenue',
+    response_model=list[RevenueRow],
+    summary="Выручка по тарифам",
+    description="Готовые итоги по дням или месяцам, по тарифу и статусу платежа"
+)
+async def get_revenue(
+        period: Literal['day', 'month'] = 'day',
+        date_from: Union[None, datetime.date] = None,
+        date_to: Union[None, datetime.date] = None,
+        subscription_id: Union[None, uuid.UUID] = None,
+        payment_status: Union[None, str] = None,
+        admin_payload: dict = Depends(get_current_admin_data),
+        revenue_service: RevenueService = Depends(get_revenue_service),
+):
+    return await revenue_service.get_revenue(
+        period, date_from, date_to, subscription_id, payment_status)
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends
+
+from db.pool import pool_status
+from db.postgres import engine
+from db.replica import replicas
+from services.auth import get_current_admin_data
+
+router = APIRouter()
+
+
+@router.get(
+    '/stats/db_pool',
+    summary="Состояние пула соединений с БД",
+    description="Выданные соединения, overflow, ожидание и таймауты выдачи"
+)
+async def db_pool_stats(
+        admin_payload: dict = Depends(get_current_admin_data),
+):
+    stats = {'primary': pool_status('primary', engine)}
+    for replica in replicas.replicas:
+        stats[replica.name] = pool_status(replica.name, replica.engine)
+    return stats
+
+
+@router.get(
+    '/stats/db_replicas',
+    summary="Состояние реплик БД",
+    description="Отставание реплик в секундах, прием потока WAL и признак "
+                "того, что реплика принимает чтение"
+)
+async def db_replicas_stats(
+        admin_payload: dict = Depends(get_current_admin_data),
+):
+    return replicas.status()
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+
+import typer
+from redis.asyncio import Redis
+
+from core.config import settings
+from core.logger import LoggerSetup
+from services.catalog import catalog
+from services.entitlements import EntitlementStore
+from services.gateway import create_gateway
+from services.notify_queue import NotifyQueue, NotifyWorker
+from services.outbox import OutboxRelay
+from services.partitions import PaymentsPartitionManager
+from services.prolongation import ProlongationScheduler
+from services.reconciliation import PendingPaymentsReconciler
+from services.sweeper import ExpiredSubscriptionsSweeper
+
+logging_setup = LoggerSetup()
+logger = logging.getLogger('billing_api')
+
+app = typer.Typer()
+
+
+@app.callback()
+def main():
+    """
+    Фоновые процессы billing_api.
+    """
+
+
+async def _run_notify_worker(consumer: str) -> None:
+    redis = Redis(host=settings.redis_host, port=settings.redis_port)
+    gateway = create_gateway()
+    worker = NotifyWorker(NotifyQueue(redis), gateway, catalog,
+                          EntitlementStore(redis), consumer=consumer)
+    logger.info('Notify worker [%s] started', consumer)
+    try:
+        await catalog.start(redis)
+        await worker.run()
+    finally:
+        await catalog.stop()
+        await gateway.close()
+        await redis.close()
+
+
+@app.command()
+def notify_worker(consumer: str = settings.notify_consumer):
+    """
+    Разбирает очередь вебхуков ЮKassa пачками.
+    """
+    asyncio.run(_run_notify_worker(consumer))
+
+
+async def _run_prolongation_scheduler(once: bool) -> None:
+    redis = Redis(host=settings.redis_host, port=settings.redis_port)
+    gateway = create_gateway()
+    scheduler = ProlongationScheduler(gateway, catalog,
+                                      EntitlementStore(redis))
+    logger.info('Prolongation scheduler started')
+    try:
+        await catalog.start(redis)
+        if once:
+            await scheduler.run_once()
+        else:
+            await scheduler.run()
+    finally:
+        await catalog.stop()
+        await gateway.close()
+        await redis.close()
+
+
+@app.command()
+def prolongation_scheduler(once: bool = False):
+    """
+    Автопродление подписок, истекающих в ближайшее окно.
+    """
+    asyncio.run(_run_prolongation_scheduler(once))
+
+
+async def _run_payments_partitions(drop: bool, once: bool) -> None:
+    manager = PaymentsPartitionManager()
+    while True:
+        try:
+            await manager.ensure_partitions()
+            await manager.detach_expired(drop=drop)
+        except Exception:
+            if once:
+                raise
+            logger.exception('Payments partitions maintenance failed')
+        if once:
+            return
+        await asyncio.sleep(settings.payments_partitions_interval_seconds)
+
+
+@app.command()
+def payments_partitions(drop: bool = False, once: bool = False):
+    """
+    Создает будущие секции payments и отсоединяет устаревшие.
+    """
+    asyncio.run(_run_payments_partitions(drop, once))
+
+
+async def _run_outbox_relay() -> None:
+    redis = Redis(host=settings.redis_host, port=settings.redis_port)
+    relay = OutboxRelay(redis)
+    logger.info('Outbox relay started')
+    try:
+        await relay.run()
+    finally:
+        await redis.close()
+
+
+@app.command()
+def outbox_relay():
+    """
+    Публикует события outbox_events в Redis stream.
+    """
+    asyncio.run(_run_outbox_relay())
+
+
+async def _run_reconcile_payments(older_than_minutes: int) -> None:
+    redis = Redis(host=settings.redis_host, port=settings.redis_port)
+    gateway = create_gateway()
+    reconciler = PendingPaymentsReconciler(
+        gateway, catalog, EntitlementStore(redis),
+        older_than_minutes=older_than_minutes,
+    )
+    try:
+        await catalog.start(redis)
+        await reconciler.run_once()
+    finally:
+        await catalog.stop()
+        await gateway.close()
+        await redis.close()
+
+
+@app.command()
+def reconcile_payments(
+        older_than_minutes: int = settings.reconcile_older_than_minutes,
+):
+    """
+    Сверяет с кассой платежи, зависшие в pending. Можно запускать
+    повторно и параллельно с приемом вебхуков.
+    """
+    asyncio.run(_run_reconcile_payments(older_than_minutes))
+
+
+async def _run_expired_subscriptions_sweeper(once: bool) -> None:
+    redis = Redis(host=settings.redis_host, port=settings.redis_port)
+    sweeper = ExpiredSubscriptionsSweeper(EntitlementStore(redis))
+    logger.info('Expired subscriptions sweeper started')
+    try:
+        if once:
+            await sweeper.run_once()
+        else:
+            await sweeper.run()
+    finally:
+        await redis.close()
+
+
+@app.command()
+def expired_subscriptions_sweeper(once: bool = False):
+    """
+    Снимает is_active с истекших подписок.
+    """
+    asyncio.run(_run_expired_subscriptions_sweeper(once))
+
+
+if __name__ == '__main__':
+    app()
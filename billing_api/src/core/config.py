@@ -14,13 +14,84 @@ class Settings(BaseSettings):
     postgres_host: str = Field(alias='BILLING_API_POSTGRES_HOST')
     postgres_port: int = Field(alias='BILLING_API_POSTGRES_PORT')
     postgres_db: str = Field(alias='BILLING_API_POSTGRES_DB')
-    db_echo: bool = True
+    db_echo: bool = False
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_statement_cache_size: int = 100
+    db_pgbouncer: bool = False
+    db_slow_statement_seconds: float = 0.5
+    # DSN реплик для чтения через запятую, пусто - только основная база
+    db_replica_dsns: str = ''
+    db_replica_max_lag_seconds: float = 5.0
+    db_replica_check_interval: float = 5.0
     redis_host: str = Field(alias='AUTH_API_REDIS_HOST')
     redis_port: int = Field(alias='AUTH_API_REDIS_PORT')
-    jwt_secret_key: str = Field(alias='AUTH_API_JWT_SECRET_KEY')
-    jwt_algorithm: str = Field(alias='AUTH_API_JWT_ALGORITHM')
+    session_secret_key: str = Field(alias='BILLING_API_SESSION_SECRET_KEY')
+    auth_jwks_url: str = 'http://auth_api:8000/.well-known/jwks.json'
+    auth_jwks_cache_seconds: int = 300
+    auth_jwks_min_refresh_seconds: int = 10
+    auth_deny_list_key: str = 'auth:deny_list'
+    auth_deny_list_channel: str = 'auth:deny_list:events'
+    auth_deny_list_resync_seconds: int = 300
+    auth_revoked_before_key: str = 'auth:revoked_before'
+    auth_revoked_before_channel: str = 'auth:revoked_before:events'
+    auth_token_cache_size: int = 100000
+    # Счетчик версии ролей пользователя, который ведет auth_api
+    auth_role_version_key_prefix: str = 'auth:role_version:'
+    # Роли сервисных учетных записей auth_api, через запятую
+    service_roles: str = 'service,admin'
     yookassa_shop_id: str = Field(alias='YOOKASSA_SHOP_ID')
     yookassa_secret_key: str = Field(alias='YOOKASSA_SECRET_KEY')
+    yookassa_api_url: str = 'https://api.yookassa.ru/v3'
+    gateway_timeout: float = 10.0
+    gateway_connect_timeout: float = 3.0
+    gateway_max_concurrency: int = 50
+    gateway_pool_size: int = 100
+    gateway_keepalive_timeout: float = 30.0
+    notify_queue_enabled: bool = False
+    notify_stream: str = 'billing:notify'
+    notify_group: str = 'billing_notify_workers'
+    notify_consumer: str = 'notify_worker'
+    notify_batch_size: int = 500
+    notify_block_ms: int = 1000
+    # После стольких неудачных доставок пачка уходит в dead-letter stream
+    notify_max_deliveries: int = 5
+    notify_dead_letter_stream: str = 'billing:notify:dead'
+    prolongation_window_hours: int = 24
+    prolongation_page_size: int = 500
+    prolongation_concurrency: int = 20
+    prolongation_interval_seconds: int = 600
+    # Истекшие не позже стольких часов назад подписки тоже продлеваются
+    prolongation_catchup_hours: int = 72
+    # Сколько касса помнит ключ идемпотентности: недовершенные списания
+    # старше этого не повторяются автоматически
+    gateway_idempotence_key_hours: int = 24
+    entitlements_ttl_seconds: int = 86400
+    entitlements_bulk_limit: int = 1000
+    payments_partitions_ahead: int = 3
+    payments_retention_months: int = 24
+    payments_archive_schema: str = 'archive'
+    payments_partitions_lock_timeout: str = '5s'
+    payments_partitions_interval_seconds: int = 86400
+    payments_pending_lookup_days: int = 14
+    outbox_stream: str = 'billing:events'
+    outbox_stream_maxlen: int = 1000000
+    outbox_batch_size: int = 500
+    outbox_poll_interval: float = 0.5
+    admin_exact_count_threshold: int = 10000
+    reconcile_older_than_minutes: int = 60
+    # Окно сверки шире окна вебхуков: сверка ищет как раз застрявшие платежи
+    reconcile_lookup_days: int = 365
+    reconcile_page_size: int = 500
+    reconcile_concurrency: int = 10
+    reconcile_rate_per_second: float = 20.0
+    sweeper_batch_size: int = 1000
+    sweeper_interval_seconds: int = 60
+    payments_history_page_size: int = 20
+    payments_history_max_page_size: int = 100
     return_url: str = '127.0.0.1'
     auth_api_login_url: str = 'http://auth_api:8000/api/v1/auth/signin/'
 
@@ -0,0 +1,155 @@
+import logging
+import time
+
+from prometheus_client import Counter, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from core.config import settings
+from db.pool import pool_status
+
+logger = logging.getLogger('billing_api')
+
+REQUEST_LATENCY = Histogram(
+    'billing_http_request_duration_seconds',
+    'Время обработки HTTP запроса',
+    ['method', 'route', 'status'],
+)
+GATEWAY_LATENCY = Histogram(
+    'billing_gateway_request_duration_seconds',
+    'Время запроса к платежному шлюзу',
+    ['operation', 'outcome'],
+)
+GATEWAY_ERRORS = Counter(
+    'billing_gateway_errors_total',
+    'Ошибки запросов к платежному шлюзу',
+    ['operation', 'reason'],
+)
+DB_STATEMENT_LATENCY = Histogram(
+    'billing_db_statement_duration_seconds',
+    'Время выполнения SQL выражения',
+    ['engine', 'operation'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5),
+)
+PAYMENT_TRANSITIONS = Counter(
+    'billing_payment_transitions_total',
+    'Смены статуса платежей',
+    ['from_status', 'to_status'],
+)
+PAYMENT_STATUS_MISSES = Counter(
+    'billing_payment_status_misses_total',
+    'Статусы от кассы, не найденные среди ожидающих платежей в окне '
+    'payments_pending_lookup_days: outside_window - применены '
+    'повторным поиском по всей таблице, not_pending - платежа нет '
+    'или он уже не ожидает оплаты',
+    ['reason'],
+)
+
+_engines: dict[str, AsyncEngine] = {}
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: гистограмма времени ответа по шаблону пути.
+    Метка route берется из сработавшего маршрута (/payments/{id}),
+    а не из url, чтобы число рядов не росло с числом платежей.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get('route')
+            REQUEST_LATENCY.labels(
+                method=scope['method'],
+                route=getattr(route, 'path', 'unmatched'),
+                status=status_code,
+            ).observe(time.perf_counter() - started)
+
+
+def observe_payment_transitions(from_status: str, payments: list) -> None:
+    for payment in payments:
+        PAYMENT_TRANSITIONS.labels(
+            from_status=from_status, to_status=payment.status).inc()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def instrument_engine(name: str, engine: AsyncEngine) -> None:
+    """
+    Замеряет каждое выражение через события before/after_cursor_execute
+    и логирует выражения дольше db_slow_statement_seconds.
+    """
+    def after_cursor_execute(conn, cursor, statement, parameters, context,
+                             executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        operation = statement.lstrip().split(None, 1)[0].lower()
+        DB_STATEMENT_LATENCY.labels(
+            engine=name, operation=operation).observe(elapsed)
+        if elapsed >= settings.db_slow_statement_seconds:
+            logger.warning('Slow statement %.3fs: %s', elapsed,
+                           ' '.join(statement.split()))
+
+    def handle_error(context):
+        # Выражение с ошибкой не доходит до after_cursor_execute
+        started = context.connection.info.get('query_started')
+        if started:
+            started.pop()
+
+    _engines[name] = engine
+    event.listen(engine.sync_engine, 'before_cursor_execute',
+                 _before_cursor_execute)
+    event.listen(engine.sync_engine, 'after_cursor_execute',
+                 after_cursor_execute)
+    event.listen(engine.sync_engine, 'handle_error', handle_error)
+
+
+class PoolCollector:
+    """
+    Отдает счетчики пула соединений из db.pool в момент сбора метрик.
+    """
+
+    def collect(self):
+        gauges = {
+            key: GaugeMetricFamily(f'billing_db_pool_{key}',
+                                   f'Пул соединений: {key}', labels=['engine'])
+            for key in ('size', 'checked_in', 'checked_out', 'overflow',
+                        'wait_seconds_max')
+        }
+        counters = {
+            key: CounterMetricFamily(f'billing_db_pool_{key}',
+                                     f'Пул соединений: {key}',
+                                     labels=['engine'])
+            for key in ('checkouts', 'timeouts', 'wait_seconds')
+        }
+        for name, engine in _engines.items():
+            status = pool_status(name, engine)
+            status['wait_seconds'] = status.pop('wait_seconds_total')
+            for key, value in status.items():
+                family = gauges.get(key) or counters[key]
+                family.add_metric([name], value)
+        yield from gauges.values()
+        yield from counters.values()
+
+
+REGISTRY.register(PoolCollector())
@@ -1,5 +1,5 @@
 import abc
-from typing import Union
+from typing import AsyncIterator, Union
 
 
 class AsyncDbServiceBase(abc.ABC):
@@ -37,3 +37,43 @@ class AsyncDbServiceBase(abc.ABC):
             where_delete: Union[list, None] = None,
     ):
         pass
+
+    @abc.abstractmethod
+    async def insert_many(
+            self,
+            what_insert,
+            values_insert: list[dict],
+    ):
+        pass
+
+    @abc.abstractmethod
+    async def update_many(
+            self,
+            what_update,
+            key: str,
+            values_update: list[dict],
+            where_update: Union[list, None] = None,
+            filters: Union[list, None] = None,
+            returning: Union[list, None] = None,
+    ):
+        pass
+
+    @abc.abstractmethod
+    async def select_in(
+            self,
+            what_select,
+            key_column,
+            values_in: list,
+            where_select: Union[list, None] = None,
+    ):
+        pass
+
+    @abc.abstractmethod
+    def stream_select(
+            self,
+            what_select,
+            keys: list,
+            where_select: Union[list, None] = None,
+            page_size: int = 1000,
+    ) -> AsyncIterator:
+        pass
@@ -0,0 +1,108 @@
+import time
+import uuid
+
+from sqlalchemy import exc
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, Pool
+
+from core.config import settings
+
+
+class PoolStats:
+    """
+    Счетчики выдачи соединений из пула одного engine.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.checkouts += 1
+        self.wait_seconds_total += seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+
+pool_stats: dict[str, PoolStats] = {}
+
+
+class InstrumentedPoolMixin:
+    """
+    Замеряет, сколько запрос ждал соединение: свободное из пула,
+    новое в пределах overflow или до pool_timeout.
+    """
+    stats: PoolStats
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        self.stats.observe(time.perf_counter() - started)
+        return connection
+
+
+def instrumented_pool_class(name: str, pgbouncer: bool) -> type[Pool]:
+    # С PgBouncer пулом управляет он, а приложение открывает соединение
+    # на каждую сессию
+    base = NullPool if pgbouncer else AsyncAdaptedQueuePool
+    stats = pool_stats.setdefault(name, PoolStats(name))
+    return type(f'Instrumented{base.__name__}',
+                (InstrumentedPoolMixin, base), {'stats': stats})
+
+
+def engine_options(name: str) -> dict:
+    """
+    Параметры create_async_engine из настроек BILLING_API_DB_*.
+    """
+    options = {
+        'echo': settings.db_echo,
+        'pool_pre_ping': settings.db_pool_pre_ping,
+        'poolclass': instrumented_pool_class(name, settings.db_pgbouncer),
+    }
+    if settings.db_pgbouncer:
+        # В transaction pooling соседние транзакции попадают на разные
+        # серверные соединения, поэтому подготовленные выражения
+        # не кэшируются и получают уникальные имена
+        options['connect_args'] = {
+            'statement_cache_size': 0,
+            'prepared_statement_cache_size': 0,
+            'prepared_statement_name_func':
+                lambda: f'__asyncpg_{uuid.uuid4()}__',
+        }
+    else:
+        options.update({
+            'pool_size': settings.db_pool_size,
+            'max_overflow': settings.db_max_overflow,
+            'pool_timeout': settings.db_pool_timeout,
+            'pool_recycle': settings.db_pool_recycle,
+            'connect_args': {
+                'prepared_statement_cache_size':
+                    settings.db_statement_cache_size,
+            },
+        })
+    return options
+
+
+def pool_status(name: str, engine: AsyncEngine) -> dict:
+    pool = engine.pool
+    stats = pool_stats.setdefault(name, PoolStats(name))
+    status = {
+        'checkouts': stats.checkouts,
+        'timeouts': stats.timeouts,
+        'wait_seconds_total': round(stats.wait_seconds_total, 6),
+        'wait_seconds_max': round(stats.wait_seconds_max, 6),
+    }
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0),
+        })
+    return status
@@ -1,15 +1,21 @@
-from typing import Union
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Union
 
+from sqlalchemy import column, insert, tuple_, values
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, \
     async_sessionmaker
 from sqlalchemy.sql import select, update, delete
 from core.config import settings
+from core.metrics import instrument_engine
 from db.base import AsyncDbServiceBase
+from db.pool import engine_options
+from db.replica import ReplicaPool, replicas as default_replicas
 from models.base import Base
 
 dsn = (f'postgresql+asyncpg://{settings.postgres_user}:{settings.postgres_password}@'
        f'{settings.postgres_host}:{settings.postgres_port}/{settings.postgres_db}')
-engine = create_async_engine(dsn, echo=settings.db_echo, future=True)
+engine = create_async_engine(dsn, future=True, **engine_options('primary'))
+instrument_engine('primary', engine)
 
 async_session = async_sessionmaker(engine, expire_on_commit=False)
 
@@ -20,8 +26,43 @@ async def get_session() -> AsyncSession:
 
 
 class DbService(AsyncDbServiceBase):
-    def __init__(self, db: AsyncSession) -> None:
+    # asyncpg принимает не больше 32767 параметров в одном запросе
+    in_chunk_size = 10000
+
+    def __init__(self, db: AsyncSession,
+                 replicas: ReplicaPool = default_replicas) -> None:
         self.db = db
+        self.replicas = replicas
+        self._in_transaction = False
+        # После первой записи чтения этого сервиса идут только в основную
+        # базу: реплика может еще не получить только что записанное
+        self._wrote = False
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator['DbService']:
+        """
+        Объединяет все записи внутри блока в одну транзакцию с одним commit.
+        Вложенные вызовы присоединяются к внешней транзакции.
+        """
+        if self._in_transaction:
+            yield self
+            return
+        self._in_transaction = True
+        try:
+            yield self
+            await self.db.commit()
+        except BaseException:
+            await self.db.rollback()
+            raise
+        finally:
+            self._in_transaction = False
+
+    async def _commit(self) -> None:
+        self._wrote = True
+        if self._in_transaction:
+            await self.db.flush()
+        else:
+            await self.db.commit()
 
     @staticmethod
     def _prepare_select_sql_query(
@@ -68,9 +109,63 @@ class DbService(AsyncDbServiceBase):
                 )
         return default_sql
 
+    @staticmethod
+    def _prepare_update_many_sql_query(
+            what_update: Base,
+            key: str,
+            values_update: list[dict],
+            where_update=None,
+            filters=None,
+    ):
+        names = list(values_update[0])
+        columns = what_update.__table__.c
+        new_values = values(
+            *[column(name, columns[name].type) for name in names],
+            name='new_values',
+        ).data([tuple(row[name] for name in names) for row in values_update])
+        default_sql = update(what_update).where(
+            columns[key] == new_values.c[key],
+        )
+        if where_update:
+            for update_item in where_update:
+                default_sql = default_sql.where(
+                    update_item[0] == update_item[1],
+                )
+        if filters:
+            default_sql = default_sql.where(*filters)
+        return default_sql.values({
+            name: new_values.c[name] for name in names if name != key
+        }).execution_options(synchronize_session=False)
+
+    async def execute(self, sql) -> list:
+        """
+        Выполняет произвольный запрос (например, upsert с RETURNING)
+        и возвращает строки результата.
+        """
+        result = await self.db.execute(sql)
+        # ORM-запрос с RETURNING возвращает не CursorResult, а
+        # ChunkedIteratorResult без returns_rows, и строки у него есть всегда
+        rows = result.all() if getattr(result, 'returns_rows', True) else []
+        await self._commit()
+        return rows
+
+    async def _read(self, sql, consume: Callable[[Any], Any],
+                    primary: bool = False) -> Any:
+        if primary or self._in_transaction or self._wrote:
+            return consume(await self.db.execute(sql))
+        return await self.replicas.read(sql, consume, self.db)
+
+    async def read(self, sql, primary: bool = False) -> list:
+        """
+        Выполняет запрос только на чтение и возвращает строки результата.
+        Запрос уходит на реплику, если она есть и не отстала; primary=True
+        - для чтений, которым нужны только что записанные данные.
+        """
+        return await self._read(sql, lambda result: result.all(), primary)
+
     async def insert_data(self, data) -> None:
         self.db.add(data)
-        await self.db.commit()
+        await self._commit()
         await self.db.refresh(data)
 
     async def select(
@@ -79,15 +174,19 @@ class DbService(AsyncDbServiceBase):
             where_select=None,
             order_select=None,
             join_with=None,
+            primary: bool = False,
     ):
+        """
+        Как и read, читает с реплики, если не указано primary=True.
+        """
         sql = self._prepare_select_sql_query(
             what_select=what_select,
             where_select=where_select,
             order_select=order_select,
             join_with=join_with,
         )
-        data = await self.db.execute(sql)
-        return list(data.scalars())
+        return await self._read(sql, lambda result: list(result.scalars()),
+                                primary)
 
     async def update(
             self,
@@ -101,7 +200,7 @@ class DbService(AsyncDbServiceBase):
             where_update=where_update,
         )
         await self.db.execute(sql)
-        await self.db.commit()
+        await self._commit()
 
     async def insert(
             self,
@@ -110,7 +209,7 @@ class DbService(AsyncDbServiceBase):
     ):
         new_object = what_insert(**values_insert)
         self.db.add(new_object)
-        await self.db.commit()
+        await self._commit()
         return new_object
 
     async def delete(
@@ -123,4 +222,97 @@ class DbService(AsyncDbServiceBase):
             where_delete=where_delete,
         )
         await self.db.execute(sql)
-        await self.db.commit()
+        await self._commit()
+
+    async def insert_many(
+            self,
+            what_insert: Base,
+            values_insert: list[dict],
+    ) -> None:
+        """
+        Вставляет все строки одним executemany без загрузки объектов в сессию.
+        """
+        if not values_insert:
+            return
+        await self.db.execute(insert(what_insert), values_insert)
+        await self._commit()
+
+    async def update_many(
+            self,
+            what_update: Base,
+            key: str,
+            values_update: list[dict],
+            where_update=None,
+            filters=None,
+            returning=None,
+    ) -> list:
+        """
+        Обновляет строки с разными значениями одним
+        UPDATE ... FROM (VALUES ...), сопоставляя их по колонке key.
+        Во всех словарях values_update должен быть один набор ключей.
+        filters - дополнительные условия, кроме равенств из where_update.
+        """
+        if not values_update:
+            return []
+        sql = self._prepare_update_many_sql_query(
+            what_update=what_update,
+            key=key,
+            values_update=values_update,
+            where_update=where_update,
+            filters=filters,
+        )
+        if returning:
+            sql = sql.returning(*returning)
+        return await self.execute(sql)
+
+    async def select_in(
+            self,
+            what_select: Base,
+            key_column,
+            values_in: list,
+            where_select=None,
+    ) -> list:
+        """
+        Выбирает строки, у которых key_column входит в values_in. Длинные
+        списки делятся на части, чтобы не упереться в лимит параметров asyncpg.
+        """
+        data = []
+        values_in = list(dict.fromkeys(values_in))
+        for start in range(0, len(values_in), self.in_chunk_size):
+            sql = self._prepare_select_sql_query(
+                what_select=what_select,
+                where_select=where_select,
+            ).where(
+                key_column.in_(values_in[start:start + self.in_chunk_size]))
+            data += (await self.db.execute(sql)).scalars()
+        return data
+
+    async def stream_select(
+            self,
+            what_select: Base,
+            keys: list,
+            where_select=None,
+            page_size: int = 1000,
+    ) -> AsyncIterator:
+        """
+        Отдает строки по одной, не загружая всю выборку в память.
+        Страницы идут по ключу keys (уникальному, например [Model.id]),
+        а каждая страница читается серверным курсором.
+        """
+        last = None
+        while True:
+            sql = self._prepare_select_sql_query(
+                what_select=what_select,
+                where_select=where_select,
+            ).order_by(*keys).limit(page_size)
+            if last is not None:
+                sql = sql.where(tuple_(*keys) > tuple_(*last))
+            count = 0
+            result = await self.db.stream_scalars(
+                sql, execution_options={'yield_per': page_size})
+            async for row in result:
+                count += 1
+                last = [getattr(row, key.key) for key in keys]
+                yield row
+            if count < page_size:
+                return
@@ -10,12 +10,17 @@ from sqladmin import Admin
 from starlette.middleware.sessions import SessionMiddleware
 
 from admin import SubscriptionAdmin, PaymentsAdmin, UserSubscriptionsAdmin, \
-    AdminAuth
-from api.v1 import billing
+    RevenueDailyAdmin, RevenueMonthlyAdmin, AdminAuth
+from api.v1 import billing, entitlements, metrics, payments, revenue, stats
 from core.config import settings
 from core.logger import LoggerSetup
+from core.metrics import MetricsMiddleware
 from db import redis
 from db.postgres import engine
+from db.replica import replicas
+from services import gateway
+from services.auth import deny_list
+from services.catalog import catalog
 
 logging_setup = LoggerSetup()
 logger = logging.getLogger('billing_api')
@@ -28,9 +33,17 @@ async def lifespan(*args, **kwargs):
         host=settings.redis_host,
         port=settings.redis_port
     )
+    gateway.gateway = gateway.create_gateway()
+    await catalog.start(redis.redis)
+    await deny_list.start(redis.redis)
     yield
+    await deny_list.stop()
+    await catalog.stop()
+    await gateway.gateway.close()
+    await redis.redis.close()
+    await replicas.dispose()
     logger.info('Billing API service stopped')
-    
+
 
 app = FastAPI(
     lifespan=lifespan,
@@ -38,23 +51,34 @@ app = FastAPI(
     docs_url='/api/v1/billing/openapi',
     openapi_url='/api/v1/billing/openapi.json',
     default_response_class=ORJSONResponse,
-    lifespan=lifespan
 )
 
 admin = Admin(
     app, engine,
     base_url='/api/v1/billing/admin',
     title='Billing admin panel',
-    authentication_backend=AdminAuth(secret_key=settings.jwt_secret_key)
+    authentication_backend=AdminAuth(secret_key=settings.session_secret_key)
 )
 admin.add_view(SubscriptionAdmin)
 admin.add_view(PaymentsAdmin)
 admin.add_view(UserSubscriptionsAdmin)
+admin.add_view(RevenueDailyAdmin)
+admin.add_view(RevenueMonthlyAdmin)
 
 app.include_router(billing.router, prefix='/api/v1/billing', tags=['billing'])
+app.include_router(payments.router, prefix='/api/v1/billing',
+                   tags=['payments'])
+app.include_router(entitlements.router, prefix='/api/v1/billing',
+                   tags=['entitlements'])
+app.include_router(revenue.router, prefix='/api/v1/billing', tags=['revenue'])
+app.include_router(stats.router, prefix='/api/v1/billing', tags=['stats'])
+# Без префикса: /metrics не проксируется nginx и доступен только
+# сборщику метрик внутри сети
+app.include_router(metrics.router)
 
 app.add_middleware(asgi_correlation_id.CorrelationIdMiddleware)
-app.add_middleware(SessionMiddleware, secret_key=settings.jwt_secret_key)
+app.add_middleware(SessionMiddleware, secret_key=settings.session_secret_key)
+app.add_middleware(MetricsMiddleware)
 
 if __name__ == '__main__':
     uvicorn.run(
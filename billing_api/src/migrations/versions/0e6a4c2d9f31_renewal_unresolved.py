@@ -0,0 +1,42 @@
+"""renewal unresolved
+
+Revision ID: 0e6a4c2d9f31
+Revises: 5b2e9d7c4a18
+Create Date: 2026-10-19 12:08:33.417205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0e6a4c2d9f31'
+down_revision: Union[str, None] = '5b2e9d7c4a18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('user_subscriptions',
+                  sa.Column('renewal_unresolved_since',
+                            sa.DateTime(timezone=True), nullable=True))
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_user_subscriptions_renewal_unresolved',
+            'user_subscriptions',
+            ['renewal_unresolved_since'],
+            postgresql_where=sa.text('renewal_unresolved_since IS NOT NULL'),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_user_subscriptions_renewal_unresolved',
+            table_name='user_subscriptions',
+            postgresql_concurrently=True,
+        )
+    op.drop_column('user_subscriptions', 'renewal_unresolved_since')
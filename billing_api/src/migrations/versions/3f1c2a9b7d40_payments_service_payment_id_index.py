@@ -0,0 +1,39 @@
+"""payments service payment id index
+
+Revision ID: 3f1c2a9b7d40
+Revises: 6d970705235b
+Create Date: 2026-10-18 13:24:05.318472
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c2a9b7d40'
+down_revision: Union[str, None] = '6d970705235b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Поиск платежа по вебхуку кассы: service_payment_id + status.
+    # Выборка подписки по (user_id, subscription_id) уже покрыта
+    # уникальным ограничением user_subscriptions_user_id_subscription_id_key.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_payments_service_payment_id_status',
+            'payments',
+            ['service_payment_id', 'status'],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_payments_service_payment_id_status',
+            table_name='payments',
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,60 @@
+"""subscription id indexes
+
+Revision ID: 5b2e9d7c4a18
+Revises: c8d2f5a1e936
+Create Date: 2026-10-18 23:41:07.551920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b2e9d7c4a18'
+down_revision: Union[str, None] = 'c8d2f5a1e936'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Поиск по тарифу в админке. subscription_id не первый столбец
+    # уникального ключа user_subscriptions, поэтому нужен свой индекс.
+    # Секции payments индексируются по одной, как в e7b2c4d9f015
+    with op.get_context().autocommit_block():
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+            'ix_user_subscriptions_subscription_id '
+            'ON user_subscriptions (subscription_id)'
+        )
+    op.execute(
+        'CREATE INDEX IF NOT EXISTS ix_payments_subscription_id '
+        'ON ONLY payments (subscription_id)'
+    )
+    partitions = op.get_bind().execute(sa.text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = 'payments'::regclass
+    """)).scalars().all()
+    with op.get_context().autocommit_block():
+        for partition in partitions:
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+                f'{partition}_subscription_id_idx '
+                f'ON {partition} (subscription_id)'
+            )
+            op.execute(
+                'ALTER INDEX ix_payments_subscription_id '
+                f'ATTACH PARTITION {partition}_subscription_id_idx'
+            )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_payments_subscription_id', table_name='payments')
+    with op.get_context().autocommit_block():
+        op.execute(
+            'DROP INDEX CONCURRENTLY IF EXISTS '
+            'ix_user_subscriptions_subscription_id'
+        )
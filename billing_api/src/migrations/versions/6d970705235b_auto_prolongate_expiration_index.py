@@ -0,0 +1,38 @@
+"""auto prolongate expiration index
+
+Revision ID: 6d970705235b
+Revises: 77ebc838d2fe
+Create Date: 2026-10-18 11:03:17.551920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6d970705235b'
+down_revision: Union[str, None] = '77ebc838d2fe'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_user_subscriptions_auto_prolongate_expiration',
+            'user_subscriptions',
+            ['expiration_time', 'id'],
+            postgresql_where=sa.text('auto_prolongate'),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_user_subscriptions_auto_prolongate_expiration',
+            table_name='user_subscriptions',
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,90 @@
+"""unique user subscription
+
+Revision ID: 77ebc838d2fe
+Revises: aa72f6b6680f
+Create Date: 2026-10-18 10:12:41.104233
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '77ebc838d2fe'
+down_revision: Union[str, None] = 'aa72f6b6680f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+BACKUP_TABLE = 'user_subscriptions_duplicates'
+
+
+def upgrade() -> None:
+    # Дубликаты пары (user_id, subscription_id) сливаются в подписку,
+    # которая истекает позже всех. Все строки таких пар до слияния
+    # сохраняются в user_subscriptions_duplicates: downgrade возвращает
+    # их как было, таблицу можно удалить, когда откат уже не нужен.
+    op.execute(f"""
+        CREATE TABLE {BACKUP_TABLE} AS
+        SELECT * FROM user_subscriptions AS subscription
+        WHERE EXISTS (
+            SELECT 1 FROM user_subscriptions AS other
+            WHERE other.user_id = subscription.user_id
+              AND other.subscription_id = subscription.subscription_id
+              AND other.id <> subscription.id
+        )
+    """)
+    op.execute(f"""
+        UPDATE user_subscriptions AS kept
+        SET is_active = merged.is_active,
+            auto_prolongate = merged.auto_prolongate
+        FROM (
+            SELECT user_id, subscription_id,
+                   bool_or(is_active) AS is_active,
+                   bool_or(auto_prolongate) AS auto_prolongate
+            FROM {BACKUP_TABLE}
+            GROUP BY user_id, subscription_id
+        ) AS merged
+        WHERE kept.user_id = merged.user_id
+          AND kept.subscription_id = merged.subscription_id
+          AND NOT EXISTS (
+              SELECT 1 FROM user_subscriptions AS later
+              WHERE later.user_id = kept.user_id
+                AND later.subscription_id = kept.subscription_id
+                AND (later.expiration_time, later.id)
+                    > (kept.expiration_time, kept.id)
+          )
+    """)
+    op.execute("""
+        DELETE FROM user_subscriptions AS duplicate
+        USING user_subscriptions AS kept
+        WHERE duplicate.user_id = kept.user_id
+          AND duplicate.subscription_id = kept.subscription_id
+          AND (duplicate.expiration_time, duplicate.id)
+              < (kept.expiration_time, kept.id)
+    """)
+    op.create_unique_constraint(
+        'user_subscriptions_user_id_subscription_id_key',
+        'user_subscriptions',
+        ['user_id', 'subscription_id'],
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint(
+        'user_subscriptions_user_id_subscription_id_key',
+        'user_subscriptions',
+        type_='unique',
+    )
+    backup = op.get_bind().execute(
+        sa.text(f"SELECT to_regclass('{BACKUP_TABLE}')")).scalar()
+    if backup is None:
+        return
+    op.execute(f"""
+        DELETE FROM user_subscriptions
+        WHERE id IN (SELECT id FROM {BACKUP_TABLE})
+    """)
+    op.execute(f'INSERT INTO user_subscriptions SELECT * FROM {BACKUP_TABLE}')
+    op.drop_table(BACKUP_TABLE)
@@ -0,0 +1,149 @@
+"""partition payments by month
+
+Revision ID: 9c4e7f2a1b83
+Revises: 3f1c2a9b7d40
+Create Date: 2026-10-18 14:02:48.776105
+
+"""
+import datetime
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c4e7f2a1b83'
+down_revision: Union[str, None] = '3f1c2a9b7d40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PARTITIONS_AHEAD = 3
+
+
+def _month_start(shift: int) -> datetime.datetime:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    month = now.year * 12 + now.month - 1 + shift
+    return datetime.datetime(month // 12, month % 12 + 1, 1,
+                             tzinfo=datetime.timezone.utc)
+
+
+def upgrade() -> None:
+    # Существующая таблица не копируется, а становится секцией
+    # payments_legacy для всех платежей до начала следующего месяца.
+    # Долгие шаги идут без эксклюзивной блокировки: индекс строится
+    # CONCURRENTLY, VALIDATE берет SHARE UPDATE EXCLUSIVE. ACCESS EXCLUSIVE
+    # ненадолго берет ADD CONSTRAINT ... NOT VALID, а затем одна
+    # транзакция держит ее на payments от смены первичного ключа до
+    # конца миграции. Шаги в ней не читают строки: ключ собирается из
+    # готового индекса, ATTACH не сканирует таблицу благодаря CHECK,
+    # индексы родителя подключают уже построенные индексы секции.
+    legacy_until = _month_start(1).isoformat()
+    with op.get_context().autocommit_block():
+        op.execute(
+            'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS '
+            'payments_id_date_create_key ON payments (id, date_create)'
+        )
+        op.execute(
+            'ALTER TABLE payments ADD CONSTRAINT payments_date_create_check '
+            f"CHECK (date_create < '{legacy_until}') NOT VALID"
+        )
+        op.execute(
+            'ALTER TABLE payments VALIDATE CONSTRAINT payments_date_create_check'
+        )
+
+    # Внешний ключ на секционированную таблицу должен включать
+    # date_create, поэтому ссылка user_subscriptions.payment_id
+    # остается без ограничения
+    op.execute("""
+        DO $$
+        DECLARE constraint_name text;
+        BEGIN
+            FOR constraint_name IN
+                SELECT conname FROM pg_constraint
+                WHERE conrelid = 'user_subscriptions'::regclass
+                  AND confrelid = 'payments'::regclass
+                  AND contype = 'f'
+            LOOP
+                EXECUTE format(
+                    'ALTER TABLE user_subscriptions DROP CONSTRAINT %I',
+                    constraint_name);
+            END LOOP;
+        END $$
+    """)
+    # Первичный ключ секции должен совпасть с ключом родителя:
+    # уникальный индекс (id, date_create) становится ключом без перестроения
+    op.execute(
+        'ALTER TABLE payments DROP CONSTRAINT payments_pkey, '
+        'ADD CONSTRAINT payments_pkey PRIMARY KEY '
+        'USING INDEX payments_id_date_create_key'
+    )
+    op.execute('ALTER TABLE payments RENAME TO payments_legacy')
+    op.execute("""
+        DO $$
+        DECLARE index_name text;
+        BEGIN
+            FOR index_name IN
+                SELECT indexname FROM pg_indexes
+                WHERE tablename = 'payments_legacy'
+            LOOP
+                EXECUTE format('ALTER INDEX %I RENAME TO %I', index_name,
+                               replace(index_name, 'payments',
+                                       'payments_legacy'));
+            END LOOP;
+        END $$
+    """)
+    op.execute("""
+        CREATE TABLE payments (
+            id UUID NOT NULL,
+            service_payment_id UUID NOT NULL,
+            user_id UUID NOT NULL,
+            subscription_id UUID NOT NULL REFERENCES subscriptions (id),
+            price INTEGER NOT NULL,
+            status VARCHAR(255) NOT NULL,
+            date_create TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+            CONSTRAINT payments_pkey PRIMARY KEY (id, date_create)
+        ) PARTITION BY RANGE (date_create)
+    """)
+    op.execute(
+        'ALTER TABLE payments ATTACH PARTITION payments_legacy '
+        f"FOR VALUES FROM (MINVALUE) TO ('{legacy_until}')"
+    )
+    for shift in range(1, PARTITIONS_AHEAD + 1):
+        lower = _month_start(shift)
+        upper = _month_start(shift + 1)
+        op.execute(
+            f'CREATE TABLE payments_y{lower.year}m{lower.month:02d} '
+            f'PARTITION OF payments '
+            f"FOR VALUES FROM ('{lower.isoformat()}') "
+            f"TO ('{upper.isoformat()}')"
+        )
+    op.execute('CREATE TABLE payments_default PARTITION OF payments DEFAULT')
+    # Индексы секции payments_legacy с тем же определением
+    # подключаются к индексам родителя без перестроения
+    op.execute('CREATE INDEX ix_payments_date_create ON payments (date_create)')
+    op.execute(
+        'CREATE INDEX ix_payments_service_payment_id_status '
+        'ON payments (service_payment_id, status)'
+    )
+
+
+def downgrade() -> None:
+    op.execute('CREATE TABLE payments_plain (LIKE payments INCLUDING DEFAULTS)')
+    op.execute('INSERT INTO payments_plain SELECT * FROM payments')
+    op.execute('DROP TABLE payments CASCADE')
+    op.execute('ALTER TABLE payments_plain RENAME TO payments')
+    op.execute('ALTER TABLE payments ADD CONSTRAINT payments_pkey PRIMARY KEY (id)')
+    op.execute(
+        'ALTER TABLE payments ADD CONSTRAINT payments_subscription_id_fkey '
+        'FOREIGN KEY (subscription_id) REFERENCES subscriptions (id)'
+    )
+    op.execute('CREATE INDEX ix_payments_date_create ON payments (date_create)')
+    op.execute(
+        'CREATE INDEX ix_payments_service_payment_id_status '
+        'ON payments (service_payment_id, status)'
+    )
+    op.execute(
+        'ALTER TABLE user_subscriptions '
+        'ADD CONSTRAINT user_subscriptions_payment_id_fkey '
+        'FOREIGN KEY (payment_id) REFERENCES payments (id)'
+    )
@@ -0,0 +1,59 @@
+"""payments user history covering index
+
+Revision ID: a1c9d3e7f452
+Revises: f3a8c1d5e290
+Create Date: 2026-10-18 20:11:05.551920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1c9d3e7f452'
+down_revision: Union[str, None] = 'f3a8c1d5e290'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = ('(user_id, date_create DESC, id DESC) '
+           'INCLUDE (subscription_id, price, status)')
+
+
+def _partitions() -> list[str]:
+    return op.get_bind().execute(sa.text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = 'payments'::regclass
+    """)).scalars().all()
+
+
+def upgrade() -> None:
+    # История платежей пользователя читается только из индекса.
+    # Индекс строится так же, как ix_payments_user_id_date_create
+    # (ON ONLY + CONCURRENTLY по секциям), и заменяет его: поиск
+    # по user_id в админке идет по тому же префиксу.
+    op.execute(f'CREATE INDEX IF NOT EXISTS ix_payments_user_history '
+               f'ON ONLY payments {COLUMNS}')
+    partitions = _partitions()
+    with op.get_context().autocommit_block():
+        for partition in partitions:
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+                f'{partition}_user_history_idx ON {partition} {COLUMNS}'
+            )
+            op.execute(
+                'ALTER INDEX ix_payments_user_history '
+                f'ATTACH PARTITION {partition}_user_history_idx'
+            )
+    op.drop_index('ix_payments_user_id_date_create', table_name='payments')
+
+
+def downgrade() -> None:
+    op.execute(
+        'CREATE INDEX IF NOT EXISTS ix_payments_user_id_date_create '
+        'ON payments (user_id, date_create)'
+    )
+    op.drop_index('ix_payments_user_history', table_name='payments')
@@ -0,0 +1,59 @@
+"""revenue rollups
+
+Revision ID: b57d1e0c9a26
+Revises: 9c4e7f2a1b83
+Create Date: 2026-10-18 15:11:37.402519
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b57d1e0c9a26'
+down_revision: Union[str, None] = '9c4e7f2a1b83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _create_rollup(table: str, period: str) -> None:
+    op.create_table(
+        table,
+        sa.Column(period, sa.Date(), nullable=False),
+        sa.Column('subscription_id', sa.UUID(), nullable=False),
+        sa.Column('status', sa.String(length=255), nullable=False),
+        sa.Column('payments_count', sa.BigInteger(), nullable=False),
+        sa.Column('revenue', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint(period, 'subscription_id', 'status'),
+    )
+
+
+def upgrade() -> None:
+    _create_rollup('revenue_daily', 'day')
+    _create_rollup('revenue_monthly', 'month')
+    # Разовое заполнение по уже завершенным платежам. Момент смены
+    # статуса раньше не сохранялся, поэтому берется дата создания.
+    op.execute("""
+        INSERT INTO revenue_daily (day, subscription_id, status,
+                                   payments_count, revenue)
+        SELECT (date_create AT TIME ZONE 'UTC')::date, subscription_id,
+               status, count(*), sum(price)
+        FROM payments
+        WHERE status <> 'pending'
+        GROUP BY 1, 2, 3
+    """)
+    op.execute("""
+        INSERT INTO revenue_monthly (month, subscription_id, status,
+                                     payments_count, revenue)
+        SELECT date_trunc('month', day)::date, subscription_id, status,
+               sum(payments_count), sum(revenue)
+        FROM revenue_daily
+        GROUP BY 1, 2, 3
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('revenue_monthly')
+    op.drop_table('revenue_daily')
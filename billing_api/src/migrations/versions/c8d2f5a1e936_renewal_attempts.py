@@ -0,0 +1,32 @@
+"""renewal attempts
+
+Revision ID: c8d2f5a1e936
+Revises: a1c9d3e7f452
+Create Date: 2026-10-19 10:42:17.204388
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c8d2f5a1e936'
+down_revision: Union[str, None] = 'a1c9d3e7f452'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Nullable-колонки без default: только изменение каталога
+    op.add_column('user_subscriptions',
+                  sa.Column('renewal_attempted_for',
+                            sa.DateTime(timezone=True), nullable=True))
+    op.add_column('payments',
+                  sa.Column('payment_method_id', sa.UUID(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('payments', 'payment_method_id')
+    op.drop_column('user_subscriptions', 'renewal_attempted_for')
@@ -0,0 +1,51 @@
+"""payments user id index
+
+Revision ID: e7b2c4d9f015
+Revises: d41f6e2b8a07
+Create Date: 2026-10-18 18:02:14.551920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7b2c4d9f015'
+down_revision: Union[str, None] = 'd41f6e2b8a07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Поиск платежей пользователя в админке. На секционированной таблице
+    # CONCURRENTLY недоступен, поэтому индекс родителя создается ON ONLY
+    # (пустой и невалидный), секции индексируются без блокировки записи
+    # по одной и подключаются к нему. После последней секции индекс
+    # родителя становится валидным, новые секции получают его сами.
+    op.execute(
+        'CREATE INDEX IF NOT EXISTS ix_payments_user_id_date_create '
+        'ON ONLY payments (user_id, date_create)'
+    )
+    partitions = op.get_bind().execute(sa.text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = 'payments'::regclass
+    """)).scalars().all()
+    with op.get_context().autocommit_block():
+        for partition in partitions:
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+                f'{partition}_user_id_date_create_idx '
+                f'ON {partition} (user_id, date_create)'
+            )
+            op.execute(
+                'ALTER INDEX ix_payments_user_id_date_create '
+                f'ATTACH PARTITION {partition}_user_id_date_create_idx'
+            )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_payments_user_id_date_create', table_name='payments')
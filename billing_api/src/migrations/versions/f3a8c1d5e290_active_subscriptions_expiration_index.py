@@ -0,0 +1,38 @@
+"""active subscriptions expiration index
+
+Revision ID: f3a8c1d5e290
+Revises: e7b2c4d9f015
+Create Date: 2026-10-18 19:24:41.551920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3a8c1d5e290'
+down_revision: Union[str, None] = 'e7b2c4d9f015'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_user_subscriptions_active_expiration',
+            'user_subscriptions',
+            ['expiration_time', 'id'],
+            postgresql_where=sa.text('is_active'),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_user_subscriptions_active_expiration',
+            table_name='user_subscriptions',
+            postgresql_concurrently=True,
+        )
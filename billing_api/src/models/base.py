@@ -3,10 +3,10 @@ from dataclasses import dataclass
 from typing import Any
 
 from sqlalchemy import Column, DateTime, String, Float, Integer, \
-    ForeignKey, Boolean
-from sqlalchemy.dialects.postgresql import UUID
+    ForeignKey, Boolean, UniqueConstraint, Index, Date, BigInteger, Identity
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 from sqlalchemy.orm import declarative_base, relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 
 Base: Any = declarative_base()
 
@@ -37,19 +37,45 @@ class Subscriptions(UUidMixin, Base):
         return self.title
 
 
-class Payments(UUidMixin, Base):
+class Payments(Base):
+    """
+    Секционирована по месяцам date_create (см. services/partitions.py),
+    поэтому ключ секционирования входит в первичный ключ, а внешние
+    ключи на платежи из других таблиц невозможны.
+    """
     __tablename__ = 'payments'
+    __table_args__ = (
+        Index('ix_payments_service_payment_id_status',
+              'service_payment_id', 'status'),
+        # Покрывающий индекс истории платежей пользователя
+        Index('ix_payments_user_history',
+              'user_id', text('date_create DESC'), text('id DESC'),
+              postgresql_include=['subscription_id', 'price', 'status']),
+        {'postgresql_partition_by': 'RANGE (date_create)'},
+    )
 
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4,
+                nullable=False)
     service_payment_id = Column(UUID(as_uuid=True), nullable=False)
+    # Сохраненный способ оплаты, которым списано продление
+    payment_method_id = Column(UUID(as_uuid=True))
     user_id = Column(UUID(as_uuid=True), nullable=False)
-    subscription_id = Column(ForeignKey('subscriptions.id'), nullable=False)
+    subscription_id = Column(ForeignKey('subscriptions.id'), nullable=False,
+                             index=True)
     price = Column(Integer, nullable=False)
     status = Column(String(255), nullable=False)
     date_create = Column(DateTime(timezone=True), server_default=func.now(),
-                         nullable=False, index=True)
+                         primary_key=True, nullable=False, index=True)
+    # id уникален сам по себе: ORM и админка адресуют платеж только по нему
+    __mapper_args__ = {'primary_key': [id]}
 
     Subscription = relationship("Subscriptions", back_populates='Payments')
-    UserSubscriptions = relationship("UserSubscriptions", back_populates='Payment')
+    UserSubscriptions = relationship(
+        "UserSubscriptions",
+        primaryjoin="Payments.id == foreign(UserSubscriptions.payment_id)",
+        back_populates='Payment',
+        viewonly=True,
+    )
 
     def __str__(self):
         return str(self.id)
@@ -57,12 +83,84 @@ class Payments(UUidMixin, Base):
 
 class UserSubscriptions(UUidMixin, Base):
     __tablename__ = 'user_subscriptions'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'subscription_id',
+                         name='user_subscriptions_user_id_subscription_id_key'),
+        Index('ix_user_subscriptions_auto_prolongate_expiration',
+              'expiration_time', 'id',
+              postgresql_where=text('auto_prolongate')),
+        Index('ix_user_subscriptions_active_expiration',
+              'expiration_time', 'id',
+              postgresql_where=text('is_active')),
+        Index('ix_user_subscriptions_renewal_unresolved',
+              'renewal_unresolved_since',
+              postgresql_where=text('renewal_unresolved_since IS NOT NULL')),
+    )
 
     user_id = Column(UUID(as_uuid=True), nullable=False)
-    subscription_id = Column(ForeignKey('subscriptions.id'), nullable=False)
-    payment_id = Column(ForeignKey('payments.id'), nullable=False)
+    subscription_id = Column(ForeignKey('subscriptions.id'), nullable=False,
+                             index=True)
+    payment_id = Column(UUID(as_uuid=True), nullable=False)
     is_active = Column(Boolean)
     expiration_time = Column(DateTime(timezone=True), nullable=False)
     auto_prolongate = Column(Boolean, nullable=False, default=False)
+    # expiration_time, за который уже создавалось списание продления
+    renewal_attempted_for = Column(DateTime(timezone=True))
+    # С какого момента списание за renewal_attempted_for недовершено:
+    # касса могла его принять, но платеж не записан в БД
+    renewal_unresolved_since = Column(DateTime(timezone=True))
     Subscription = relationship("Subscriptions", back_populates='UserSubscriptions')
-    Payment = relationship("Payments", back_populates='UserSubscriptions')
+    Payment = relationship(
+        "Payments",
+        primaryjoin="foreign(UserSubscriptions.payment_id) == Payments.id",
+        back_populates='UserSubscriptions',
+        viewonly=True,
+    )
+
+
+class RevenueRollupMixin(object):
+    """
+    Выручка, накопленная по тарифу и итоговому статусу платежа за период.
+    Пополняется в той же транзакции, в которой платеж покидает pending.
+    """
+    subscription_id = Column(UUID(as_uuid=True), primary_key=True)
+    status = Column(String(255), primary_key=True)
+    payments_count = Column(BigInteger, nullable=False, default=0)
+    revenue = Column(BigInteger, nullable=False, default=0)
+
+
+class RevenueDaily(RevenueRollupMixin, Base):
+    __tablename__ = 'revenue_daily'
+
+    day = Column(Date, primary_key=True)
+
+    def __str__(self):
+        return f'{self.day} {self.subscription_id} {self.status}'
+
+
+class RevenueMonthly(RevenueRollupMixin, Base):
+    __tablename__ = 'revenue_monthly'
+
+    month = Column(Date, primary_key=True)  # Первое число месяца
+
+    def __str__(self):
+        return f'{self.month} {self.subscription_id} {self.status}'
+
+
+class OutboxEvents(Base):
+    """
+    Исходящие события об изменении платежей и подписок. Пишутся в той же
+    транзакции, что и само изменение, релей (services/outbox.py)
+    публикует их в Redis stream и удаляет опубликованные строки.
+    """
+    __tablename__ = 'outbox_events'
+
+    id = Column(BigInteger, Identity(), primary_key=True)
+    event_type = Column(String(64), nullable=False)
+    aggregate_id = Column(UUID(as_uuid=True), nullable=False)
+    payload = Column(JSONB, nullable=False)
+    date_create = Column(DateTime(timezone=True), server_default=func.now(),
+                         nullable=False)
+
+    def __str__(self):
+        return f'{self.id} {self.event_type}'
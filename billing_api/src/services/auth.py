@@ -1,15 +1,24 @@
 import abc
-import uuid
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
 from functools import lru_cache
+from typing import Union
 
-from fastapi import Depends, HTTPException
+import aiohttp
+from fastapi import Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordBearer
-from jose import jwt, JWTError
+from jose import jwk, jwt, JWTError
+from jose.backends.base import Key
 from redis.asyncio import Redis
 
 from core.config import settings
 from db.redis import get_redis
 
+logger = logging.getLogger('billing_api')
+
 
 class UnAuthException(BaseException):
     pass
@@ -21,33 +30,279 @@ class AbstractAsyncAuthService(abc.ABC):
         pass
 
 
+class TokenCache:
+    """
+    Разобранные токены в памяти процесса: ключ - sha256 токена,
+    запись живет до exp. Подпись проверяется один раз на токен,
+    а не на каждый запрос. При переполнении вытесняется давно не
+    использованный токен, истекшие удаляются при обращении к ним.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._payloads: OrderedDict[bytes, dict] = OrderedDict()
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, key: bytes) -> Union[None, dict]:
+        payload = self._payloads.get(key)
+        if payload is None:
+            return None
+        if payload['exp'] <= time.time():
+            del self._payloads[key]
+            return None
+        self._payloads.move_to_end(key)
+        return payload
+
+    def set(self, key: bytes, payload: dict) -> None:
+        if 'exp' not in payload:
+            return
+        self._payloads[key] = payload
+        self._payloads.move_to_end(key)
+        while len(self._payloads) > self.max_size:
+            self._payloads.popitem(last=False)
+
+
+class JwksKeys:
+    """
+    Открытые ключи auth_api из JWKS, кэшируются на cache_seconds.
+
+    Токен с неизвестным kid (auth_api начал подписывать новым ключом)
+    вызывает внеочередное обновление, но не чаще раза
+    в min_refresh_seconds, чтобы токены с выдуманным kid не заваливали
+    auth_api запросами. Если auth_api недоступен, работают ранее
+    полученные ключи.
+    """
+
+    algorithm = 'RS256'
+
+    def __init__(
+            self,
+            url: str = settings.auth_jwks_url,
+            cache_seconds: int = settings.auth_jwks_cache_seconds,
+            min_refresh_seconds: int = settings.auth_jwks_min_refresh_seconds,
+    ) -> None:
+        self.url = url
+        self.cache_seconds = cache_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self._keys: dict[str, Key] = {}
+        self._fetched_at: Union[None, float] = None
+        self._lock = asyncio.Lock()
+
+    def _due(self, kid: str) -> bool:
+        if self._fetched_at is None:
+            return True
+        age = time.monotonic() - self._fetched_at
+        if kid not in self._keys:
+            return age >= self.min_refresh_seconds
+        return age >= self.cache_seconds
+
+    async def refresh(self) -> None:
+        self._fetched_at = time.monotonic()
+        timeout = aiohttp.ClientTimeout(total=5)
+        try:
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.get(self.url) as response:
+                    response.raise_for_status()
+                    jwks = await response.json()
+            self._keys = {
+                key['kid']: jwk.construct(key, self.algorithm)
+                for key in jwks['keys']
+            }
+        except (aiohttp.ClientError, asyncio.TimeoutError, JWTError,
+                KeyError, ValueError) as err:
+            logger.error('Failed to fetch JWKS from %s: %r', self.url, err)
+            return
+        logger.info('JWKS refreshed: %s', list(self._keys))
+
+    async def get(self, kid: str) -> Union[None, Key]:
+        if self._due(kid):
+            async with self._lock:
+                if self._due(kid):
+                    await self.refresh()
+        return self._keys.get(kid)
+
+    async def decode(self, token: str) -> dict:
+        key = await self.get(jwt.get_unverified_header(token).get('kid'))
+        if key is None:
+            raise JWTError('Unknown key id')
+        return jwt.decode(token, key, algorithms=[self.algorithm])
+
+
+class DenyList:
+    """
+    Копия списка отозванных токенов в памяти процесса.
+
+    auth_api при отзыве токена пишет jti в sorted set (score - время,
+    до которого jti действует) и публикует его в канал. При выходе
+    со всех устройств так же пишется и публикуется время отзыва
+    пользователя: недействительны его токены с iat раньше этого времени.
+    Процесс подписан на каналы и раз в resync_seconds перечитывает
+    sorted set'ы целиком, чтобы не зависеть от потерянных сообщений.
+    Пока копия не синхронизирована (старт, обрыв подписки), проверка
+    идет в Redis.
+    """
+
+    def __init__(
+            self,
+            key: str = settings.auth_deny_list_key,
+            channel: str = settings.auth_deny_list_channel,
+            resync_seconds: int = settings.auth_deny_list_resync_seconds,
+            revoked_before_key: str = settings.auth_revoked_before_key,
+            revoked_before_channel: str = (
+                settings.auth_revoked_before_channel),
+    ) -> None:
+        self.key = key
+        self.channel = channel
+        self.resync_seconds = resync_seconds
+        self.revoked_before_key = revoked_before_key
+        self.revoked_before_channel = revoked_before_channel
+        self.ready = False
+        self._jtis: set[str] = set()
+        self._revoked_before: dict[str, float] = {}
+        self._listener: Union[None, asyncio.Task] = None
+
+    def __contains__(self, jti: str) -> bool:
+        return jti in self._jtis
+
+    def add(self, jti: str) -> None:
+        self._jtis.add(jti)
+
+    def revoked_before(self, user_id: str) -> Union[None, float]:
+        return self._revoked_before.get(user_id)
+
+    def add_revoked_before(self, user_id: str, revoked_at: float) -> None:
+        if revoked_at > self._revoked_before.get(user_id, 0):
+            self._revoked_before[user_id] = revoked_at
+
+    def _on_message(self, message: dict) -> None:
+        data = message['data'].decode()
+        if message['channel'].decode() == self.revoked_before_channel:
+            user_id, revoked_at = data.split()
+            self.add_revoked_before(user_id, float(revoked_at))
+        else:
+            self.add(data)
+
+    async def resync(self, redis: Redis) -> None:
+        jtis = await redis.zrangebyscore(self.key, time.time(), '+inf')
+        users = await redis.zrange(self.revoked_before_key, 0, -1,
+                                   withscores=True)
+        self._jtis = {jti.decode() for jti in jtis}
+        self._revoked_before = {
+            user_id.decode(): revoked_at for user_id, revoked_at in users
+        }
+        self.ready = True
+        logger.info('Deny list synced: %s tokens, %s users',
+                    len(self._jtis), len(self._revoked_before))
+
+    async def _listen(self, redis: Redis) -> None:
+        while True:
+            try:
+                async with redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel,
+                                           self.revoked_before_channel)
+                    # Догоняем отзывы, пропущенные без подписки
+                    await self.resync(redis)
+                    synced_at = time.monotonic()
+                    while True:
+                        message = await pubsub.get_message(
+                            ignore_subscribe_messages=True, timeout=1.0)
+                        if message is not None:
+                            self._on_message(message)
+                        if time.monotonic() - synced_at >= self.resync_seconds:
+                            await self.resync(redis)
+                            synced_at = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.ready = False
+                logger.exception('Deny list listener failed')
+                await asyncio.sleep(1)
+
+    async def start(self, redis: Redis) -> None:
+        try:
+            await self.resync(redis)
+        except Exception:
+            logger.exception('Deny list initial sync failed')
+        self._listener = asyncio.create_task(self._listen(redis))
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+
+
 class AuthService(AbstractAsyncAuthService):
-    def __init__(self, redis: Redis):
+    def __init__(self, redis: Redis, deny_list: DenyList,
+                 token_cache: TokenCache, jwks_keys: JwksKeys):
         self.redis = redis
+        self.deny_list = deny_list
+        self.token_cache = token_cache
+        self.jwks_keys = jwks_keys
 
-    async def check_check_token_in_deny_list(self, jti: uuid.UUID) -> bool:
-        value = await self.redis.get(str(jti))
-        if value:
-            return True
+    async def is_token_revoked(self, payload: dict) -> bool:
+        jti, user_id = str(payload['jti']), str(payload['user_id'])
+        if self.deny_list.ready:
+            denied = jti in self.deny_list
+            revoked_before = self.deny_list.revoked_before(user_id)
         else:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.exists(jti)
+                pipe.zscore(self.deny_list.revoked_before_key, user_id)
+                denied, revoked_before = await pipe.execute()
+        if denied:
+            return True
+        # Токены без iat выданы до появления отзыва по времени
+        if revoked_before is None:
             return False
+        return payload.get('iat', 0) < revoked_before
+
+    async def decode_token(self, token: str) -> dict:
+        key = self.token_cache.key(token)
+        payload = self.token_cache.get(key)
+        if payload is None:
+            try:
+                payload = await self.jwks_keys.decode(token)
+            except JWTError:
+                raise UnAuthException
+            self.token_cache.set(key, payload)
+        return payload
 
     async def check_token(self, token: str, token_type: str) -> dict:
-        try:
-            payload = jwt.decode(token, settings.jwt_secret_key,
-                                 algorithms=[settings.jwt_algorithm])
-        except JWTError:
-            raise UnAuthException
+        payload = await self.decode_token(token)
 
         if payload['token_type'] != token_type:
             raise UnAuthException
 
-        jti = payload['jti']
-        if await self.check_check_token_in_deny_list(jti):
+        if await self.is_token_revoked(payload):
             raise UnAuthException
 
         return payload
 
+    async def has_role(self, payload: dict, roles: list) -> bool:
+        """
+        Роль из claim roles действует, пока roles_version токена совпадает
+        со счетчиком в Redis, который auth_api увеличивает при каждом
+        изменении ролей пользователя. Ролей из БД auth_api здесь нет,
+        поэтому токен с устаревшими ролями нужно перевыпустить.
+        """
+        if not any(role in roles for role in payload.get('roles', [])):
+            return False
+        user_id = payload['user_id']
+        version = await self.redis.get(
+            f'{settings.auth_role_version_key_prefix}{user_id}')
+        if payload.get('roles_version') != int(version or 0):
+            logger.info('Roles claim of user [%s] is stale', user_id)
+            return False
+        return True
+
+
+deny_list = DenyList()
+token_cache = TokenCache(settings.auth_token_cache_size)
+jwks_keys = JwksKeys()
+
 
 @lru_cache()
 def get_auth_service(
@@ -55,10 +310,15 @@ def get_auth_service(
 ) -> AuthService:
     return AuthService(
         redis=redis,
+        deny_list=deny_list,
+        token_cache=token_cache,
+        jwks_keys=jwks_keys,
     )
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/signin")
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/signin",
+                                              auto_error=False)
 
 
 async def get_current_user_data(
@@ -70,3 +330,42 @@ async def get_current_user_data(
     except UnAuthException:
         raise HTTPException(status_code=403, detail='Token not valid')
     return payload
+
+
+async def get_current_admin_data(
+        request: Request,
+        auth_service: AuthService = Depends(get_auth_service),
+        token=Depends(oauth2_scheme_optional),
+) -> dict:
+    """
+    Администратор: токен с действующей ролью admin из заголовка
+    или из сессии админки (см. AdminAuth).
+    """
+    token = token or request.session.get('token')
+    try:
+        if not token:
+            raise UnAuthException
+        payload = await auth_service.check_token(token, 'access')
+        if not await auth_service.has_role(payload, ['admin']):
+            raise UnAuthException
+    except UnAuthException:
+        raise HTTPException(status_code=403, detail='Token not valid')
+    return payload
+
+
+async def is_service(auth_service: AuthService, payload: dict) -> bool:
+    return await auth_service.has_role(payload,
+                                       settings.service_roles.split(','))
+
+
+async def get_current_service_data(
+        auth_service: AuthService = Depends(get_auth_service),
+        payload: dict = Depends(get_current_user_data),
+) -> dict:
+    """
+    Вызов от другого сервиса: токен его учетной записи в auth_api
+    с одной из ролей service_roles.
+    """
+    if not await is_service(auth_service, payload):
+        raise HTTPException(status_code=403, detail='Service role required')
+    return payload
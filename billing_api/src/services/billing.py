@@ -1,27 +1,53 @@
 import datetime
 import logging
 import uuid
-from datetime import timedelta
+from typing import Union
 
 from fastapi import Depends, HTTPException, status
-from yookassa import Configuration, Payment
+from sqlalchemy import func, literal, select, true, update
+from sqlalchemy.dialects.postgresql import UUID, insert
 
 from core.config import settings
+from core.metrics import PAYMENT_STATUS_MISSES, observe_payment_transitions
 from db.postgres import DbService, get_session
 from models.base import Subscriptions, Payments, PaymentStatus, \
     UserSubscriptions
+from services.catalog import SubscriptionCatalog, SubscriptionPlan, \
+    get_catalog
+from services.entitlements import EntitlementStore, get_entitlement_store
+from services.gateway import AbstractPaymentGateway, GatewayError, \
+    GatewayNotSentError, GatewayPayment, get_gateway
+from services.outbox import OutboxService
+from services.revenue import RevenueService
 
 logger = logging.getLogger('billing_api')
 
-Configuration.configure(
-    settings.yookassa_shop_id,
-    settings.yookassa_secret_key
-)
+# Пространство имен ключей идемпотентности списаний за продление
+RENEWAL_NAMESPACE = uuid.UUID('6f1d2c8e-4b7a-4e59-9a3d-2c5e8b1f0a74')
 
 
 class BillingService:
-    def __init__(self, db: DbService):
+    def __init__(self, db: DbService, gateway: AbstractPaymentGateway,
+                 catalog: SubscriptionCatalog,
+                 entitlements: EntitlementStore):
         self.db = db
+        self.gateway = gateway
+        self.catalog = catalog
+        self.entitlements = entitlements
+        self.revenue = RevenueService(db)
+        self.outbox = OutboxService(db)
+
+    async def _create_gateway_payment(
+            self, payload: dict,
+            idempotence_key: Union[None, uuid.UUID] = None,
+    ) -> GatewayPayment:
+        try:
+            return await self.gateway.create_payment(
+                payload, idempotence_key or uuid.uuid4())
+        except GatewayError as err:
+            logger.error('Failed to create gateway payment: %s', err)
+            raise HTTPException(status.HTTP_502_BAD_GATEWAY,
+                                'Платежный сервис недоступен') from err
 
     async def _get_pending_payment(self,
                                    service_payment_id: uuid.UUID,
@@ -34,7 +60,8 @@ class BillingService:
             [
                 (Payments.service_payment_id, service_payment_id),
                 (Payments.status, payment_status)
-            ]
+            ],
+            primary=True,
         )
         return payments_data[0]
 
@@ -46,7 +73,8 @@ class BillingService:
             UserSubscriptions,
             [
                 (UserSubscriptions.id, user_subscription_id),
-            ]
+            ],
+            primary=True,
         )
         if not user_subscribe_data:
             raise HTTPException(status.HTTP_400_BAD_REQUEST,
@@ -59,78 +87,104 @@ class BillingService:
             subscription_id: uuid.UUID,
             yookassa_payment_id: uuid.UUID,
             price: int,
-            payment_status: PaymentStatus = PaymentStatus.pending
+            payment_status: PaymentStatus = PaymentStatus.pending,
+            payment_method_id: Union[None, uuid.UUID] = None,
     ) -> Payments:
         return await self.db.insert(
             Payments,
             {
                 'service_payment_id': yookassa_payment_id,
+                'payment_method_id': payment_method_id,
                 "user_id": user_id,
                 'subscription_id': subscription_id,
                 'price': price,
                 'status': payment_status,
-                'date_create': datetime.datetime.now()
+                'date_create': datetime.datetime.now(datetime.timezone.utc)
             }
         )
 
     async def _get_subscription(
             self,
             subscription_id: uuid.UUID
-    ) -> Subscriptions:
-        try:
-            subscription_data = await self.db.select(
-                Subscriptions,
-                where_select=[(Subscriptions.id, subscription_id)]
-            )
-            return subscription_data[0]
-        except Exception:
+    ) -> SubscriptionPlan:
+        """
+        Тариф берется из каталога в памяти. В БД идем только за тарифом,
+        которого в каталоге еще нет (создан, а уведомление не дошло).
+        """
+        subscription = self.catalog.get(subscription_id)
+        if subscription is not None:
+            return subscription
+        subscription_data = await self.db.select(
+            Subscriptions,
+            where_select=[(Subscriptions.id, subscription_id)],
+            primary=True,
+        )
+        if not subscription_data:
             raise HTTPException(404, 'Подписка с таким id не существует')
+        return self.catalog.add(subscription_data[0])
 
     async def _increase_user_subscribe_time(self, subscription_id: uuid.UUID,
                                             user_id: uuid.UUID,
                                             payment_id: uuid.UUID):
         """
-        Создает пользовательскую подписку или продлевает ее
+        Создает пользовательскую подписку или продлевает ее одним upsert.
+        Новый срок считается в БД: GREATEST(expiration_time, now()) +
+        длительность тарифа, поэтому параллельные вебхуки не теряют продление.
         """
-        subscription = await self._get_subscription(subscription_id)
-        user_subscribe_data = await self.db.select(
-            UserSubscriptions,
+        duration = func.make_interval(0, 0, 0, Subscriptions.duration * 30)
+        new_user_subscribe = select(
+            literal(uuid.uuid4(), UUID(as_uuid=True)),
+            literal(user_id, UUID(as_uuid=True)),
+            Subscriptions.id,
+            literal(payment_id, UUID(as_uuid=True)),
+            true(),
+            func.now() + duration,
+            true(),
+        ).where(Subscriptions.id == subscription_id)
+
+        sql = insert(UserSubscriptions).from_select(
             [
-                (UserSubscriptions.user_id, user_id),
-                (UserSubscriptions.subscription_id, subscription_id)
-            ]
+                'id', 'user_id', 'subscription_id', 'payment_id',
+                'is_active', 'expiration_time', 'auto_prolongate',
+            ],
+            new_user_subscribe,
         )
-        if not user_subscribe_data:
-            user_subscribe = await self.db.insert(
-                UserSubscriptions,
-                {
-                    'user_id': user_id,
-                    'subscription_id': subscription_id,
-                    'payment_id': payment_id,
-                    'is_active': True,
-                    'expiration_time': datetime.datetime.now() + timedelta(
-                        subscription.duration * 30),
-                    'auto_prolongate': True
-                }
-            )
-        else:
-            user_subscribe: UserSubscriptions = user_subscribe_data[0]
-            user_expiration_time = user_subscribe.expiration_time
-            if user_expiration_time < datetime.datetime.utcnow().replace(
-                    tzinfo=datetime.timezone.utc):
-                user_expiration_time = datetime.datetime.utcnow().replace(
-                    tzinfo=datetime.timezone.utc)
-
-            await self.db.update(
-                UserSubscriptions,
-                {
-                    'payment_id': payment_id,
-                    'is_active': True,
-                    'expiration_time': user_expiration_time + timedelta(
-                        subscription.duration * 30),
-                },
-                [UserSubscriptions.id, user_subscribe.id]
-            )
+        sql = sql.on_conflict_do_update(
+            index_elements=[UserSubscriptions.user_id,
+                            UserSubscriptions.subscription_id],
+            set_={
+                'payment_id': sql.excluded.payment_id,
+                'is_active': True,
+                'expiration_time': func.greatest(
+                    UserSubscriptions.expiration_time, func.now(),
+                ) + (sql.excluded.expiration_time - func.now()),
+            },
+        ).returning(
+            UserSubscriptions.user_id,
+            UserSubscriptions.subscription_id,
+            UserSubscriptions.expiration_time,
+        )
+        return await self.db.execute(sql)
+
+    async def _grant_entitlements(self, user_subscribes: list) -> None:
+        """
+        Переносит продленные подписки в проекцию Redis после коммита.
+        Ошибка Redis не отменяет платеж. Проекция без продления могла бы
+        жить до entitlements_ttl_seconds, поэтому она удаляется
+        и при следующем чтении догружается из БД.
+        """
+        if not user_subscribes:
+            return
+        try:
+            await self.entitlements.grant(user_subscribes)
+        except Exception as err:
+            logger.error('Failed to update entitlements: %r', err)
+            user_ids = [user_id for user_id, _, _ in user_subscribes]
+            try:
+                await self.entitlements.invalidate(user_ids)
+            except Exception as invalidate_err:
+                logger.error('Failed to invalidate entitlements of %s: %r',
+                             user_ids, invalidate_err)
 
     async def prolongate_subscribe(self, user_id: uuid.UUID,
                                    user_subscription_id: uuid.UUID) -> bool:
@@ -139,38 +193,204 @@ class BillingService:
         Возвращает True если получилось
         """
         user_subscribe = await self._get_user_subscribe(user_subscription_id)
-        if not user_subscribe.auto_prolongate:
+        if user_subscribe.user_id != user_id:
             raise HTTPException(status.HTTP_400_BAD_REQUEST,
-                                'Subscribtion not autoprolongate')
+                                'user_subscribe not exist')
+        return await self.prolongate_user_subscribe(user_subscribe)
+
+    @staticmethod
+    def renewal_idempotence_key(user_subscription_id: uuid.UUID,
+                                period: datetime.datetime) -> uuid.UUID:
+        """
+        Один ключ на подписку и период: повтор после таймаута шлюза
+        вернет тот же платеж, а не спишет деньги второй раз.
+        """
+        return uuid.uuid5(RENEWAL_NAMESPACE,
+                          f'{user_subscription_id}:{period.isoformat()}')
+
+    async def _claim_renewal(
+            self, user_subscribe: UserSubscriptions,
+    ) -> Union[None, datetime.datetime]:
+        """
+        Отмечает попытку продления за текущий период (expiration_time).
+        Возвращает период или None, если попытка за него уже была:
+        платеж еще pending или был отменен.
+        """
+        rows = await self.db.execute(
+            update(UserSubscriptions)
+            .where(
+                UserSubscriptions.id == user_subscribe.id,
+                UserSubscriptions.renewal_attempted_for.is_distinct_from(
+                    UserSubscriptions.expiration_time),
+            )
+            .values(renewal_attempted_for=UserSubscriptions.expiration_time)
+            .returning(UserSubscriptions.expiration_time)
+        )
+        return rows[0][0] if rows else None
+
+    async def _release_renewal(self, user_subscribe: UserSubscriptions,
+                               period: datetime.datetime) -> None:
+        await self.db.execute(
+            update(UserSubscriptions)
+            .where(
+                UserSubscriptions.id == user_subscribe.id,
+                UserSubscriptions.renewal_attempted_for == period,
+            )
+            .values(renewal_attempted_for=None)
+        )
+
+    async def _mark_renewal_unresolved(
+            self, user_subscribe: UserSubscriptions,
+            period: datetime.datetime,
+            since: Union[None, datetime.datetime] = None,
+    ) -> None:
+        """
+        Списание могло пройти, но не записано в БД: отметка о попытке
+        остается, а ProlongationScheduler довершает его тем же ключом
+        идемпотентности (см. resume_renewal).
+        """
+        logger.error('Renewal of user subscription %s for %s is unresolved',
+                     user_subscribe.id, period)
+        await self.db.execute(
+            update(UserSubscriptions)
+            .where(
+                UserSubscriptions.id == user_subscribe.id,
+                UserSubscriptions.renewal_attempted_for == period,
+            )
+            .values(renewal_unresolved_since=since or func.now())
+        )
+
+    async def _take_unresolved_renewal(
+            self, user_subscribe: UserSubscriptions,
+    ) -> Union[None, datetime.datetime]:
+        """
+        Снимает отметку о недовершенном списании. Возвращает период или
+        None, если отметку уже снял другой экземпляр планировщика.
+        """
+        since = UserSubscriptions.renewal_unresolved_since
+        period = UserSubscriptions.renewal_attempted_for
+        rows = await self.db.execute(
+            update(UserSubscriptions)
+            .where(
+                UserSubscriptions.id == user_subscribe.id,
+                since == user_subscribe.renewal_unresolved_since,
+                period == UserSubscriptions.expiration_time,
+            )
+            .values(renewal_unresolved_since=None)
+            .returning(UserSubscriptions.renewal_attempted_for)
+        )
+        return rows[0][0] if rows else None
 
+    async def _renewal_payload(
+            self, user_subscribe: UserSubscriptions,
+    ) -> tuple[SubscriptionPlan, uuid.UUID, dict]:
+        """
+        Тариф, способ оплаты и тело списания. Читается до отметки
+        о попытке, чтобы ошибка чтения ее не оставляла.
+        """
         subscription = await self._get_subscription(
             user_subscribe.subscription_id)
         last_payment_data = await self.db.select(Payments, [
-            (Payments.id, user_subscribe.payment_id)])
+            (Payments.id, user_subscribe.payment_id)], primary=True)
         last_payment: Payments = last_payment_data[0]
-
-        yookassa_payment = Payment.create({
+        # Способ оплаты - первый платеж с сохранением карты
+        payment_method_id = last_payment.payment_method_id or last_payment.service_payment_id
+        payload = {
             "amount": {
                 "value": f"{subscription.price}",
                 "currency": "RUB"
             },
             "capture": True,
-            "payment_method_id": f"{last_payment.service_payment_id}",
+            "payment_method_id": f"{payment_method_id}",
             "description": f"{subscription.title}"
-        })
+        }
+        return subscription, payment_method_id, payload
 
-        payment = await self._create_db_new_payment(
-            user_id, subscription.id, last_payment.service_payment_id,
-            subscription.price, yookassa_payment.status
-        )
-        if yookassa_payment.status == "succeeded":
-            await self._increase_user_subscribe_time(
-                subscription_id=payment.subscription_id,
-                user_id=payment.user_id,
-                payment_id=payment.id
-            )
-            return True
-        return False
+    async def _charge_renewal(
+            self,
+            user_subscribe: UserSubscriptions,
+            renewal: tuple[SubscriptionPlan, uuid.UUID, dict],
+            period: datetime.datetime,
+            unresolved_since: Union[None, datetime.datetime] = None,
+    ) -> bool:
+        """
+        Списание за период с ключом идемпотентности периода.
+
+        Отметка о попытке снимается, только если запрос не дошел
+        до кассы. Таймаут, отмена или ошибка после ответа кассы
+        оставляют период недовершенным: повтор с новой отметкой
+        после истечения ключа в кассе списал бы деньги второй раз.
+        """
+        subscription, payment_method_id, payload = renewal
+        try:
+            yookassa_payment = await self._create_gateway_payment(
+                payload, self.renewal_idempotence_key(user_subscribe.id, period))
+
+            user_subscribes = []
+            async with self.db.transaction():
+                payment = await self._create_db_new_payment(
+                    user_subscribe.user_id, subscription.id,
+                    yookassa_payment.id,
+                    subscription.price, yookassa_payment.status,
+                    payment_method_id,
+                )
+                await self.revenue.add_payments([payment])
+                await self.outbox.add_payments([payment])
+                if yookassa_payment.status == PaymentStatus.success:
+                    user_subscribes = await self._increase_user_subscribe_time(
+                        subscription_id=payment.subscription_id,
+                        user_id=payment.user_id,
+                        payment_id=payment.id
+                    )
+                    await self.outbox.add_subscriptions(user_subscribes)
+        except BaseException as err:
+            not_sent = isinstance(err.__cause__, GatewayNotSentError)
+            # Недовершенное списание остается отмеченным, даже если этот
+            # повтор не дошел до кассы: могла пройти первая попытка
+            if not_sent and unresolved_since is None:
+                await self._release_renewal(user_subscribe, period)
+            else:
+                await self._mark_renewal_unresolved(user_subscribe, period,
+                                                    unresolved_since)
+            raise
+        observe_payment_transitions('new', [payment])
+        await self._grant_entitlements(user_subscribes)
+        return yookassa_payment.status == PaymentStatus.success
+
+    async def prolongate_user_subscribe(
+            self,
+            user_subscribe: UserSubscriptions,
+    ) -> bool:
+        """
+        Списывает оплату за следующий период сохраненным способом оплаты.
+        Используется и ручкой /auto_prolongate, и планировщиком автопродлений.
+
+        За один период списание создается один раз, см. _charge_renewal.
+        """
+        if not user_subscribe.auto_prolongate:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST,
+                                'Subscribtion not autoprolongate')
+
+        renewal = await self._renewal_payload(user_subscribe)
+        period = await self._claim_renewal(user_subscribe)
+        if period is None:
+            raise HTTPException(status.HTTP_409_CONFLICT,
+                                'Renewal for this period already attempted')
+        return await self._charge_renewal(user_subscribe, renewal, period)
+
+    async def resume_renewal(self, user_subscribe: UserSubscriptions) -> bool:
+        """
+        Довершает списание, отмеченное как недовершенное: тот же ключ
+        идемпотентности вернет уже созданный кассой платеж, если он был.
+        """
+        renewal = await self._renewal_payload(user_subscribe)
+        period = await self._take_unresolved_renewal(user_subscribe)
+        if period is None:
+            raise HTTPException(status.HTTP_409_CONFLICT,
+                                'Renewal is already resumed')
+        return await self._charge_renewal(
+            user_subscribe, renewal, period,
+            user_subscribe.renewal_unresolved_since)
 
     async def create_new_payment(
             self,
@@ -183,7 +403,7 @@ class BillingService:
         Создает платеж в БД и возвращает ссылку на оплату.
         """
         subscription = await self._get_subscription(subscription_id)
-        yookassa_payment = Payment.create({
+        yookassa_payment = await self._create_gateway_payment({
             "description": f"Подписка  {subscription.title}",
             "amount": {
                 "value": subscription.price,
@@ -211,43 +431,124 @@ class BillingService:
             },
             "capture": True,
             "save_payment_method": True
-        }, uuid.uuid4())
+        })
 
-        await self._create_db_new_payment(
-            user_id,
-            subscription_id,
-            yookassa_payment.id,
-            subscription.price
+        async with self.db.transaction():
+            payment = await self._create_db_new_payment(
+                user_id,
+                subscription_id,
+                yookassa_payment.id,
+                subscription.price
+            )
+            await self.outbox.add_payments([payment])
+        observe_payment_transitions('new', [payment])
+
+        return yookassa_payment.confirmation_url
+
+    async def _update_pending_payments(
+            self,
+            statuses: dict[uuid.UUID, str],
+            filters: list,
+    ) -> list:
+        return await self.db.update_many(
+            Payments,
+            key='service_payment_id',
+            values_update=[
+                {'service_payment_id': payment_id, 'status': new_status}
+                for payment_id, new_status in statuses.items()
+            ],
+            where_update=[(Payments.status, PaymentStatus.pending)],
+            filters=filters,
+            returning=[
+                Payments.id,
+                Payments.service_payment_id,
+                Payments.user_id,
+                Payments.subscription_id,
+                Payments.status,
+                Payments.price,
+            ],
         )
 
-        return yookassa_payment.confirmation.confirmation_url
+    async def apply_payment_statuses(
+            self,
+            statuses: dict[uuid.UUID, str],
+            lookup_days: Union[None, int] = settings.payments_pending_lookup_days,
+    ) -> list:
+        """
+        Применяет пачку статусов от кассы: один UPDATE ... FROM (VALUES ...)
+        по ожидающим платежам и продление подписок по успешным,
+        все в одной транзакции. Возвращает обновленные платежи.
+
+        Платежи ищутся среди созданных за lookup_days дней (None - без
+        ограничения): окно по date_create оставляет в плане только
+        последние секции payments. Не найденные в окне ищутся повторно
+        по всей таблице, чтобы поздний вебхук не потерялся.
+        """
+        statuses = {
+            payment_id: new_status
+            for payment_id, new_status in statuses.items()
+            if new_status != PaymentStatus.pending
+        }
+        if not statuses:
+            return []
+
+        filters = []
+        if lookup_days is not None:
+            lookup = datetime.timedelta(days=lookup_days)
+            created_after = datetime.datetime.now(datetime.timezone.utc) - lookup
+            filters.append(Payments.date_create >= created_after)
+        user_subscribes = []
+        async with self.db.transaction():
+            payments = await self._update_pending_payments(statuses, filters)
+            missed = statuses.keys() - {
+                payment.service_payment_id for payment in payments}
+            if missed and filters:
+                late = await self._update_pending_payments(
+                    {payment_id: statuses[payment_id] for payment_id in missed},
+                    [],
+                )
+                if late:
+                    logger.warning(
+                        'Applied %s statuses to payments older than %s days',
+                        len(late), lookup_days)
+                    PAYMENT_STATUS_MISSES.labels('outside_window').inc(
+                        len(late))
+                missed -= {payment.service_payment_id for payment in late}
+                payments += late
+            if missed:
+                # Повторный вебхук по уже проведенному платежу или
+                # неизвестный платеж
+                logger.info('No pending payments for %s gateway statuses: %s',
+                            len(missed), sorted(map(str, missed))[:10])
+                PAYMENT_STATUS_MISSES.labels('not_pending').inc(len(missed))
+            await self.revenue.add_payments(payments)
+            await self.outbox.add_payments(payments)
+            for payment in payments:
+                if payment.status == PaymentStatus.success:
+                    user_subscribes += await self._increase_user_subscribe_time(
+                        subscription_id=payment.subscription_id,
+                        user_id=payment.user_id,
+                        payment_id=payment.id
+                    )
+            await self.outbox.add_subscriptions(user_subscribes)
+        observe_payment_transitions(PaymentStatus.pending, payments)
+        await self._grant_entitlements(user_subscribes)
+        return payments
 
     async def update_payment_status(self, yookassa_payment_id: uuid.UUID,
                                     new_status: str):
         """
         Обновляет статус платежа в бд и продлевает подписку в случае успеха
         """
-        try:
-            payment = await self._get_pending_payment(yookassa_payment_id,
-                                                      "pending")
-        except Exception:
-            return
-
-        if payment.status == "succeeded":
-            return
-
-        await self.db.update(Payments, {'status': new_status},
-                             [Payments.id, payment.id])
-
-        if new_status == "succeeded":
-            await self._increase_user_subscribe_time(
-                subscription_id=payment.subscription_id,
-                user_id=payment.user_id,
-                payment_id=payment.id
-            )
+        await self.apply_payment_statuses({yookassa_payment_id: new_status})
 
 
 def get_billing_service(
-        session=Depends(get_session)) -> BillingService:
+        session=Depends(get_session),
+        gateway: AbstractPaymentGateway = Depends(get_gateway),
+        catalog: SubscriptionCatalog = Depends(get_catalog),
+        entitlements: EntitlementStore = Depends(get_entitlement_store),
+) -> BillingService:
     db = DbService(db=session)
-    return BillingService(db=db)
+    return BillingService(db=db, gateway=gateway, catalog=catalog,
+                          entitlements=entitlements)
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import uuid
+from dataclasses import dataclass
+from typing import Union
+
+from redis.asyncio import Redis
+from sqlalchemy import select
+
+from db.postgres import async_session
+from models.base import Subscriptions
+
+logger = logging.getLogger('billing_api')
+
+
+@dataclass(frozen=True)
+class SubscriptionPlan:
+    id: uuid.UUID
+    title: str
+    price: float
+    duration: int  # Длительность подписки в месяцах
+
+    @classmethod
+    def from_model(cls, subscription: Subscriptions) -> 'SubscriptionPlan':
+        return cls(
+            id=subscription.id,
+            title=subscription.title,
+            price=subscription.price,
+            duration=subscription.duration,
+        )
+
+
+class SubscriptionCatalog:
+    """
+    Каталог тарифов в памяти процесса.
+
+    Загружается целиком при старте. Админка после правки тарифа
+    увеличивает версию в Redis и публикует ее в канал, а каждый воркер
+    перечитывает каталог, если версия новее его собственной.
+    """
+
+    channel = 'billing:subscriptions:invalidate'
+    version_key = 'billing:subscriptions:version'
+
+    def __init__(self) -> None:
+        self.version = -1
+        self._plans: dict[uuid.UUID, SubscriptionPlan] = {}
+        self._listener: Union[None, asyncio.Task] = None
+
+    def get(self, subscription_id: uuid.UUID) -> Union[None, SubscriptionPlan]:
+        return self._plans.get(subscription_id)
+
+    def add(self, subscription: Subscriptions) -> SubscriptionPlan:
+        plan = SubscriptionPlan.from_model(subscription)
+        self._plans[plan.id] = plan
+        return plan
+
+    async def load(self, version: int) -> None:
+        async with async_session() as session:
+            subscriptions = (await session.execute(select(Subscriptions))).scalars()
+            self._plans = {
+                subscription.id: SubscriptionPlan.from_model(subscription)
+                for subscription in subscriptions
+            }
+        self.version = version
+        logger.info('Subscriptions catalog loaded: version %s, %s plans',
+                    version, len(self._plans))
+
+    async def refresh(self, redis: Redis) -> None:
+        version = int(await redis.get(self.version_key) or 0)
+        if version != self.version:
+            await self.load(version)
+
+    async def _listen(self, redis: Redis) -> None:
+        while True:
+            try:
+                async with redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    # Догоняем изменения, пропущенные без подписки
+                    await self.refresh(redis)
+                    async for message in pubsub.listen():
+                        if message['type'] != 'message':
+                            continue
+                        version = int(message['data'])
+                        if version > self.version:
+                            await self.load(version)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Subscriptions catalog listener failed')
+                await asyncio.sleep(1)
+
+    async def start(self, redis: Redis) -> None:
+        await self.refresh(redis)
+        self._listener = asyncio.create_task(self._listen(redis))
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+
+    @classmethod
+    async def invalidate(cls, redis: Redis) -> None:
+        version = await redis.incr(cls.version_key)
+        await redis.publish(cls.channel, version)
+
+
+catalog = SubscriptionCatalog()
+
+
+async def get_catalog() -> SubscriptionCatalog:
+    return catalog
@@ -0,0 +1,226 @@
+import datetime
+import time
+import uuid
+from collections import defaultdict
+from functools import lru_cache
+from typing import Iterable, Union
+
+from fastapi import Depends
+from redis.asyncio import Redis
+from sqlalchemy import func, select
+
+from core.config import settings
+from db.postgres import DbService, get_session
+from db.redis import get_redis
+from models.base import UserSubscriptions
+
+# Поля хэша: subscription_id -> срок окончания (unix time). Срок пишется
+# только если он больше текущего, поэтому запоздавшая запись из БД не
+# откатывает свежее продление. Флаг '_' означает, что в хэше лежат все
+# подписки пользователя, а не только продленные после загрузки.
+MERGE_SCRIPT = """
+for i = 3, #ARGV, 2 do
+    local current = redis.call('HGET', KEYS[1], ARGV[i])
+    if not current or tonumber(current) < tonumber(ARGV[i + 1]) then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+if ARGV[2] == '1' then
+    redis.call('HSET', KEYS[1], '_', '1')
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# Поле удаляется, только если в нем срок не позже истекшего: продление,
+# записанное после деактивации, остается в проекции.
+REVOKE_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    local current = redis.call('HGET', KEYS[1], ARGV[i])
+    if current and tonumber(current) <= tonumber(ARGV[i + 1]) then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+return 1
+"""
+
+
+class EntitlementStore:
+    """
+    Проекция активных подписок пользователей в Redis.
+
+    Чтение - один HGETALL на пользователя (для пачки - один pipeline),
+    промахи догружаются одним запросом в Postgres и сохраняются.
+    """
+
+    key = 'billing:entitlements:{user_id}'
+    complete_field = b'_'
+
+    def __init__(self, redis: Redis,
+                 ttl: int = settings.entitlements_ttl_seconds) -> None:
+        self.redis = redis
+        self.ttl = ttl
+        self._merge = redis.register_script(MERGE_SCRIPT)
+        self._revoke = redis.register_script(REVOKE_SCRIPT)
+
+    def _key(self, user_id: uuid.UUID) -> str:
+        return self.key.format(user_id=user_id)
+
+    async def _store(self, pipe, user_id: uuid.UUID,
+                     subscriptions: Iterable[tuple[uuid.UUID, datetime.datetime]],
+                     complete: bool) -> None:
+        args = [self.ttl, int(complete)]
+        for subscription_id, expiration_time in subscriptions:
+            args += [str(subscription_id), expiration_time.timestamp()]
+        await self._merge(keys=[self._key(user_id)], args=args, client=pipe)
+
+    async def grant(
+            self,
+            rows: Iterable[tuple[uuid.UUID, uuid.UUID, datetime.datetime]],
+    ) -> None:
+        """
+        Записывает продления (user_id, subscription_id, expiration_time)
+        после коммита транзакции.
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id, subscription_id, expiration_time in rows:
+                await self._store(pipe, user_id,
+                                  [(subscription_id, expiration_time)],
+                                  complete=False)
+            await pipe.execute()
+
+    async def revoke(
+            self,
+            rows: Iterable[tuple[uuid.UUID, uuid.UUID, datetime.datetime]],
+    ) -> None:
+        """
+        Убирает истекшие подписки (user_id, subscription_id,
+        expiration_time) из проекции.
+        """
+        by_user = defaultdict(list)
+        for user_id, subscription_id, expiration_time in rows:
+            by_user[user_id] += [str(subscription_id),
+                                 expiration_time.timestamp()]
+        if not by_user:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id, args in by_user.items():
+                await self._revoke(keys=[self._key(user_id)], args=args,
+                                   client=pipe)
+            await pipe.execute()
+
+    async def invalidate(self, user_ids: Iterable[uuid.UUID]) -> None:
+        """
+        Удаляет проекции пользователей: следующее чтение догрузит их из БД.
+        """
+        keys = [self._key(user_id) for user_id in set(user_ids)]
+        if keys:
+            await self.redis.delete(*keys)
+
+    async def get_many(
+            self,
+            user_ids: list[uuid.UUID],
+    ) -> dict[uuid.UUID, Union[None, dict[uuid.UUID, float]]]:
+        """
+        Действующие подписки пользователей из Redis.
+        None - пользователя нет в проекции, нужно идти в БД.
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.hgetall(self._key(user_id))
+            projections = await pipe.execute()
+
+        now = time.time()
+        result = {}
+        for user_id, projection in zip(user_ids, projections):
+            if self.complete_field not in projection:
+                result[user_id] = None
+                continue
+            result[user_id] = {
+                uuid.UUID(field.decode()): float(expiration_time)
+                for field, expiration_time in projection.items()
+                if field != self.complete_field and float(expiration_time) > now
+            }
+        return result
+
+    async def load(
+            self,
+            user_ids: list[uuid.UUID],
+            rows: Iterable[tuple[uuid.UUID, uuid.UUID, datetime.datetime]],
+    ) -> None:
+        """
+        Сохраняет полный набор подписок пользователей, прочитанный из БД.
+        Пользователи без подписок тоже сохраняются, чтобы не ходить в БД
+        повторно.
+        """
+        by_user = {user_id: [] for user_id in user_ids}
+        for user_id, subscription_id, expiration_time in rows:
+            by_user[user_id].append((subscription_id, expiration_time))
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id, subscriptions in by_user.items():
+                await self._store(pipe, user_id, subscriptions, complete=True)
+            await pipe.execute()
+
+
+class EntitlementService:
+    def __init__(self, store: EntitlementStore, db: DbService) -> None:
+        self.store = store
+        self.db = db
+
+    async def _select_active(self, user_ids: list[uuid.UUID]) -> list:
+        sql = select(
+            UserSubscriptions.user_id,
+            UserSubscriptions.subscription_id,
+            UserSubscriptions.expiration_time,
+        ).where(
+            UserSubscriptions.user_id.in_(user_ids),
+            UserSubscriptions.is_active.is_(True),
+            UserSubscriptions.expiration_time > func.now(),
+        )
+        # Отставшая реплика безопасна: MERGE_SCRIPT не откатывает
+        # более поздний срок, уже записанный grant
+        return await self.db.read(sql)
+
+    async def get_entitlements(
+            self,
+            user_ids: list[uuid.UUID],
+    ) -> dict[uuid.UUID, dict[uuid.UUID, datetime.datetime]]:
+        """
+        Действующие подписки пользователей: user_id -> {subscription_id:
+        срок окончания}. Промахи проекции догружаются одним запросом.
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        projected = await self.store.get_many(user_ids)
+        result = {
+            user_id: {
+                subscription_id: datetime.datetime.fromtimestamp(
+                    expiration_time, datetime.timezone.utc)
+                for subscription_id, expiration_time in subscriptions.items()
+            }
+            for user_id, subscriptions in projected.items()
+            if subscriptions is not None
+        }
+
+        missed = [user_id for user_id in user_ids if user_id not in result]
+        if missed:
+            rows = await self._select_active(missed)
+            await self.store.load(missed, rows)
+            for user_id in missed:
+                result[user_id] = {}
+            for user_id, subscription_id, expiration_time in rows:
+                result[user_id][subscription_id] = expiration_time
+        return result
+
+
+@lru_cache()
+def get_entitlement_store(
+        redis: Redis = Depends(get_redis),
+) -> EntitlementStore:
+    return EntitlementStore(redis)
+
+
+def get_entitlement_service(
+        session=Depends(get_session),
+        store: EntitlementStore = Depends(get_entitlement_store),
+) -> EntitlementService:
+    return EntitlementService(store=store, db=DbService(db=session))
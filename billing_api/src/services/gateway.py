@@ -0,0 +1,192 @@
+import abc
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Union
+
+import aiohttp
+
+from core.config import settings
+from core.metrics import GATEWAY_ERRORS, GATEWAY_LATENCY
+
+logger = logging.getLogger('billing_api')
+
+
+class GatewayError(Exception):
+    pass
+
+
+class GatewayNotSentError(GatewayError):
+    """
+    Запрос не дошел до кассы: повтор не может создать второй платеж.
+    Остальные GatewayError (таймаут, обрыв, ответ с ошибкой) так
+    не считаются - касса могла успеть принять запрос.
+    """
+
+
+@dataclass
+class GatewayPayment:
+    id: str
+    status: str
+    confirmation_url: Union[str, None] = None
+
+    @classmethod
+    def from_response(cls, data: dict) -> 'GatewayPayment':
+        confirmation = data.get('confirmation') or {}
+        return cls(
+            id=data['id'],
+            status=data['status'],
+            confirmation_url=confirmation.get('confirmation_url'),
+        )
+
+
+class AbstractPaymentGateway(abc.ABC):
+    @abc.abstractmethod
+    async def create_payment(self, payload: dict,
+                             idempotence_key: uuid.UUID) -> GatewayPayment:
+        pass
+
+    @abc.abstractmethod
+    async def get_payment(self, payment_id: Union[str, uuid.UUID]) -> GatewayPayment:
+        pass
+
+    @abc.abstractmethod
+    async def close(self) -> None:
+        pass
+
+
+class YookassaGateway(AbstractPaymentGateway):
+    """
+    Асинхронный клиент API ЮKassa.
+
+    Держит пул keep-alive соединений, ограничивает число одновременных
+    запросов к провайдеру и прерывает вызов по таймауту, чтобы медленный
+    ответ кассы не останавливал event loop и не копил очередь запросов.
+    """
+
+    def __init__(
+            self,
+            api_url: str,
+            shop_id: str,
+            secret_key: str,
+            timeout: float,
+            connect_timeout: float,
+            max_concurrency: int,
+            pool_size: int,
+            keepalive_timeout: float,
+    ) -> None:
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self._auth = aiohttp.BasicAuth(shop_id, secret_key)
+        self._client_timeout = aiohttp.ClientTimeout(
+            total=timeout, connect=connect_timeout)
+        self._pool_size = pool_size
+        self._keepalive_timeout = keepalive_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session: Union[None, aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self._pool_size,
+                keepalive_timeout=self._keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                auth=self._auth,
+                timeout=self._client_timeout,
+            )
+        return self._session
+
+    async def _request(self, operation: str, method: str, path: str,
+                       json: Union[dict, None] = None,
+                       headers: Union[dict, None] = None) -> dict:
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            logger.error('Payment gateway concurrency limit exceeded')
+            GATEWAY_ERRORS.labels(operation, 'overloaded').inc()
+            raise GatewayNotSentError('Payment gateway is overloaded')
+        # Ожидание семафора не входит в задержку шлюза: это очередь
+        # внутри сервиса, а не время ответа кассы
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            session = self._get_session()
+            async with session.request(method, f'{self.api_url}{path}',
+                                       json=json,
+                                       headers=headers) as response:
+                try:
+                    data = await response.json(content_type=None)
+                except (ValueError, aiohttp.ContentTypeError) as err:
+                    # Например, HTML-страница 502 от прокси перед кассой
+                    body = (await response.text(errors='replace'))[:500]
+                    logger.error('Payment gateway returned non-JSON %s: %s',
+                                 response.status, body)
+                    GATEWAY_ERRORS.labels(operation, response.status).inc()
+                    raise GatewayError(
+                        f'Payment gateway responded {response.status}: '
+                        f'{body}') from err
+                if response.status >= 400:
+                    logger.error('Payment gateway error %s: %s',
+                                 response.status, data)
+                    GATEWAY_ERRORS.labels(operation, response.status).inc()
+                    raise GatewayError(
+                        f'Payment gateway responded {response.status}')
+                outcome = 'success'
+                return data
+        except asyncio.TimeoutError as err:
+            logger.error('Payment gateway request failed: %r', err)
+            GATEWAY_ERRORS.labels(operation, 'timeout').inc()
+            raise GatewayError('Payment gateway is unavailable') from err
+        except aiohttp.ClientConnectorError as err:
+            logger.error('Payment gateway request failed: %r', err)
+            GATEWAY_ERRORS.labels(operation, 'connection').inc()
+            raise GatewayNotSentError('Payment gateway is unavailable') from err
+        except aiohttp.ClientError as err:
+            logger.error('Payment gateway request failed: %r', err)
+            GATEWAY_ERRORS.labels(operation, 'connection').inc()
+            raise GatewayError('Payment gateway is unavailable') from err
+        finally:
+            GATEWAY_LATENCY.labels(operation, outcome).observe(
+                time.perf_counter() - started)
+            self._semaphore.release()
+
+    async def create_payment(self, payload: dict,
+                             idempotence_key: uuid.UUID) -> GatewayPayment:
+        data = await self._request(
+            'create_payment', 'POST', '/payments', json=payload,
+            headers={'Idempotence-Key': str(idempotence_key)},
+        )
+        return GatewayPayment.from_response(data)
+
+    async def get_payment(self, payment_id: Union[str, uuid.UUID]) -> GatewayPayment:
+        data = await self._request('get_payment', 'GET',
+                                   f'/payments/{payment_id}')
+        return GatewayPayment.from_response(data)
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+gateway: Union[None, AbstractPaymentGateway] = None
+
+
+def create_gateway() -> AbstractPaymentGateway:
+    return YookassaGateway(
+        api_url=settings.yookassa_api_url,
+        shop_id=settings.yookassa_shop_id,
+        secret_key=settings.yookassa_secret_key,
+        timeout=settings.gateway_timeout,
+        connect_timeout=settings.gateway_connect_timeout,
+        max_concurrency=settings.gateway_max_concurrency,
+        pool_size=settings.gateway_pool_size,
+        keepalive_timeout=settings.gateway_keepalive_timeout,
+    )
+
+
+async def get_gateway() -> Union[None, AbstractPaymentGateway]:
+    return gateway
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import uuid
+from typing import Union
+
+from fastapi import Depends
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+
+from core.config import settings
+from db.postgres import DbService, async_session
+from db.redis import get_redis
+from services.billing import BillingService
+from services.catalog import SubscriptionCatalog
+from services.entitlements import EntitlementStore
+from services.gateway import AbstractPaymentGateway
+
+logger = logging.getLogger('billing_api')
+
+
+class NotifyQueue:
+    """
+    Очередь вебхуков ЮKassa поверх Redis stream.
+
+    /notify только кладет в нее статус платежа, а воркер разбирает
+    сообщения пачками через consumer group и подтверждает их после commit.
+    Сообщения, которые так и не удалось обработать, переносятся
+    в dead_letter_stream для ручного разбора.
+    """
+
+    def __init__(self, redis: Redis) -> None:
+        self.redis = redis
+        self.stream = settings.notify_stream
+        self.group = settings.notify_group
+        self.dead_letter_stream = settings.notify_dead_letter_stream
+
+    async def put(self, payment_id: uuid.UUID, new_status: str) -> None:
+        await self.redis.xadd(
+            self.stream,
+            {'payment_id': str(payment_id), 'status': new_status},
+        )
+
+    async def create_group(self) -> None:
+        try:
+            await self.redis.xgroup_create(self.stream, self.group, id='0',
+                                           mkstream=True)
+        except ResponseError as err:
+            if 'BUSYGROUP' not in str(err):
+                raise
+
+    async def read(self, consumer: str, count: int, block_ms: int,
+                   pending: bool = False) -> list:
+        """
+        pending=True перечитывает сообщения, выданные этому consumer'у,
+        но не подтвержденные (например, после падения воркера).
+        """
+        response = await self.redis.xreadgroup(
+            self.group, consumer, {self.stream: '0' if pending else '>'},
+            count=count, block=None if pending else block_ms,
+        )
+        if not response:
+            return []
+        return response[0][1]
+
+    async def ack(self, message_ids: list) -> None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xack(self.stream, self.group, *message_ids)
+            pipe.xdel(self.stream, *message_ids)
+            await pipe.execute()
+
+    async def delivery_counts(self, consumer: str,
+                              messages: list) -> dict[bytes, int]:
+        """Сколько раз каждое сообщение выдавалось consumer'у (XPENDING)."""
+        # Сообщения пачки идут в порядке stream, так что первый и последний
+        # id ограничивают диапазон
+        entries = await self.redis.xpending_range(
+            self.stream, self.group, min=messages[0][0],
+            max=messages[-1][0], count=len(messages), consumername=consumer,
+        )
+        return {entry['message_id']: entry['times_delivered']
+                for entry in entries}
+
+    async def dead_letter(self, messages: list) -> None:
+        message_ids = [message_id for message_id, _ in messages]
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for message_id, fields in messages:
+                pipe.xadd(self.dead_letter_stream,
+                          {**fields, 'message_id': message_id})
+            pipe.xack(self.stream, self.group, *message_ids)
+            pipe.xdel(self.stream, *message_ids)
+            await pipe.execute()
+
+
+class NotifyWorker:
+    def __init__(
+            self,
+            queue: NotifyQueue,
+            gateway: AbstractPaymentGateway,
+            catalog: SubscriptionCatalog,
+            entitlements: EntitlementStore,
+            consumer: str = settings.notify_consumer,
+            batch_size: int = settings.notify_batch_size,
+            block_ms: int = settings.notify_block_ms,
+            max_deliveries: int = settings.notify_max_deliveries,
+    ) -> None:
+        self.queue = queue
+        self.gateway = gateway
+        self.catalog = catalog
+        self.entitlements = entitlements
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.max_deliveries = max_deliveries
+
+    @staticmethod
+    def _collect_statuses(messages: list) -> dict[uuid.UUID, str]:
+        statuses = {}
+        for message_id, fields in messages:
+            try:
+                payment_id = uuid.UUID(fields[b'payment_id'].decode())
+                new_status = fields[b'status'].decode()
+            except (KeyError, ValueError):
+                logger.error('Skip malformed notify message %s', message_id)
+                continue
+            statuses[payment_id] = new_status
+        return statuses
+
+    async def process(self, messages: list) -> None:
+        statuses = self._collect_statuses(messages)
+        async with async_session() as session:
+            billing_service = BillingService(db=DbService(db=session),
+                                             gateway=self.gateway,
+                                             catalog=self.catalog,
+                                             entitlements=self.entitlements)
+            payments = await billing_service.apply_payment_statuses(statuses)
+        await self.queue.ack([message_id for message_id, _ in messages])
+        logger.info('Notify batch: %s messages, %s payments updated',
+                    len(messages), len(payments))
+
+    async def process_each(self, messages: list) -> list:
+        """
+        Разбирает упавшую пачку по одному сообщению, чтобы сообщение
+        с постоянной ошибкой не держало остальные. Возвращает сообщения,
+        которые обработать не удалось: они остаются в pending.
+        """
+        failed = []
+        for message in messages:
+            try:
+                await self.process([message])
+            except Exception:
+                logger.exception('Failed to process notify message %s',
+                                 message[0])
+                failed.append(message)
+        return failed
+
+    async def dead_letter_exhausted(self, messages: list) -> None:
+        """
+        Без этого сообщение с постоянной ошибкой перечитывалось бы
+        из pending бесконечно и не давало разбирать stream дальше.
+        """
+        if not messages:
+            return
+        counts = await self.queue.delivery_counts(self.consumer, messages)
+        exhausted = [
+            (message_id, fields) for message_id, fields in messages
+            if counts.get(message_id, 0) >= self.max_deliveries
+        ]
+        if exhausted:
+            await self.queue.dead_letter(exhausted)
+            logger.error('Moved %s notify messages to %s after %s deliveries',
+                         len(exhausted), self.queue.dead_letter_stream,
+                         self.max_deliveries)
+
+    async def run(self) -> None:
+        await self.queue.create_group()
+        pending = True
+        while True:
+            messages = await self.queue.read(self.consumer, self.batch_size,
+                                             self.block_ms, pending=pending)
+            if not messages:
+                pending = False
+                continue
+            try:
+                await self.process(messages)
+                continue
+            except Exception:
+                logger.exception('Failed to process notify batch')
+            failed = await self.process_each(messages)
+            if not failed:
+                continue
+            pending = True
+            try:
+                await self.dead_letter_exhausted(failed)
+            except Exception:
+                logger.exception('Failed to dead-letter notify messages')
+            await asyncio.sleep(1)
+
+
+def get_notify_queue(
+        redis: Union[None, Redis] = Depends(get_redis),
+) -> NotifyQueue:
+    return NotifyQueue(redis=redis)
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import logging
+import uuid
+
+from redis.asyncio import Redis
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from core.config import settings
+from db.postgres import DbService, async_session
+from models.base import OutboxEvents
+
+logger = logging.getLogger('billing_api')
+
+
+class OutboxService:
+    """
+    Запись исходящих событий. Вызывается внутри транзакции
+    DbService.transaction(), которая меняет платежи и подписки,
+    поэтому событие сохраняется тогда и только тогда, когда сохранилось
+    изменение.
+    """
+
+    def __init__(self, db: DbService) -> None:
+        self.db = db
+
+    async def add_payments(self, payments: list) -> None:
+        """
+        Событие payment.<status> на каждый платеж. Строки payments:
+        id, user_id, subscription_id, status, price.
+        """
+        await self.db.insert_many(OutboxEvents, [
+            {
+                'event_type': f'payment.{payment.status}',
+                'aggregate_id': payment.id,
+                'payload': {
+                    'payment_id': str(payment.id),
+                    'user_id': str(payment.user_id),
+                    'subscription_id': str(payment.subscription_id),
+                    'status': payment.status,
+                    'price': payment.price,
+                },
+            }
+            for payment in payments
+        ])
+
+    async def add_subscriptions(self, user_subscribes: list) -> None:
+        """
+        Событие subscription.extended на каждую продленную подписку.
+        Строки user_subscribes: user_id, subscription_id, expiration_time.
+        """
+        await self.db.insert_many(OutboxEvents, [
+            {
+                'event_type': 'subscription.extended',
+                'aggregate_id': user_subscribe.user_id,
+                'payload': {
+                    'user_id': str(user_subscribe.user_id),
+                    'subscription_id': str(user_subscribe.subscription_id),
+                    'expiration_time':
+                        user_subscribe.expiration_time.isoformat(),
+                },
+            }
+            for user_subscribe in user_subscribes
+        ])
+
+    async def add_expired_subscriptions(self, user_subscribes: list) -> None:
+        """
+        Одно событие subscriptions.expired на пачку деактивированных
+        подписок. Строки user_subscribes: id, user_id, subscription_id,
+        expiration_time. aggregate_id - идентификатор пачки.
+        """
+        await self.db.insert_many(OutboxEvents, [{
+            'event_type': 'subscriptions.expired',
+            'aggregate_id': uuid.uuid4(),
+            'payload': {
+                'subscriptions': [
+                    {
+                        'user_subscription_id': str(user_subscribe.id),
+                        'user_id': str(user_subscribe.user_id),
+                        'subscription_id':
+                            str(user_subscribe.subscription_id),
+                        'expiration_time':
+                            user_subscribe.expiration_time.isoformat(),
+                    }
+                    for user_subscribe in user_subscribes
+                ],
+            },
+        }])
+
+
+class OutboxRelay:
+    """
+    Переносит события из outbox_events в Redis stream пачками.
+
+    Пачка берется FOR UPDATE SKIP LOCKED, публикуется одним pipeline
+    XADD и удаляется в той же транзакции, так что таблица не копит
+    обработанные строки. Если процесс упадет между XADD и commit,
+    пачка будет опубликована повторно: доставка at-least-once,
+    потребители отбрасывают повторы по полю id.
+    """
+
+    def __init__(
+            self,
+            redis: Redis,
+            session_factory: async_sessionmaker = async_session,
+            stream: str = settings.outbox_stream,
+            stream_maxlen: int = settings.outbox_stream_maxlen,
+            batch_size: int = settings.outbox_batch_size,
+            poll_interval: float = settings.outbox_poll_interval,
+    ) -> None:
+        self.redis = redis
+        self.session_factory = session_factory
+        self.stream = stream
+        self.stream_maxlen = stream_maxlen
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+
+    async def publish_batch(self) -> int:
+        async with self.session_factory() as session:
+            events = (await session.execute(
+                select(OutboxEvents)
+                .order_by(OutboxEvents.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )).scalars().all()
+            if not events:
+                return 0
+
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for outbox_event in events:
+                    pipe.xadd(
+                        self.stream,
+                        {
+                            'id': outbox_event.id,
+                            'type': outbox_event.event_type,
+                            'aggregate_id': str(outbox_event.aggregate_id),
+                            'payload': json.dumps(outbox_event.payload),
+                            'date_create':
+                                outbox_event.date_create.isoformat(),
+                        },
+                        maxlen=self.stream_maxlen,
+                        approximate=True,
+                    )
+                await pipe.execute()
+
+            await session.execute(delete(OutboxEvents).where(
+                OutboxEvents.id.in_([event.id for event in events])))
+            await session.commit()
+        return len(events)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                published = await self.publish_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Outbox relay batch failed')
+                published = 0
+            if published:
+                logger.debug('Outbox events published: %s', published)
+            # Полная пачка - в таблице, скорее всего, есть еще события
+            if published < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
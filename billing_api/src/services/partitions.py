@@ -0,0 +1,182 @@
+import datetime
+import logging
+import re
+from dataclasses import dataclass
+from typing import Union
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from core.config import settings
+from db.postgres import async_session
+
+logger = logging.getLogger('billing_api')
+
+BOUND_RE = re.compile(
+    r"FROM \((?:MINVALUE|'(?P<lower>[^']+)')\) TO \('(?P<upper>[^']+)'\)")
+
+
+def month_start(value: datetime.datetime, shift: int = 0) -> datetime.datetime:
+    month = value.year * 12 + value.month - 1 + shift
+    return datetime.datetime(month // 12, month % 12 + 1, 1,
+                             tzinfo=datetime.timezone.utc)
+
+
+def parse_bound(value: str) -> datetime.datetime:
+    # '2026-11-01 00:00:00+00' -> python 3.10 понимает только '+00:00'
+    if re.search(r'[+-]\d\d$', value):
+        value += ':00'
+    return datetime.datetime.fromisoformat(value)
+
+
+@dataclass
+class Partition:
+    name: str
+    lower: Union[None, datetime.datetime]  # None - MINVALUE
+    upper: Union[None, datetime.datetime]  # None - секция DEFAULT
+
+
+class PaymentsPartitionManager:
+    """
+    Обслуживание помесячных секций payments.
+
+    Заранее создает секции на months_ahead месяцев вперед, чтобы новые
+    платежи не попадали в секцию DEFAULT, и отсоединяет секции старше
+    retention_months: переносит их в схему archive_schema или удаляет.
+    Каждая операция идет в своей транзакции с lock_timeout, чтобы DDL
+    не выстраивал очередь из запросов за долгой транзакцией.
+    """
+
+    table = 'payments'
+    name_template = 'payments_y{year}m{month:02d}'
+
+    def __init__(
+            self,
+            session_factory: async_sessionmaker = async_session,
+            months_ahead: int = settings.payments_partitions_ahead,
+            retention_months: int = settings.payments_retention_months,
+            archive_schema: str = settings.payments_archive_schema,
+            lock_timeout: str = settings.payments_partitions_lock_timeout,
+    ) -> None:
+        self.session_factory = session_factory
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.archive_schema = archive_schema
+        self.lock_timeout = lock_timeout
+
+    async def _execute_ddl(self, *statements: str) -> None:
+        async with self.session_factory() as session:
+            await session.execute(text(
+                f"SET LOCAL lock_timeout = '{self.lock_timeout}'"))
+            for statement in statements:
+                await session.execute(text(statement))
+            await session.commit()
+
+    async def partitions(self) -> list[Partition]:
+        async with self.session_factory() as session:
+            await session.execute(text("SET LOCAL TIME ZONE 'UTC'"))
+            rows = (await session.execute(text("""
+                SELECT child.relname,
+                       pg_get_expr(child.relpartbound, child.oid)
+                FROM pg_inherits
+                JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+                WHERE pg_inherits.inhparent = CAST(:table AS regclass)
+            """), {'table': self.table})).all()
+
+        partitions = []
+        for name, bound in rows:
+            match = BOUND_RE.search(bound)
+            if match is None:
+                partitions.append(Partition(name, None, None))
+                continue
+            lower = match.group('lower')
+            partitions.append(Partition(
+                name,
+                parse_bound(lower) if lower else None,
+                parse_bound(match.group('upper')),
+            ))
+        return partitions
+
+    async def ensure_partitions(
+            self,
+            since: Union[None, datetime.datetime] = None,
+    ) -> list[str]:
+        """
+        Создает недостающие месячные секции от since (по умолчанию от
+        текущего месяца) до months_ahead месяцев вперед и секцию DEFAULT.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        partitions = await self.partitions()
+        covered_until = max(
+            (partition.upper for partition in partitions
+             if partition.upper is not None and partition.lower is None),
+            default=None,
+        )
+        existing = {partition.lower for partition in partitions}
+        created = []
+
+        start = month_start(since or now)
+        months = self._months_between(start, now) + self.months_ahead
+        for shift in range(months + 1):
+            lower = month_start(start, shift)
+            if lower in existing:
+                continue
+            if covered_until is not None and lower < covered_until:
+                continue
+            upper = month_start(lower, 1)
+            name = self.name_template.format(year=lower.year,
+                                             month=lower.month)
+            await self._execute_ddl(
+                f"CREATE TABLE {name} PARTITION OF {self.table} "
+                f"FOR VALUES FROM ('{lower.isoformat()}') "
+                f"TO ('{upper.isoformat()}')"
+            )
+            created.append(name)
+
+        if all(partition.upper is not None for partition in partitions):
+            await self._execute_ddl(
+                f"CREATE TABLE {self.table}_default "
+                f"PARTITION OF {self.table} DEFAULT")
+            created.append(f'{self.table}_default')
+
+        if created:
+            logger.info('Payments partitions created: %s', created)
+        return created
+
+    @staticmethod
+    def _months_between(start: datetime.datetime,
+                        end: datetime.datetime) -> int:
+        return max((end.year - start.year) * 12 + end.month - start.month, 0)
+
+    async def detach_expired(self, drop: bool = False) -> list[str]:
+        """
+        Отсоединяет секции, целиком лежащие старше retention_months.
+        Отсоединенная секция переносится в архивную схему или удаляется.
+        """
+        if self.retention_months <= 0:
+            return []
+        cutoff = month_start(datetime.datetime.now(datetime.timezone.utc),
+                             -self.retention_months)
+        detached = []
+        for partition in await self.partitions():
+            if partition.upper is None or partition.upper > cutoff:
+                continue
+            statements = [
+                f"ALTER TABLE {self.table} "
+                f"DETACH PARTITION {partition.name}",
+            ]
+            if drop:
+                statements.append(f"DROP TABLE {partition.name}")
+            else:
+                statements += [
+                    f"CREATE SCHEMA IF NOT EXISTS {self.archive_schema}",
+                    f"ALTER TABLE {partition.name} "
+                    f"SET SCHEMA {self.archive_schema}",
+                ]
+            await self._execute_ddl(*statements)
+            detached.append(partition.name)
+
+        if detached:
+            logger.info('Payments partitions %s: %s',
+                        'dropped' if drop else 'archived', detached)
+        return detached
@@ -0,0 +1,80 @@
+import base64
+import binascii
+import datetime
+import uuid
+from typing import Union
+
+from fastapi import Depends, HTTPException, status
+from sqlalchemy import and_, or_, select
+
+from db.postgres import DbService, get_session
+from models.base import Payments
+
+
+def encode_cursor(date_create: datetime.datetime, payment_id: uuid.UUID) -> str:
+    raw = f'{date_create.isoformat()}|{payment_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, uuid.UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        date_create, payment_id = raw.decode().split('|')
+        return (datetime.datetime.fromisoformat(date_create),
+                uuid.UUID(payment_id))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, 'Invalid cursor')
+
+
+class PaymentHistoryService:
+    """
+    История платежей пользователя, новые первыми.
+
+    Страницы идут по ключу (date_create, id) от курсора, поэтому любая
+    страница стоит как первая. Все нужные колонки есть в покрывающем
+    индексе ix_payments_user_history, запрос читает только индекс.
+    """
+
+    def __init__(self, db: DbService) -> None:
+        self.db = db
+
+    async def get_user_payments(
+            self,
+            user_id: uuid.UUID,
+            limit: int,
+            cursor: Union[None, str] = None,
+            payment_status: Union[None, str] = None,
+    ) -> tuple[list, Union[None, str]]:
+        sql = select(
+            Payments.id,
+            Payments.subscription_id,
+            Payments.price,
+            Payments.status,
+            Payments.date_create,
+        ).where(Payments.user_id == user_id)
+        if payment_status is not None:
+            sql = sql.where(Payments.status == payment_status)
+        if cursor is not None:
+            date_create, payment_id = decode_cursor(cursor)
+            # Отдельное условие на date_create задает границу диапазона
+            # в индексе
+            sql = sql.where(
+                Payments.date_create <= date_create,
+                or_(Payments.date_create < date_create,
+                    and_(Payments.date_create == date_create,
+                         Payments.id < payment_id)),
+            )
+        sql = sql.order_by(Payments.date_create.desc(),
+                           Payments.id.desc()).limit(limit + 1)
+        rows = await self.db.read(sql)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].date_create, rows[-1].id)
+        return rows, next_cursor
+
+
+def get_payment_history_service(
+        session=Depends(get_session),
+) -> PaymentHistoryService:
+    return PaymentHistoryService(db=DbService(db=session))
@@ -0,0 +1,182 @@
+import asyncio
+import datetime
+import logging
+import time
+from typing import AsyncIterator
+
+from fastapi import HTTPException, status
+from sqlalchemy import select, tuple_
+
+from core.config import settings
+from db.postgres import DbService, async_session
+from models.base import UserSubscriptions
+from services.billing import BillingService
+from services.catalog import SubscriptionCatalog
+from services.entitlements import EntitlementStore
+from services.gateway import AbstractPaymentGateway
+
+logger = logging.getLogger('billing_api')
+
+
+class ProlongationScheduler:
+    """
+    Находит подписки с автопродлением, истекающие в ближайшее окно
+    или недавно истекшие (catchup_hours), и продлевает их через
+    ограниченный пул воркеров.
+
+    Подписки читаются страницами по ключу (expiration_time, id) по
+    частичному индексу ix_user_subscriptions_auto_prolongate_expiration.
+    Списание за период создается один раз: подписки, для которых оно
+    уже было (платеж pending или отменен), пропускаются до смены
+    expiration_time, см. BillingService.prolongate_user_subscribe.
+    Недовершенные списания (касса могла списать, а платеж не записан)
+    повторяются тем же ключом идемпотентности, пока касса его помнит;
+    более старые ждут ручной сверки.
+    """
+
+    def __init__(
+            self,
+            gateway: AbstractPaymentGateway,
+            catalog: SubscriptionCatalog,
+            entitlements: EntitlementStore,
+            window_hours: int = settings.prolongation_window_hours,
+            catchup_hours: int = settings.prolongation_catchup_hours,
+            page_size: int = settings.prolongation_page_size,
+            concurrency: int = settings.prolongation_concurrency,
+            idempotence_key_hours: int = settings.gateway_idempotence_key_hours,
+    ) -> None:
+        self.gateway = gateway
+        self.catalog = catalog
+        self.entitlements = entitlements
+        self.window = datetime.timedelta(hours=window_hours)
+        self.catchup = datetime.timedelta(hours=catchup_hours)
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.idempotence_key_ttl = datetime.timedelta(
+            hours=idempotence_key_hours)
+
+    async def _pages(self) -> AsyncIterator[list[UserSubscriptions]]:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        since = now - self.catchup
+        until = now + self.window
+        last = None
+        while True:
+            sql = select(UserSubscriptions).where(
+                UserSubscriptions.auto_prolongate.is_(True),
+                UserSubscriptions.expiration_time >= since,
+                UserSubscriptions.expiration_time < until,
+                UserSubscriptions.renewal_attempted_for.is_distinct_from(
+                    UserSubscriptions.expiration_time),
+            )
+            if last is not None:
+                key = tuple_(UserSubscriptions.expiration_time,
+                             UserSubscriptions.id)
+                sql = sql.where(key > tuple_(last.expiration_time, last.id))
+            sql = sql.order_by(
+                UserSubscriptions.expiration_time,
+                UserSubscriptions.id,
+            ).limit(self.page_size)
+            # Отдельная короткая сессия на страницу, чтобы не держать
+            # соединение из пула на весь проход
+            async with async_session() as session:
+                page = list((await session.execute(sql)).scalars())
+            if page:
+                yield page
+            if len(page) < self.page_size:
+                return
+            last = page[-1]
+
+    async def _unresolved(self) -> list[UserSubscriptions]:
+        sql = select(UserSubscriptions).where(
+            UserSubscriptions.renewal_unresolved_since.is_not(None),
+        ).order_by(UserSubscriptions.renewal_unresolved_since)
+        async with async_session() as session:
+            return list((await session.execute(sql)).scalars())
+
+    async def _prolongate(self, user_subscribe: UserSubscriptions,
+                          stats: dict) -> None:
+        try:
+            async with async_session() as session:
+                billing_service = BillingService(
+                    db=DbService(db=session),
+                    gateway=self.gateway,
+                    catalog=self.catalog,
+                    entitlements=self.entitlements,
+                )
+                if user_subscribe.renewal_unresolved_since is None:
+                    succeeded = await billing_service.prolongate_user_subscribe(
+                        user_subscribe)
+                else:
+                    succeeded = await billing_service.resume_renewal(
+                        user_subscribe)
+        except HTTPException as err:
+            if err.status_code == status.HTTP_409_CONFLICT:
+                # Период уже взят другим экземпляром планировщика
+                stats['skipped'] += 1
+                return
+            logger.error('Failed to prolongate user subscription %s: %r',
+                         user_subscribe.id, err)
+            stats['failed'] += 1
+            return
+        except Exception as err:
+            logger.error('Failed to prolongate user subscription %s: %r',
+                         user_subscribe.id, err)
+            stats['failed'] += 1
+            return
+        stats['succeeded' if succeeded else 'pending'] += 1
+
+    async def _worker(self, queue: asyncio.Queue, stats: dict) -> None:
+        while True:
+            user_subscribe = await queue.get()
+            try:
+                await self._prolongate(user_subscribe, stats)
+            finally:
+                queue.task_done()
+
+    async def run_once(self) -> dict:
+        """
+        Один проход по окну истекающих подписок.
+        """
+        started = time.perf_counter()
+        stats = {'succeeded': 0, 'pending': 0, 'failed': 0, 'skipped': 0,
+                 'unresolved': 0}
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [
+            asyncio.create_task(self._worker(queue, stats))
+            for _ in range(self.concurrency)
+        ]
+        seen_users = set()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        expired_since = now - self.idempotence_key_ttl
+        try:
+            for user_subscribe in await self._unresolved():
+                if user_subscribe.renewal_unresolved_since < expired_since:
+                    logger.error('Renewal of user subscription %s needs '
+                                 'manual reconciliation', user_subscribe.id)
+                    stats['unresolved'] += 1
+                    continue
+                seen_users.add(user_subscribe.user_id)
+                await queue.put(user_subscribe)
+            async for page in self._pages():
+                for user_subscribe in page:
+                    if user_subscribe.user_id in seen_users:
+                        stats['skipped'] += 1
+                        continue
+                    seen_users.add(user_subscribe.user_id)
+                    await queue.put(user_subscribe)
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        logger.info('Prolongation pass finished in %.1fs: %s',
+                    time.perf_counter() - started, stats)
+        return stats
+
+    async def run(self, interval: int = settings.prolongation_interval_seconds) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception('Prolongation pass failed')
+            await asyncio.sleep(interval)
@@ -0,0 +1,170 @@
+import asyncio
+import datetime
+import logging
+import time
+import uuid
+from typing import AsyncIterator
+
+from sqlalchemy import exists, select, tuple_
+from sqlalchemy.orm import aliased
+
+from core.config import settings
+from db.postgres import DbService, async_session
+from models.base import Payments, PaymentStatus
+from services.billing import BillingService
+from services.catalog import SubscriptionCatalog
+from services.entitlements import EntitlementStore
+from services.gateway import AbstractPaymentGateway, GatewayError
+
+logger = logging.getLogger('billing_api')
+
+
+class RateLimiter:
+    """
+    Равномерно распределяет вызовы: не больше rate в секунду.
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(self._next, now) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class PendingPaymentsReconciler:
+    """
+    Сверяет с кассой платежи, которые дольше older_than_minutes остаются
+    в pending (вебхук не дошел).
+
+    Платежи читаются страницами по ключу (date_create, id) за последние
+    lookup_days дней. Это окно шире окна вебхуков и передается
+    в apply_payment_statuses, иначе платеж, зависший дольше
+    payments_pending_lookup_days, не обновился бы никогда.
+    Статусы страницы запрашиваются у кассы параллельно, не чаще rate_per_second, и применяются одной
+    пачкой через BillingService.apply_payment_statuses. Обновляются
+    только платежи, все еще ожидающие оплаты, поэтому повторный или
+    параллельный запуск и вебхук, пришедший во время сверки, ничего
+    не задваивают.
+
+    Платежи, чей service_payment_id есть и у другой строки, не сверяются:
+    старые продления записывали id исходного платежа, и его статус
+    в кассе ничего не говорит о продлении.
+    """
+
+    def __init__(
+            self,
+            gateway: AbstractPaymentGateway,
+            catalog: SubscriptionCatalog,
+            entitlements: EntitlementStore,
+            older_than_minutes: int = settings.reconcile_older_than_minutes,
+            lookup_days: int = settings.reconcile_lookup_days,
+            page_size: int = settings.reconcile_page_size,
+            concurrency: int = settings.reconcile_concurrency,
+            rate_per_second: float = settings.reconcile_rate_per_second,
+    ) -> None:
+        self.gateway = gateway
+        self.catalog = catalog
+        self.entitlements = entitlements
+        self.older_than = datetime.timedelta(minutes=older_than_minutes)
+        self.lookup_days = lookup_days
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate_per_second)
+
+    async def _pages(self) -> AsyncIterator[list]:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        since = now - datetime.timedelta(days=self.lookup_days)
+        until = now - self.older_than
+        other = aliased(Payments)
+        shared_id = exists().where(
+            other.service_payment_id == Payments.service_payment_id,
+            other.id != Payments.id,
+        )
+        last = None
+        while True:
+            sql = select(
+                Payments.id,
+                Payments.service_payment_id,
+                Payments.date_create,
+            ).where(
+                Payments.status == PaymentStatus.pending,
+                Payments.date_create >= since,
+                Payments.date_create < until,
+                ~shared_id,
+            )
+            if last is not None:
+                key = tuple_(Payments.date_create, Payments.id)
+                sql = sql.where(key > tuple_(last.date_create, last.id))
+            sql = sql.order_by(Payments.date_create,
+                               Payments.id).limit(self.page_size)
+            async with async_session() as session:
+                page = (await session.execute(sql)).all()
+            if page:
+                yield page
+            if len(page) < self.page_size:
+                return
+            last = page[-1]
+
+    async def _fetch_statuses(self, payment_ids: set[uuid.UUID],
+                              stats: dict) -> dict[uuid.UUID, str]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        statuses = {}
+
+        async def fetch(payment_id: uuid.UUID) -> None:
+            async with semaphore:
+                await self.rate_limiter.wait()
+                try:
+                    gateway_payment = await self.gateway.get_payment(payment_id)
+                except GatewayError as err:
+                    logger.error('Failed to reconcile payment %s: %r',
+                                 payment_id, err)
+                    stats['failed'] += 1
+                    return
+                except Exception:
+                    # Например, ответ кассы без нужных полей: остальные
+                    # платежи страницы сверяются дальше
+                    logger.exception('Failed to reconcile payment %s',
+                                     payment_id)
+                    stats['failed'] += 1
+                    return
+            statuses[payment_id] = gateway_payment.status
+
+        await asyncio.gather(*(fetch(payment_id) for payment_id in payment_ids))
+        return statuses
+
+    async def _apply(self, statuses: dict[uuid.UUID, str]) -> list:
+        async with async_session() as session:
+            billing_service = BillingService(
+                db=DbService(db=session),
+                gateway=self.gateway,
+                catalog=self.catalog,
+                entitlements=self.entitlements,
+            )
+            return await billing_service.apply_payment_statuses(
+                statuses, lookup_days=self.lookup_days)
+
+    async def run_once(self) -> dict:
+        """
+        Один проход по зависшим платежам.
+        """
+        started = time.perf_counter()
+        stats = {'checked': 0, 'updated': 0, 'pending': 0, 'failed': 0}
+        async for page in self._pages():
+            payment_ids = {payment.service_payment_id for payment in page}
+            stats['checked'] += len(payment_ids)
+            statuses = await self._fetch_statuses(payment_ids, stats)
+            stats['pending'] += sum(
+                status == PaymentStatus.pending
+                for status in statuses.values())
+            updated = await self._apply(statuses)
+            stats['updated'] += len(updated)
+        logger.info('Pending payments reconciled in %.1fs: %s',
+                    time.perf_counter() - started, stats)
+        return stats
@@ -0,0 +1,103 @@
+import datetime
+import uuid
+from collections import defaultdict
+from typing import Union
+
+from fastapi import Depends
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from db.postgres import DbService, get_session
+from models.base import PaymentStatus, RevenueDaily, RevenueMonthly
+
+
+class RevenueService:
+    """
+    Поддерживает помесячные и подневные итоги выручки, чтобы отчеты
+    читали готовые строки, а не группировали payments.
+    """
+
+    periods = {
+        'day': (RevenueDaily, RevenueDaily.day),
+        'month': (RevenueMonthly, RevenueMonthly.month),
+    }
+
+    def __init__(self, db: DbService) -> None:
+        self.db = db
+
+    async def _upsert(self, rollup, period_column: str, rows: list[dict]):
+        sql = insert(rollup).values(rows)
+        sql = sql.on_conflict_do_update(
+            index_elements=[period_column, 'subscription_id', 'status'],
+            set_={
+                'payments_count': rollup.payments_count + sql.excluded.payments_count,
+                'revenue': rollup.revenue + sql.excluded.revenue,
+            },
+        )
+        await self.db.execute(sql)
+
+    async def add_payments(self, payments: list) -> None:
+        """
+        Добавляет в итоги платежи, которые только что получили итоговый
+        статус. Строки payments: subscription_id, status, price.
+        Вызывается в транзакции, которая меняет статус платежей.
+        """
+        totals = defaultdict(lambda: [0, 0])
+        for payment in payments:
+            if payment.status == PaymentStatus.pending:
+                continue
+            total = totals[(payment.subscription_id, payment.status)]
+            total[0] += 1
+            total[1] += payment.price
+        if not totals:
+            return
+
+        day = datetime.datetime.now(datetime.timezone.utc).date()
+        for rollup, period_column, period in (
+                (RevenueDaily, 'day', day),
+                (RevenueMonthly, 'month', day.replace(day=1)),
+        ):
+            await self._upsert(rollup, period_column, [
+                {
+                    period_column: period,
+                    'subscription_id': subscription_id,
+                    'status': payment_status,
+                    'payments_count': payments_count,
+                    'revenue': revenue,
+                }
+                # Один порядок строк во всех транзакциях - без взаимных блокировок
+                for (subscription_id, payment_status), (payments_count, revenue)
+                in sorted(totals.items(), key=lambda item: str(item[0]))
+            ])
+
+    async def get_revenue(
+            self,
+            period: str,
+            date_from: Union[None, datetime.date] = None,
+            date_to: Union[None, datetime.date] = None,
+            subscription_id: Union[None, uuid.UUID] = None,
+            payment_status: Union[None, str] = None,
+    ) -> list:
+        rollup, period_column = self.periods[period]
+        sql = select(
+            period_column.label('period'),
+            rollup.subscription_id,
+            rollup.status,
+            rollup.payments_count,
+            rollup.revenue,
+        )
+        if date_from is not None:
+            sql = sql.where(period_column >= date_from)
+        if date_to is not None:
+            sql = sql.where(period_column <= date_to)
+        if subscription_id is not None:
+            sql = sql.where(rollup.subscription_id == subscription_id)
+        if payment_status is not None:
+            sql = sql.where(rollup.status == payment_status)
+        sql = sql.order_by(period_column, rollup.subscription_id,
+                           rollup.status)
+        return await self.db.read(sql)
+
+
+def get_revenue_service(session=Depends(get_session)) -> RevenueService:
+    return RevenueService(db=DbService(db=session))
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import time
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from core.config import settings
+from db.postgres import DbService, async_session
+from models.base import UserSubscriptions
+from services.entitlements import EntitlementStore
+from services.outbox import OutboxService
+
+logger = logging.getLogger('billing_api')
+
+
+class ExpiredSubscriptionsSweeper:
+    """
+    Снимает is_active с истекших подписок пачками по batch_size.
+
+    Пачка выбирается по частичному индексу
+    ix_user_subscriptions_active_expiration с FOR UPDATE SKIP LOCKED:
+    строки, которые сейчас продлеваются, пропускаются, а несколько
+    экземпляров чистильщика не мешают друг другу. В той же транзакции
+    в outbox пишется одно событие subscriptions.expired на пачку.
+    После commit подписки убираются из проекции в Redis.
+    """
+
+    def __init__(
+            self,
+            entitlements: EntitlementStore,
+            session_factory: async_sessionmaker = async_session,
+            batch_size: int = settings.sweeper_batch_size,
+    ) -> None:
+        self.entitlements = entitlements
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+
+    def _sweep_sql(self):
+        expired = select(UserSubscriptions.id).where(
+            UserSubscriptions.is_active,
+            UserSubscriptions.expiration_time <= func.now(),
+        ).order_by(
+            UserSubscriptions.expiration_time,
+        ).limit(self.batch_size).with_for_update(skip_locked=True)
+        return update(UserSubscriptions).where(
+            UserSubscriptions.id.in_(expired),
+        ).values(is_active=False).returning(
+            UserSubscriptions.id,
+            UserSubscriptions.user_id,
+            UserSubscriptions.subscription_id,
+            UserSubscriptions.expiration_time,
+        ).execution_options(synchronize_session=False)
+
+    async def sweep_batch(self) -> int:
+        async with self.session_factory() as session:
+            db = DbService(db=session)
+            async with db.transaction():
+                user_subscribes = await db.execute(self._sweep_sql())
+                if user_subscribes:
+                    await OutboxService(db).add_expired_subscriptions(
+                        user_subscribes)
+        await self.entitlements.revoke(
+            (user_subscribe.user_id, user_subscribe.subscription_id,
+             user_subscribe.expiration_time)
+            for user_subscribe in user_subscribes
+        )
+        return len(user_subscribes)
+
+    async def run_once(self) -> int:
+        """
+        Один проход: пачки до тех пор, пока последняя не окажется неполной.
+        """
+        started = time.perf_counter()
+        swept = 0
+        while True:
+            count = await self.sweep_batch()
+            swept += count
+            if count < self.batch_size:
+                break
+        logger.info('Expired subscriptions swept in %.1fs: %s',
+                    time.perf_counter() - started, swept)
+        return swept
+
+    async def run(self, interval: int = settings.sweeper_interval_seconds) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception('Expired subscriptions sweep failed')
+            await asyncio.sleep(interval)
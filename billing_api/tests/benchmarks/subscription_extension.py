@@ -0,0 +1,168 @@
+"""
+Замер обращений к БД на одно продление подписки после успешного платежа.
+
+Сравнивает прежнюю схему _increase_user_subscribe_time (SELECT тарифа,
+SELECT подписки, INSERT или UPDATE со своим commit) с одним upsert
+из BillingService. Половина платежей приходится на пользователей,
+у которых подписка уже есть, чтобы проверить обе ветки.
+
+Запуск из директории billing_api на базе с примененными миграциями:
+
+    PYTHONPATH=src python -m tests.benchmarks.subscription_extension --payments 1000
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import time
+import uuid
+
+from sqlalchemy import delete, event, select, update
+
+from db.postgres import DbService, async_session, engine
+from models.base import Payments, PaymentStatus, Subscriptions, \
+    UserSubscriptions
+from services.billing import BillingService
+from services.catalog import catalog
+
+
+class RoundTripCounter:
+    def __init__(self) -> None:
+        self.statements = 0
+        self.commits = 0
+        event.listen(engine.sync_engine, 'before_cursor_execute',
+                     self._on_execute)
+        event.listen(engine.sync_engine, 'commit', self._on_commit)
+
+    def _on_execute(self, *args) -> None:
+        self.statements += 1
+
+    def _on_commit(self, *args) -> None:
+        self.commits += 1
+
+    def reset(self) -> None:
+        self.statements = 0
+        self.commits = 0
+
+
+async def legacy_increase(session, subscription_id: uuid.UUID,
+                          user_id: uuid.UUID, payment_id: uuid.UUID) -> None:
+    """Прежняя реализация продления: чтение, решение в Python, запись."""
+    subscription = (await session.execute(
+        select(Subscriptions).where(Subscriptions.id == subscription_id)
+    )).scalar_one()
+    user_subscribe = (await session.execute(
+        select(UserSubscriptions).where(
+            UserSubscriptions.user_id == user_id,
+            UserSubscriptions.subscription_id == subscription_id,
+        )
+    )).scalars().first()
+    duration = datetime.timedelta(subscription.duration * 30)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if user_subscribe is None:
+        session.add(UserSubscriptions(
+            id=uuid.uuid4(),
+            user_id=user_id,
+            subscription_id=subscription_id,
+            payment_id=payment_id,
+            is_active=True,
+            expiration_time=now + duration,
+            auto_prolongate=True,
+        ))
+    else:
+        await session.execute(
+            update(UserSubscriptions)
+            .where(UserSubscriptions.id == user_subscribe.id)
+            .values(
+                payment_id=payment_id,
+                is_active=True,
+                expiration_time=max(user_subscribe.expiration_time, now) + duration,
+            )
+        )
+    await session.commit()
+
+
+async def upsert_increase(session, subscription_id: uuid.UUID,
+                          user_id: uuid.UUID, payment_id: uuid.UUID) -> None:
+    billing_service = BillingService(db=DbService(db=session), gateway=None,
+                                     catalog=catalog, entitlements=None)
+    await billing_service._increase_user_subscribe_time(
+        subscription_id=subscription_id,
+        user_id=user_id,
+        payment_id=payment_id,
+    )
+
+
+async def seed_payments(subscription_id: uuid.UUID, count: int) -> list:
+    users = [uuid.uuid4() for _ in range(max(count // 2, 1))]
+    payments = [
+        Payments(
+            id=uuid.uuid4(),
+            service_payment_id=uuid.uuid4(),
+            user_id=users[number % len(users)],
+            subscription_id=subscription_id,
+            price=100,
+            status=PaymentStatus.success,
+        )
+        for number in range(count)
+    ]
+    async with async_session() as session:
+        session.add_all(payments)
+        await session.commit()
+    return payments
+
+
+async def run_strategy(strategy, counter: RoundTripCounter,
+                       subscription_id: uuid.UUID, count: int) -> dict:
+    payments = await seed_payments(subscription_id, count)
+    counter.reset()
+    started = time.perf_counter()
+    async with async_session() as session:
+        for payment in payments:
+            await strategy(session, subscription_id, payment.user_id,
+                           payment.id)
+    elapsed = time.perf_counter() - started
+    result = {
+        'statements_per_payment': counter.statements / count,
+        'commits_per_payment': counter.commits / count,
+        'seconds': round(elapsed, 3),
+        'payments_per_second': round(count / elapsed, 1),
+    }
+    async with async_session() as session:
+        await session.execute(delete(UserSubscriptions).where(
+            UserSubscriptions.subscription_id == subscription_id))
+        await session.commit()
+    return result
+
+
+async def main(count: int) -> None:
+    subscription = Subscriptions(id=uuid.uuid4(),
+                                 title=f'benchmark-{uuid.uuid4()}',
+                                 price=100, duration=1)
+    async with async_session() as session:
+        session.add(subscription)
+        await session.commit()
+
+    counter = RoundTripCounter()
+    report = {'payments': count}
+    try:
+        report['legacy'] = await run_strategy(legacy_increase, counter,
+                                              subscription.id, count)
+        report['upsert'] = await run_strategy(upsert_increase, counter,
+                                              subscription.id, count)
+    finally:
+        async with async_session() as session:
+            await session.execute(delete(Payments).where(
+                Payments.subscription_id == subscription.id))
+            await session.execute(delete(Subscriptions).where(
+                Subscriptions.id == subscription.id))
+            await session.commit()
+        await engine.dispose()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--payments', type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.payments))
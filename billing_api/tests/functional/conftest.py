@@ -0,0 +1,92 @@
+"""
+Проверка планов запросов billing_api на синтетических данных.
+
+Нужна отдельная пустая база Postgres: схема создается по моделям,
+таблицы очищаются и заполняются заново. Запуск из директории billing_api:
+
+    PYTHONPATH=src:. pytest tests/functional
+"""
+import asyncio
+import datetime
+from typing import AsyncGenerator
+
+import pytest_asyncio
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, \
+    async_sessionmaker
+
+from models.base import Base
+from services.partitions import PaymentsPartitionManager
+from tests.functional.settings import settings
+
+
+@pytest_asyncio.fixture(scope='session')
+def event_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+async def db_prepare(engine: AsyncEngine):
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    # Секции под весь период синтетических платежей (до года назад)
+    since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=400)
+    await PaymentsPartitionManager(
+        session_factory=async_sessionmaker(engine),
+        retention_months=0,
+    ).ensure_partitions(since=since)
+    async with engine.begin() as connection:
+        await connection.execute(text(
+            'TRUNCATE user_subscriptions, payments, subscriptions'))
+        await connection.execute(text("""
+            INSERT INTO subscriptions (id, title, price, duration)
+            SELECT gen_random_uuid(), 'plan-' || n, 100 * n, n
+            FROM generate_series(1, 5) AS n
+        """))
+        # У каждого пользователя несколько успешных платежей
+        # и один ожидающий
+        await connection.execute(text("""
+            INSERT INTO payments (id, service_payment_id, user_id,
+                                  subscription_id, price, status, date_create)
+            SELECT gen_random_uuid(), gen_random_uuid(),
+                   ('00000000-0000-0000-0000-' || lpad(to_hex(u), 12, '0'))::uuid,
+                   (array(SELECT id FROM subscriptions ORDER BY title))[1 + u % 5],
+                   100,
+                   CASE WHEN p < :payments THEN 'succeeded' ELSE 'pending' END,
+                   now() - (u % 365) * interval '1 day' - p * interval '1 hour'
+            FROM generate_series(1, :users) AS u,
+                 generate_series(1, :payments) AS p
+        """), {'users': settings.seed_users,
+               'payments': settings.seed_payments_per_user})
+        await connection.execute(text("""
+            INSERT INTO user_subscriptions (id, user_id, subscription_id,
+                                            payment_id, is_active,
+                                            expiration_time, auto_prolongate)
+            SELECT DISTINCT ON (user_id)
+                   gen_random_uuid(), user_id, subscription_id, id, true,
+                   date_create + interval '30 days',
+                   get_byte(uuid_send(id), 0) % 2 = 0
+            FROM payments
+            WHERE status = 'succeeded'
+            ORDER BY user_id, date_create DESC
+        """))
+    async with engine.connect() as connection:
+        await connection.execution_options(isolation_level='AUTOCOMMIT')
+        await connection.execute(text('ANALYZE'))
+
+
+@pytest_asyncio.fixture(name='db_engine', scope='session')
+async def db_engine() -> AsyncGenerator[AsyncEngine, None]:
+    engine = create_async_engine(settings.dsl_database, echo=False,
+                                 future=True)
+    await db_prepare(engine)
+    yield engine
+    await engine.dispose()
+
+
+@pytest_asyncio.fixture(name='db_session', scope='function')
+async def db_session(db_engine: AsyncEngine):
+    async_session = async_sessionmaker(db_engine, expire_on_commit=False)
+    async with async_session() as session:
+        yield session
@@ -0,0 +1,32 @@
+import pytest
+from pydantic_settings import BaseSettings
+
+pytestmark = pytest.mark.asyncio
+
+
+class Settings(BaseSettings):
+    postgres_user: str
+    postgres_password: str
+    postgres_host: str = '127.0.0.1'
+    postgres_port: int = 5432
+    postgres_db: str = 'billing_db'
+
+    # Объем синтетических данных: на маленьких таблицах планировщик
+    # законно выбирает Seq Scan, и проверка ничего бы не показала.
+    # payments разбита на секции по месяцам, и каждая секция - около
+    # двенадцатой части таблицы
+    seed_users: int = 500_000
+    seed_payments_per_user: int = 3
+    # Seq Scan по таблице меньше этого числа строк не считается ошибкой
+    seq_scan_rows_limit: int = 1000
+
+    @property
+    def dsl_database(self) -> str:
+        return (f"postgresql+asyncpg://{self.postgres_user}:{self.postgres_password}"
+                f"@{self.postgres_host}:{self.postgres_port}/{self.postgres_db}")
+
+    class Config:
+        env_prefix = 'BILLING_API_'
+
+
+settings = Settings()
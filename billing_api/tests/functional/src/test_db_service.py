@@ -0,0 +1,83 @@
+import uuid
+
+from sqlalchemy import delete, func, select
+
+from db.postgres import DbService
+from models.base import Payments, PaymentStatus, Subscriptions
+from tests.functional.settings import pytestmark
+from tests.functional.utils.plans import capture_statements
+
+
+@pytestmark
+async def test_select_in_splits_long_lists(db_engine, db_session):
+    # Arrange
+    db_service = DbService(db=db_session)
+    user_ids = [uuid.UUID(int=n) for n in range(1, 25_001)]
+    expected = (await db_session.execute(
+        select(func.count()).select_from(Payments)
+        .where(Payments.user_id.in_(user_ids))
+    )).scalar_one()
+
+    # Act
+    with capture_statements(db_engine) as statements:
+        payments = await db_service.select_in(Payments, Payments.user_id,
+                                              user_ids + user_ids[:100])
+
+    # Assert
+    assert len(statements) == 3
+    assert len(payments) == expected
+    assert {payment.user_id for payment in payments} == set(user_ids)
+
+
+@pytestmark
+async def test_stream_select_continues_by_key(db_session):
+    # Arrange
+    db_service = DbService(db=db_session)
+    expected = (await db_session.execute(
+        select(Payments.id).where(Payments.status == PaymentStatus.pending)
+    )).scalars().all()
+
+    # Act
+    ids = [
+        payment.id async for payment in db_service.stream_select(
+            Payments, [Payments.id],
+            where_select=[(Payments.status, PaymentStatus.pending)],
+            page_size=999,
+        )
+    ]
+
+    # Assert
+    assert len(expected) > 999
+    assert ids == sorted(expected)
+
+
+@pytestmark
+async def test_insert_many_and_update_many(db_session):
+    # Arrange
+    db_service = DbService(db=db_session)
+    rows = [
+        {'id': uuid.uuid4(), 'title': f'bulk-{uuid.uuid4()}', 'price': 100,
+         'duration': 1}
+        for _ in range(50)
+    ]
+
+    try:
+        # Act
+        await db_service.insert_many(Subscriptions, rows)
+        updated = await db_service.update_many(
+            Subscriptions, 'id',
+            [{'id': row['id'], 'price': 100 + n} for n, row in enumerate(rows)],
+            returning=[Subscriptions.id, Subscriptions.price],
+        )
+
+        # Assert
+        prices = dict((await db_session.execute(
+            select(Subscriptions.id, Subscriptions.price)
+            .where(Subscriptions.id.in_([row['id'] for row in rows]))
+        )).all())
+        assert dict(updated) == prices
+        assert prices == {row['id']: 100 + n for n, row in enumerate(rows)}
+    finally:
+        await db_session.execute(delete(Subscriptions).where(
+            Subscriptions.id.in_([row['id'] for row in rows])))
+        await db_session.commit()
@@ -0,0 +1,114 @@
+import asyncio
+import uuid
+
+import pytest_asyncio
+from fakeredis import FakeAsyncRedis
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import services.notify_queue
+from models.base import Payments, PaymentStatus, Subscriptions, \
+    UserSubscriptions
+from services.catalog import SubscriptionCatalog
+from services.notify_queue import NotifyQueue, NotifyWorker
+from tests.functional.settings import pytestmark
+from tests.functional.utils.stubs import StubEntitlements, StubGateway
+
+
+@pytest_asyncio.fixture(name='pending_payment')
+async def pending_payment(db_session):
+    subscription_id = (await db_session.execute(
+        select(Subscriptions.id).limit(1))).scalar_one()
+    payment = Payments(
+        id=uuid.uuid4(),
+        service_payment_id=uuid.uuid4(),
+        user_id=uuid.uuid4(),
+        subscription_id=subscription_id,
+        price=100,
+        status=PaymentStatus.pending,
+    )
+    db_session.add(payment)
+    await db_session.commit()
+    yield payment
+    await db_session.execute(delete(UserSubscriptions).where(
+        UserSubscriptions.user_id == payment.user_id))
+    await db_session.execute(delete(Payments).where(
+        Payments.id == payment.id))
+    await db_session.commit()
+
+
+@pytest_asyncio.fixture(name='notify_queue')
+async def notify_queue(db_engine, monkeypatch):
+    monkeypatch.setattr(services.notify_queue, 'async_session',
+                        async_sessionmaker(db_engine, expire_on_commit=False))
+    queue = NotifyQueue(FakeAsyncRedis())
+    await queue.create_group()
+    yield queue
+    await queue.redis.close()
+
+
+def make_worker(queue: NotifyQueue, max_deliveries: int = 5) -> NotifyWorker:
+    return NotifyWorker(queue, StubGateway(), SubscriptionCatalog(),
+                        StubEntitlements(), batch_size=10, block_ms=10,
+                        max_deliveries=max_deliveries)
+
+
+async def select_expiration(db_session, payment: Payments):
+    await db_session.commit()
+    return (await db_session.execute(
+        select(UserSubscriptions.expiration_time)
+        .where(UserSubscriptions.user_id == payment.user_id)
+    )).scalar_one()
+
+
+@pytestmark
+async def test_duplicate_and_late_messages_apply_once(db_session, notify_queue,
+                                                      pending_payment):
+    # Arrange
+    worker = make_worker(notify_queue)
+    payment_id = pending_payment.service_payment_id
+    await notify_queue.put(payment_id, PaymentStatus.success)
+    await notify_queue.put(payment_id, PaymentStatus.success)
+    await worker.process(await notify_queue.read(worker.consumer, 10, 10))
+    expiration_time = await select_expiration(db_session, pending_payment)
+
+    # Act
+    # Повтор вебхука и запоздавший pending после успешной оплаты
+    await notify_queue.put(payment_id, PaymentStatus.success)
+    await notify_queue.put(payment_id, PaymentStatus.pending)
+    await worker.process(await notify_queue.read(worker.consumer, 10, 10))
+
+    # Assert
+    assert await select_expiration(db_session, pending_payment) == expiration_time
+    assert (await db_session.execute(
+        select(Payments.status).where(Payments.id == pending_payment.id)
+    )).scalar_one() == PaymentStatus.success
+    assert await notify_queue.redis.xlen(notify_queue.stream) == 0
+
+
+@pytestmark
+async def test_poison_message_dead_lettered_alone(db_session, notify_queue,
+                                                  pending_payment):
+    # Arrange
+    worker = make_worker(notify_queue, max_deliveries=2)
+    # Статус длиннее столбца: UPDATE падает на каждой попытке
+    await notify_queue.put(uuid.uuid4(), 'x' * 300)
+    await notify_queue.put(pending_payment.service_payment_id,
+                           PaymentStatus.success)
+
+    # Act
+    task = asyncio.create_task(worker.run())
+    try:
+        for _ in range(100):
+            if await notify_queue.redis.xlen(notify_queue.dead_letter_stream):
+                break
+            await asyncio.sleep(0.1)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    # Assert
+    dead = await notify_queue.redis.xrange(notify_queue.dead_letter_stream)
+    assert [fields[b'status'] for _, fields in dead] == [b'x' * 300]
+    assert await notify_queue.redis.xlen(notify_queue.stream) == 0
+    assert await select_expiration(db_session, pending_payment)
@@ -0,0 +1,94 @@
+import datetime
+import uuid
+
+import pytest_asyncio
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import services.reconciliation
+from db.postgres import DbService
+from models.base import Payments, PaymentStatus, Subscriptions, \
+    UserSubscriptions
+from services.billing import BillingService
+from services.catalog import SubscriptionCatalog
+from services.reconciliation import PendingPaymentsReconciler
+from tests.functional.settings import pytestmark
+from tests.functional.utils.stubs import StubEntitlements, StubGateway
+
+# Старше окна вебхуков (payments_pending_lookup_days)
+PAYMENT_AGE = datetime.timedelta(days=20, hours=12)
+
+
+@pytest_asyncio.fixture(name='stale_payment')
+async def stale_payment(db_session):
+    subscription_id = (await db_session.execute(
+        select(Subscriptions.id).limit(1))).scalar_one()
+    payment = Payments(
+        id=uuid.uuid4(),
+        service_payment_id=uuid.uuid4(),
+        user_id=uuid.uuid4(),
+        subscription_id=subscription_id,
+        price=100,
+        status=PaymentStatus.pending,
+        date_create=datetime.datetime.now(datetime.timezone.utc) - PAYMENT_AGE,
+    )
+    db_session.add(payment)
+    await db_session.commit()
+    yield payment
+    await db_session.execute(delete(UserSubscriptions).where(
+        UserSubscriptions.user_id == payment.user_id))
+    await db_session.execute(delete(Payments).where(
+        Payments.id == payment.id))
+    await db_session.commit()
+
+
+async def select_status(db_session, payment: Payments) -> str:
+    await db_session.commit()
+    return (await db_session.execute(
+        select(Payments.status).where(Payments.id == payment.id)
+    )).scalar_one()
+
+
+@pytestmark
+async def test_late_webhook_applies_outside_window(db_session, stale_payment):
+    # Arrange
+    billing_service = BillingService(
+        db=DbService(db=db_session),
+        gateway=StubGateway(),
+        catalog=SubscriptionCatalog(),
+        entitlements=StubEntitlements(),
+    )
+
+    # Act
+    payments = await billing_service.apply_payment_statuses(
+        {stale_payment.service_payment_id: PaymentStatus.success})
+
+    # Assert
+    assert [payment.id for payment in payments] == [stale_payment.id]
+    assert await select_status(db_session, stale_payment) == PaymentStatus.success
+
+
+@pytestmark
+async def test_reconciler_resolves_stale_payment(db_engine, db_session,
+                                                 stale_payment, monkeypatch):
+    # Arrange
+    monkeypatch.setattr(services.reconciliation, 'async_session',
+                        async_sessionmaker(db_engine, expire_on_commit=False))
+    # Окно сверки [21 день, 20 дней 6 часов) назад: из синтетических
+    # ожидающих платежей в него не попадает ни один
+    reconciler = PendingPaymentsReconciler(
+        gateway=StubGateway(),
+        catalog=SubscriptionCatalog(),
+        entitlements=StubEntitlements(),
+        older_than_minutes=(20 * 24 + 6) * 60,
+        lookup_days=21,
+        rate_per_second=1000,
+    )
+
+    # Act
+    stats = await reconciler.run_once()
+
+    # Assert
+    assert stats['checked'] == 1
+    assert stats['updated'] == 1
+    assert await select_status(db_session, stale_payment) == PaymentStatus.success
@@ -0,0 +1,126 @@
+import uuid
+
+import pytest
+from sqlalchemy import select
+
+from db.postgres import DbService
+from models.base import Payments, PaymentStatus, Subscriptions, \
+    UserSubscriptions
+from services.billing import BillingService
+from services.catalog import SubscriptionCatalog
+from services.entitlements import EntitlementService
+from tests.functional.settings import settings, pytestmark
+from tests.functional.utils.plans import capture_statements, \
+    explain_seq_scans
+from tests.functional.utils.stubs import StubEntitlements, StubGateway
+
+
+@pytest.fixture(name='billing_service')
+def billing_service(db_session) -> BillingService:
+    # Пустой каталог: тариф читается из БД, как при промахе кэша
+    return BillingService(
+        db=DbService(db=db_session),
+        gateway=StubGateway(),
+        catalog=SubscriptionCatalog(),
+        entitlements=StubEntitlements(),
+    )
+
+
+async def assert_no_seq_scan(db_engine, statements: list) -> None:
+    assert statements, 'BillingService не обратился к базе'
+    failed = await explain_seq_scans(db_engine, statements,
+                                     settings.seq_scan_rows_limit)
+    assert not failed, f'Seq Scan по большим таблицам: {failed}'
+
+
+@pytestmark
+async def test_create_new_payment(db_engine, db_session, billing_service):
+    # Arrange
+    subscription_id = (await db_session.execute(
+        select(Subscriptions.id).limit(1))).scalar_one()
+
+    # Act
+    with capture_statements(db_engine) as statements:
+        await billing_service.create_new_payment(
+            uuid.uuid4(), 'user@example.com', subscription_id,
+            'http://127.0.0.1/return')
+
+    # Assert
+    await assert_no_seq_scan(db_engine, statements)
+
+
+@pytestmark
+async def test_get_pending_payment(db_engine, db_session, billing_service):
+    # Arrange
+    service_payment_id = (await db_session.execute(
+        select(Payments.service_payment_id)
+        .where(Payments.user_id == uuid.UUID(int=1),
+               Payments.status == PaymentStatus.pending)
+        .limit(1)
+    )).scalar_one()
+
+    # Act
+    with capture_statements(db_engine) as statements:
+        await billing_service._get_pending_payment(service_payment_id,
+                                                   PaymentStatus.pending)
+
+    # Assert
+    await assert_no_seq_scan(db_engine, statements)
+
+
+@pytestmark
+async def test_apply_payment_statuses(db_engine, db_session, billing_service):
+    # Arrange
+    service_payment_ids = (await db_session.execute(
+        select(Payments.service_payment_id)
+        .where(Payments.user_id.in_([uuid.UUID(int=n) for n in range(2, 102)]),
+               Payments.status == PaymentStatus.pending)
+    )).scalars().all()
+    await db_session.commit()
+
+    # Act
+    with capture_statements(db_engine) as statements:
+        await billing_service.apply_payment_statuses({
+            service_payment_id: PaymentStatus.success
+            for service_payment_id in service_payment_ids
+        })
+
+    # Assert
+    await assert_no_seq_scan(db_engine, statements)
+
+
+@pytestmark
+async def test_prolongate_subscribe(db_engine, db_session, billing_service):
+    # Arrange
+    user_subscribe = (await db_session.execute(
+        select(UserSubscriptions)
+        .where(UserSubscriptions.user_id.in_(
+            [uuid.UUID(int=n) for n in range(200, 300)]),
+            UserSubscriptions.auto_prolongate.is_(True))
+        .limit(1)
+    )).scalar_one()
+    await db_session.commit()
+
+    # Act
+    with capture_statements(db_engine) as statements:
+        succeeded = await billing_service.prolongate_subscribe(
+            user_subscribe.user_id, user_subscribe.id)
+
+    # Assert
+    assert succeeded
+    await assert_no_seq_scan(db_engine, statements)
+
+
+@pytestmark
+async def test_select_active_entitlements(db_engine, db_session):
+    # Arrange
+    entitlement_service = EntitlementService(store=None,
+                                             db=DbService(db=db_session))
+    user_ids = [uuid.UUID(int=n) for n in range(300, 1300)]
+
+    # Act
+    with capture_statements(db_engine) as statements:
+        await entitlement_service._select_active(user_ids)
+
+    # Assert
+    await assert_no_seq_scan(db_engine, statements)
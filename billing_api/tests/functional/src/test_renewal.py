@@ -0,0 +1,125 @@
+import datetime
+import uuid
+
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException, status
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import services.prolongation
+from db.postgres import DbService
+from models.base import Payments, PaymentStatus, Subscriptions, \
+    UserSubscriptions
+from services.billing import BillingService
+from services.catalog import SubscriptionCatalog
+from services.gateway import GatewayError, GatewayPayment
+from services.prolongation import ProlongationScheduler
+from tests.functional.settings import pytestmark
+from tests.functional.utils.stubs import StubEntitlements, StubGateway
+
+
+class LostResponseGateway(StubGateway):
+    """
+    Касса с идемпотентностью по ключу, у которой теряется ответ
+    на первое списание: деньги списаны, а сервис видит таймаут.
+    """
+
+    def __init__(self) -> None:
+        self.charges: dict[uuid.UUID, GatewayPayment] = {}
+        self.lost_responses = 1
+
+    async def create_payment(self, payload: dict,
+                             idempotence_key: uuid.UUID) -> GatewayPayment:
+        if idempotence_key not in self.charges:
+            self.charges[idempotence_key] = GatewayPayment(
+                id=str(uuid.uuid4()), status=PaymentStatus.success)
+        if self.lost_responses:
+            self.lost_responses -= 1
+            raise GatewayError('Payment gateway is unavailable')
+        return self.charges[idempotence_key]
+
+
+@pytest_asyncio.fixture(name='user_subscribe')
+async def user_subscribe(db_session):
+    subscription_id = (await db_session.execute(
+        select(Subscriptions.id).limit(1))).scalar_one()
+    user_id = uuid.uuid4()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    payment = Payments(
+        id=uuid.uuid4(),
+        service_payment_id=uuid.uuid4(),
+        payment_method_id=uuid.uuid4(),
+        user_id=user_id,
+        subscription_id=subscription_id,
+        price=100,
+        status=PaymentStatus.success,
+    )
+    user_subscribe = UserSubscriptions(
+        id=uuid.uuid4(),
+        user_id=user_id,
+        subscription_id=subscription_id,
+        payment_id=payment.id,
+        is_active=True,
+        auto_prolongate=True,
+        expiration_time=now + datetime.timedelta(hours=1),
+    )
+    db_session.add_all([payment, user_subscribe])
+    await db_session.commit()
+    yield user_subscribe
+    await db_session.execute(delete(UserSubscriptions).where(
+        UserSubscriptions.user_id == user_id))
+    await db_session.execute(delete(Payments).where(
+        Payments.user_id == user_id))
+    await db_session.commit()
+
+
+@pytestmark
+async def test_lost_renewal_response_charged_once(db_engine, db_session,
+                                                  user_subscribe, monkeypatch):
+    # Arrange
+    monkeypatch.setattr(services.prolongation, 'async_session',
+                        async_sessionmaker(db_engine, expire_on_commit=False))
+    gateway = LostResponseGateway()
+    billing_service = BillingService(
+        db=DbService(db=db_session),
+        gateway=gateway,
+        catalog=SubscriptionCatalog(),
+        entitlements=StubEntitlements(),
+    )
+    scheduler = ProlongationScheduler(gateway=gateway,
+                                      catalog=SubscriptionCatalog(),
+                                      entitlements=StubEntitlements())
+    expiration_time = user_subscribe.expiration_time
+
+    # Act
+    with pytest.raises(HTTPException):
+        await billing_service.prolongate_user_subscribe(user_subscribe)
+    # Отметка о попытке не снята: новое списание за период не создается
+    with pytest.raises(HTTPException) as conflict:
+        await billing_service.prolongate_user_subscribe(user_subscribe)
+    stats = {'succeeded': 0, 'pending': 0, 'failed': 0, 'skipped': 0}
+    unresolved = [row for row in await scheduler._unresolved()
+                  if row.id == user_subscribe.id]
+    for row in unresolved:
+        await scheduler._prolongate(row, stats)
+
+    # Assert
+    await db_session.commit()
+    renewals = (await db_session.execute(
+        select(func.count()).select_from(Payments)
+        .where(Payments.user_id == user_subscribe.user_id,
+               Payments.id != user_subscribe.payment_id)
+    )).scalar_one()
+    renewed = (await db_session.execute(
+        select(UserSubscriptions)
+        .where(UserSubscriptions.id == user_subscribe.id)
+        .execution_options(populate_existing=True)
+    )).scalar_one()
+    assert conflict.value.status_code == status.HTTP_409_CONFLICT
+    assert len(unresolved) == 1
+    assert stats['succeeded'] == 1
+    assert len(gateway.charges) == 1
+    assert renewals == 1
+    assert renewed.renewal_unresolved_since is None
+    assert renewed.expiration_time > expiration_time
@@ -0,0 +1,178 @@
+from typing import Union
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError, ProgrammingError
+
+from db.replica import ReplicaPool
+from tests.functional.settings import pytestmark
+
+SQL = text('SELECT 1')
+
+
+class FakeResult:
+    def __init__(self, row: tuple) -> None:
+        self.row = row
+
+    def one(self) -> tuple:
+        return self.row
+
+    def all(self) -> list:
+        return [self.row]
+
+
+class FakeSession:
+    """
+    Сессия без базы: на любой запрос отдает row или бросает error.
+    """
+
+    def __init__(self, row: tuple = (),
+                 error: Union[None, Exception] = None) -> None:
+        self.row = row
+        self.error = error
+        self.executed = []
+
+    def __call__(self) -> 'FakeSession':
+        return self
+
+    async def __aenter__(self) -> 'FakeSession':
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        pass
+
+    async def execute(self, sql) -> FakeResult:
+        self.executed.append(sql)
+        if self.error is not None:
+            raise self.error
+        return FakeResult(self.row)
+
+
+def make_pool(*sessions: FakeSession) -> ReplicaPool:
+    # Фоновая проверка не запускается: тесты вызывают check сами
+    pool = ReplicaPool(
+        [f'postgresql+asyncpg://u:p@127.0.0.1/replica{number}'
+         for number in range(len(sessions))],
+        max_lag=5.0, check_interval=float('inf'),
+    )
+    for replica, session in zip(pool.replicas, sessions):
+        replica.session = session
+    return pool
+
+
+@pytest.mark.parametrize('row, healthy', [
+    ((True, 1.0), True),
+    ((True, 10.0), False),
+    ((False, 0), False),
+])
+@pytestmark
+async def test_check_lag_and_streaming(row, healthy):
+    # Arrange
+    pool = make_pool(FakeSession(row=row))
+
+    # Act
+    await pool.check()
+
+    # Assert
+    assert pool.replicas[0].healthy is healthy
+    assert (pool.choose() is not None) is healthy
+
+
+@pytestmark
+async def test_check_error_marks_unhealthy():
+    # Arrange
+    pool = make_pool(FakeSession(error=OSError('connection refused')))
+    pool.replicas[0].healthy = True
+
+    # Act
+    await pool.check()
+
+    # Assert
+    assert not pool.replicas[0].healthy
+    assert pool.replicas[0].lag is None
+    assert pool.choose() is None
+
+
+@pytestmark
+async def test_choose_skips_unhealthy():
+    # Arrange
+    pool = make_pool(FakeSession(row=(True, 0)), FakeSession(row=(True, 60)),
+                     FakeSession(row=(True, 0)))
+    await pool.check()
+
+    # Act
+    chosen = {pool.choose().name for _ in range(4)}
+
+    # Assert
+    assert chosen == {'replica0', 'replica2'}
+
+
+@pytestmark
+async def test_read_unchecked_replica_uses_primary():
+    # Arrange
+    replica = FakeSession(row=('replica',))
+    primary = FakeSession(row=('primary',))
+    pool = make_pool(replica)
+
+    # Act
+    rows = await pool.read(SQL, lambda result: result.all(), primary)
+
+    # Assert
+    assert rows == [('primary',)]
+    assert not replica.executed
+
+
+@pytestmark
+async def test_read_from_healthy_replica():
+    # Arrange
+    primary = FakeSession(row=('primary',))
+    pool = make_pool(FakeSession(row=(True, 0)))
+    await pool.check()
+    pool.replicas[0].session.row = ('replica',)
+
+    # Act
+    rows = await pool.read(SQL, lambda result: result.all(), primary)
+
+    # Assert
+    assert rows == [('replica',)]
+    assert not primary.executed
+
+
+@pytest.mark.parametrize('error', [
+    OSError('connection refused'),
+    DBAPIError('SELECT 1', {}, ConnectionError('connection lost'),
+               connection_invalidated=True),
+])
+@pytestmark
+async def test_read_connection_error_falls_back_to_primary(error):
+    # Arrange
+    primary = FakeSession(row=('primary',))
+    pool = make_pool(FakeSession(row=(True, 0)))
+    await pool.check()
+    pool.replicas[0].session.error = error
+
+    # Act
+    rows = await pool.read(SQL, lambda result: result.all(), primary)
+
+    # Assert
+    assert rows == [('primary',)]
+    assert not pool.replicas[0].healthy
+    assert pool.choose() is None
+
+
+@pytestmark
+async def test_read_query_error_not_retried_on_primary():
+    # Arrange
+    primary = FakeSession(row=('primary',))
+    pool = make_pool(FakeSession(row=(True, 0)))
+    await pool.check()
+    pool.replicas[0].session.error = ProgrammingError(
+        'SELECT 1', {}, Exception('syntax error'))
+
+    # Act
+    with pytest.raises(ProgrammingError):
+        await pool.read(SQL, lambda result: result.all(), primary)
+
+    # Assert
+    assert not primary.executed
+    assert pool.replicas[0].healthy
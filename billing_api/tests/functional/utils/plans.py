@@ -0,0 +1,84 @@
+import json
+from contextlib import contextmanager
+from typing import Iterator
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+@contextmanager
+def capture_statements(engine: AsyncEngine) -> Iterator[list]:
+    """
+    Собирает запросы, ушедшие в базу внутри блока: [(sql, параметры)].
+    """
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(engine.sync_engine, 'before_cursor_execute', capture)
+    try:
+        yield statements
+    finally:
+        event.remove(engine.sync_engine, 'before_cursor_execute', capture)
+
+
+def is_explainable(statement: str) -> bool:
+    """
+    INSERT ... VALUES ничего не читает, а повторный запуск упадет
+    на первичном ключе, поэтому такие запросы не проверяем.
+    """
+    statement = statement.lstrip().upper()
+    if statement.startswith('INSERT'):
+        return 'SELECT' in statement
+    return statement.startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH'))
+
+
+def seq_scans(plan: dict) -> Iterator[str]:
+    if plan['Node Type'] == 'Seq Scan':
+        yield plan['Relation Name']
+    for child in plan.get('Plans', []):
+        yield from seq_scans(child)
+
+
+async def large_relations(engine: AsyncEngine, rows_limit: int) -> set[str]:
+    async with engine.connect() as connection:
+        result = await connection.execute(text("""
+            SELECT relname FROM pg_class
+            WHERE relkind IN ('r', 'p') AND reltuples > :rows_limit
+        """), {'rows_limit': rows_limit})
+        return set(result.scalars())
+
+
+async def explain_seq_scans(
+        engine: AsyncEngine,
+        statements: list,
+        rows_limit: int,
+) -> dict[str, list[str]]:
+    """
+    Выполняет EXPLAIN (ANALYZE, BUFFERS) для каждого запроса в
+    откатываемой транзакции и возвращает запросы, которые читают
+    большие таблицы целиком: {sql: [таблицы]}.
+    """
+    large = await large_relations(engine, rows_limit)
+    failed = {}
+    async with engine.connect() as connection:
+        for statement, parameters in statements:
+            if not is_explainable(statement):
+                continue
+            result = await connection.exec_driver_sql(
+                f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}',
+                parameters,
+            )
+            plan = result.scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            relations = [
+                relation for relation in seq_scans(plan[0]['Plan'])
+                if relation in large
+            ]
+            if relations:
+                failed[statement] = relations
+        await connection.rollback()
+    return failed
@@ -0,0 +1,29 @@
+import uuid
+from typing import Union
+
+from models.base import PaymentStatus
+from services.gateway import AbstractPaymentGateway, GatewayPayment
+
+
+class StubGateway(AbstractPaymentGateway):
+    async def create_payment(self, payload: dict,
+                             idempotence_key: uuid.UUID) -> GatewayPayment:
+        # Платеж сохраненным способом оплаты проходит сразу
+        status = (PaymentStatus.success if 'payment_method_id' in payload
+                  else PaymentStatus.pending)
+        return GatewayPayment(id=str(uuid.uuid4()), status=status,
+                              confirmation_url='http://127.0.0.1/confirm')
+
+    async def get_payment(self, payment_id: Union[str, uuid.UUID]) -> GatewayPayment:
+        return GatewayPayment(id=str(payment_id), status=PaymentStatus.success)
+
+    async def close(self) -> None:
+        pass
+
+
+class StubEntitlements:
+    async def grant(self, rows) -> None:
+        pass
+
+    async def invalidate(self, user_ids) -> None:
+        pass
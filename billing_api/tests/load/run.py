@@ -0,0 +1,405 @@
+"""
+Нагрузочный прогон billing_api на одной машине.
+
+Поднимает заглушку ЮKassa (tests.stubs.yookassa) и ключей auth_api
+(tests.stubs.auth) в этом же процессе и billing_api в дочернем процессе
+uvicorn, который ходит в заглушки вместо кассы и auth_api. Postgres и Redis локальные, настройки берутся из тех же
+переменных окружения, что и у billing_api; миграции должны быть
+применены.
+
+Фазы идут по очереди: /create, /notify, /auto_prolongate, чтение
+подписок (/entitlements/{user_id} с токеном пользователя и пачкой
+с сервисным токеном) и смесь. Вебхуки отправляет сам прогон, поэтому часть из них повторяется
+(касса доставляет уведомления минимум один раз), а часть приходит
+не по порядку: waiting_for_capture после succeeded. Обращения к БД и
+к кассе на одну операцию считаются по разнице счетчиков /metrics
+billing_api до и после фазы.
+
+Результат - JSON: пропускная способность, p50/p95/p99 задержки по
+каждому виду запросов, SQL выражения и вызовы кассы на операцию.
+Цель для фаз entitlements - p99 меньше 2 мс; к этому моменту проекция
+в Redis прогрета предыдущими фазами.
+
+Запуск из директории billing_api:
+
+    PYTHONPATH=src python -m tests.load.run --requests 2000 \\
+        --concurrency 50 --output load.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Union
+
+import aiohttp
+from aiohttp import web
+from prometheus_client.parser import text_string_to_metric_families
+from sqlalchemy import delete
+
+from db.postgres import async_session, engine
+from models.base import Payments, PaymentStatus, RevenueDaily, \
+    RevenueMonthly, Subscriptions, UserSubscriptions
+from tests.stubs.auth import AuthKeysStub
+from tests.stubs.yookassa import YookassaStub
+
+SRC_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'src')
+PHASES = ('create', 'notify', 'auto_prolongate', 'entitlements',
+          'entitlements_bulk', 'mixed')
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу."""
+    ordered = sorted(values)
+    index = max(math.ceil(q / 100 * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+def parse_mix(value: str) -> dict[str, int]:
+    mix = {}
+    for item in value.split(','):
+        name, weight = item.split('=')
+        if name not in PHASES[:-1]:
+            raise argparse.ArgumentTypeError(f'Unknown operation {name}')
+        mix[name] = int(weight)
+    return mix
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    def observe(self, operation: str, seconds: float, ok: bool) -> None:
+        self.latencies[operation].append(seconds)
+        if not ok:
+            self.errors[operation] += 1
+
+    def report(self) -> dict:
+        return {
+            operation: {
+                'count': len(latencies),
+                'errors': self.errors[operation],
+                'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            }
+            for operation, latencies in self.latencies.items()
+        }
+
+
+class LoadRun:
+    def __init__(self, args: argparse.Namespace, stub: YookassaStub,
+                 auth_stub: AuthKeysStub) -> None:
+        self.args = args
+        self.stub = stub
+        self.auth_stub = auth_stub
+        self.app_url = f'http://127.0.0.1:{args.app_port}'
+        self.subscription_id = uuid.uuid4()
+        self.users = [uuid.uuid4() for _ in range(args.users)]
+        self.tokens = {user_id: self._token(user_id) for user_id in self.users}
+        self.service_token = self._token(uuid.uuid4(), roles=['service'])
+        # Пользовательские подписки с автопродлением: id -> user_id
+        self.user_subscriptions: dict[uuid.UUID, uuid.UUID] = {}
+        self.pending: list[str] = []
+        self.random = random.Random(args.seed)
+        self.session: Union[None, aiohttp.ClientSession] = None
+
+    def _token(self, user_id: uuid.UUID, roles: tuple = ()) -> str:
+        return self.auth_stub.token(
+            {
+                'user_id': str(user_id),
+                'roles': list(roles),
+                'email': f'{user_id}@load.test',
+                'jti': str(uuid.uuid4()),
+                'token_type': 'access',
+                'exp': datetime.datetime.now(datetime.timezone.utc)
+                + datetime.timedelta(days=1),
+            },
+        )
+
+    def _auth(self, user_id: uuid.UUID) -> dict:
+        return {'Authorization': f'Bearer {self.tokens[user_id]}'}
+
+    async def seed(self) -> None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        async with async_session() as session:
+            session.add(Subscriptions(
+                id=self.subscription_id,
+                title=f'load-{self.subscription_id}',
+                price=100,
+                duration=1,
+            ))
+            await session.flush()
+            for user_id in self.users[:self.args.prolongate_users]:
+                payment = Payments(
+                    id=uuid.uuid4(),
+                    service_payment_id=uuid.uuid4(),
+                    user_id=user_id,
+                    subscription_id=self.subscription_id,
+                    price=100,
+                    status=PaymentStatus.success,
+                    date_create=now,
+                )
+                user_subscription = UserSubscriptions(
+                    id=uuid.uuid4(),
+                    user_id=user_id,
+                    subscription_id=self.subscription_id,
+                    payment_id=payment.id,
+                    is_active=True,
+                    expiration_time=now + datetime.timedelta(days=30),
+                    auto_prolongate=True,
+                )
+                session.add_all([payment, user_subscription])
+                self.user_subscriptions[user_subscription.id] = user_id
+            await session.commit()
+
+    async def cleanup(self) -> None:
+        async with async_session() as session:
+            for model in (UserSubscriptions, Payments, RevenueDaily,
+                          RevenueMonthly):
+                await session.execute(delete(model).where(
+                    model.subscription_id == self.subscription_id))
+            await session.execute(delete(Subscriptions).where(
+                Subscriptions.id == self.subscription_id))
+            await session.commit()
+
+    async def counters(self) -> dict[str, float]:
+        async with self.session.get(f'{self.app_url}/metrics') as response:
+            text = await response.text()
+        counters = defaultdict(float)
+        for family in text_string_to_metric_families(text):
+            for sample in family.samples:
+                if sample.name == 'billing_db_statement_duration_seconds_count':
+                    counters['db_statements'] += sample.value
+                elif sample.name == 'billing_gateway_request_duration_seconds_count':
+                    counters['gateway_calls'] += sample.value
+        return counters
+
+    async def _post(self, recorder: Recorder, operation: str, path: str,
+                    method: str = 'POST', **kwargs) -> Union[None, str]:
+        started = time.perf_counter()
+        try:
+            async with self.session.request(method, f'{self.app_url}{path}',
+                                            **kwargs) as response:
+                body = await response.text()
+                ok = response.status < 400
+        except aiohttp.ClientError:
+            body, ok = None, False
+        recorder.observe(operation, time.perf_counter() - started, ok)
+        return body if ok else None
+
+    async def create(self, recorder: Recorder) -> None:
+        user_id = self.random.choice(self.users)
+        body = await self._post(
+            recorder, 'create', '/api/v1/billing/create',
+            params={'subscribe_id': str(self.subscription_id)},
+            headers=self._auth(user_id),
+        )
+        if body is not None:
+            # Ответ - ссылка на оплату, id платежа кассы в ее конце
+            self.pending.append(json.loads(body).rsplit('/', 1)[-1])
+
+    async def notify(self, recorder: Recorder) -> None:
+        if not self.pending:
+            await self.create(recorder)
+            return
+        payment_id = self.pending.pop(
+            self.random.randrange(len(self.pending)))
+        path = '/api/v1/billing/notify'
+        event = self.stub.notification(payment_id)
+        await self._post(recorder, 'notify', path, json=event)
+        if self.random.random() < self.args.duplicate_ratio:
+            await self._post(recorder, 'notify_duplicate', path, json=event)
+        if self.random.random() < self.args.late_ratio:
+            late = self.stub.notification(payment_id, 'waiting_for_capture')
+            await self._post(recorder, 'notify_late', path, json=late)
+
+    async def auto_prolongate(self, recorder: Recorder) -> None:
+        user_subscription_id = self.random.choice(
+            list(self.user_subscriptions))
+        await self._post(
+            recorder, 'auto_prolongate', '/api/v1/billing/auto_prolongate',
+            params={'user_subscription_id': str(user_subscription_id)},
+            headers=self._auth(self.user_subscriptions[user_subscription_id]),
+        )
+
+    async def entitlements(self, recorder: Recorder) -> None:
+        user_id = self.random.choice(self.users)
+        await self._post(
+            recorder, 'entitlements', f'/api/v1/billing/entitlements/{user_id}',
+            method='GET', headers=self._auth(user_id),
+        )
+
+    async def entitlements_bulk(self, recorder: Recorder) -> None:
+        user_ids = self.random.sample(
+            self.users, min(self.args.bulk_size, len(self.users)))
+        await self._post(
+            recorder, 'entitlements_bulk', '/api/v1/billing/entitlements',
+            json={'user_ids': [str(user_id) for user_id in user_ids]},
+            headers={'Authorization': f'Bearer {self.service_token}'},
+        )
+
+    async def run_phase(self, phase: str) -> dict:
+        if phase == 'mixed':
+            operations = list(self.args.mix)
+            weights = [self.args.mix[operation] for operation in operations]
+        else:
+            operations, weights = [phase], [1]
+        if phase == 'notify':
+            requests = min(self.args.requests, len(self.pending))
+        else:
+            requests = self.args.requests
+
+        recorder = Recorder()
+        remaining = requests
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                operation = self.random.choices(operations, weights)[0]
+                await getattr(self, operation)(recorder)
+
+        before = await self.counters()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+        elapsed = time.perf_counter() - started
+        after = await self.counters()
+
+        operations_report = recorder.report()
+        total = sum(item['count'] for item in operations_report.values())
+        return {
+            'operations_total': total,
+            'errors_total': sum(recorder.errors.values()),
+            'seconds': round(elapsed, 3),
+            'throughput_rps': round(total / elapsed, 1) if elapsed else 0,
+            'db_statements_per_op': round(
+                (after['db_statements'] - before['db_statements'])
+                / max(total, 1), 2),
+            'gateway_calls_per_op': round(
+                (after['gateway_calls'] - before['gateway_calls'])
+                / max(total, 1), 2),
+            'operations': operations_report,
+        }
+
+
+async def wait_ready(url: str, process: subprocess.Popen,
+                     timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError('billing_api exited during startup')
+            try:
+                async with session.get(f'{url}/metrics') as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError('billing_api did not start')
+
+
+async def main(args: argparse.Namespace) -> dict:
+    stub = YookassaStub(latency=args.gateway_latency)
+    auth_stub = AuthKeysStub()
+    stub_app = stub.make_app()
+    auth_stub.add_routes(stub_app)
+    runner = web.AppRunner(stub_app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', args.stub_port).start()
+
+    run = LoadRun(args, stub, auth_stub)
+    await run.seed()
+    env = dict(
+        os.environ,
+        BILLING_API_YOOKASSA_API_URL=f'http://127.0.0.1:{args.stub_port}/v3',
+        BILLING_API_AUTH_JWKS_URL=(f'http://127.0.0.1:{args.stub_port}'
+                                   f'/.well-known/jwks.json'),
+        BILLING_API_NOTIFY_QUEUE_ENABLED='false',
+        BILLING_API_LOG_LEVEL='WARNING',
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app',
+         '--host', '127.0.0.1', '--port', str(args.app_port),
+         '--no-access-log'],
+        cwd=SRC_DIR, env=env,
+    )
+    report = {
+        'config': {
+            'requests_per_phase': args.requests,
+            'concurrency': args.concurrency,
+            'users': args.users,
+            'prolongate_users': args.prolongate_users,
+            'gateway_latency': args.gateway_latency,
+            'duplicate_ratio': args.duplicate_ratio,
+            'late_ratio': args.late_ratio,
+            'bulk_size': args.bulk_size,
+            'mix': args.mix,
+        },
+        'phases': {},
+    }
+    try:
+        await wait_ready(run.app_url, process)
+        connector = aiohttp.TCPConnector(limit=args.concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            run.session = session
+            for phase in args.phases:
+                report['phases'][phase] = await run.run_phase(phase)
+    finally:
+        process.terminate()
+        process.wait()
+        await runner.cleanup()
+        if not args.keep_data:
+            await run.cleanup()
+        await engine.dispose()
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='Запросов на фазу')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--prolongate-users', type=int, default=200,
+                        help='Пользователей с подпиской на автопродлении')
+    parser.add_argument('--phases', nargs='+', choices=PHASES,
+                        default=list(PHASES))
+    parser.add_argument('--mix', type=parse_mix,
+                        default='create=5,notify=4,auto_prolongate=1',
+                        help='Веса операций в смешанной фазе')
+    parser.add_argument('--duplicate-ratio', type=float, default=0.2,
+                        help='Доля вебхуков, доставленных повторно')
+    parser.add_argument('--late-ratio', type=float, default=0.1,
+                        help='Доля платежей с запоздавшим waiting_for_capture')
+    parser.add_argument('--bulk-size', type=int, default=100,
+                        help='Пользователей в одном запросе entitlements_bulk')
+    parser.add_argument('--gateway-latency', type=float, default=0.0,
+                        help='Задержка ответа заглушки кассы, секунды')
+    parser.add_argument('--app-port', type=int, default=8002)
+    parser.add_argument('--stub-port', type=int, default=8090)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep-data', action='store_true',
+                        help='Не удалять созданные прогоном данные')
+    parser.add_argument('--output', default=None,
+                        help='Файл для JSON отчета, по умолчанию stdout')
+    args = parser.parse_args()
+
+    result = json.dumps(asyncio.run(main(args)), indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(result)
+    else:
+        print(result)
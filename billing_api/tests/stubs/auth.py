@@ -0,0 +1,36 @@
+"""
+Заглушка ключей auth_api для офлайн-тестов и замеров billing_api.
+
+Генерирует ключ RS256, подписывает им токены и отдает открытую часть
+по /.well-known/jwks.json, как auth_api. В billing_api указать
+BILLING_API_AUTH_JWKS_URL на адрес заглушки.
+"""
+import json
+import uuid
+
+import rsa
+from aiohttp import web
+from jose import jwk, jwt
+
+
+class AuthKeysStub:
+    algorithm = 'RS256'
+
+    def __init__(self) -> None:
+        self.kid = str(uuid.uuid4())
+        _, private_key = rsa.newkeys(2048)
+        self.key = jwk.construct(private_key.save_pkcs1().decode(),
+                                 self.algorithm)
+
+    def token(self, claims: dict) -> str:
+        return jwt.encode(claims, self.key, algorithm=self.algorithm,
+                          headers={'kid': self.kid})
+
+    async def jwks(self, request: web.Request) -> web.Response:
+        return web.json_response({'keys': [
+            {**self.key.public_key().to_dict(), 'kid': self.kid,
+             'use': 'sig'},
+        ]}, dumps=json.dumps)
+
+    def add_routes(self, app: web.Application) -> None:
+        app.router.add_get('/.well-known/jwks.json', self.jwks)
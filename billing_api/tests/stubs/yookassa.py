@@ -0,0 +1,163 @@
+"""
+Локальная заглушка API ЮKassa для офлайн-тестов и замеров billing_api.
+
+Эмулирует создание и получение платежа (POST/GET /v3/payments) и, если
+задан --notify-url, через --notify-delay секунд отправляет в billing_api
+вебхук payment.succeeded, как это делает настоящая касса.
+
+Запуск из директории billing_api:
+
+    python -m tests.stubs.yookassa --port 8090 \
+        --notify-url http://127.0.0.1:8000/api/v1/billing/notify
+
+В billing_api указать BILLING_API_YOOKASSA_API_URL=http://127.0.0.1:8090/v3
+"""
+import argparse
+import asyncio
+import datetime
+import logging
+import uuid
+from typing import Union
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger('yookassa_stub')
+
+
+class YookassaStub:
+    def __init__(
+            self,
+            latency: float = 0.0,
+            notify_url: Union[str, None] = None,
+            notify_delay: float = 0.0,
+    ) -> None:
+        self.latency = latency
+        self.notify_url = notify_url
+        self.notify_delay = notify_delay
+        self.payments: dict[str, dict] = {}
+        self.idempotence_keys: dict[str, str] = {}
+        self._session: Union[None, aiohttp.ClientSession] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    @staticmethod
+    def _build_payment(payload: dict) -> dict:
+        payment_id = str(uuid.uuid4())
+        # Автоплатеж по сохраненному способу оплаты проходит без участия
+        # пользователя, поэтому сразу считается успешным.
+        status = 'succeeded' if payload.get('payment_method_id') else 'pending'
+        payment = {
+            'id': payment_id,
+            'status': status,
+            'paid': status == 'succeeded',
+            'amount': payload.get('amount'),
+            'description': payload.get('description'),
+            'created_at': datetime.datetime.utcnow().isoformat() + 'Z',
+            'metadata': payload.get('metadata', {}),
+            'recipient': {'account_id': 'stub', 'gateway_id': 'stub'},
+            'refundable': False,
+            'test': True,
+            'payment_method': {
+                'type': 'bank_card',
+                'id': payload.get('payment_method_id', payment_id),
+                'saved': bool(payload.get('save_payment_method')),
+            },
+        }
+        confirmation = payload.get('confirmation')
+        if confirmation:
+            payment['confirmation'] = {
+                'type': 'redirect',
+                'return_url': confirmation.get('return_url'),
+                'confirmation_url': f'https://stub.yookassa.local/checkout/{payment_id}',
+            }
+        return payment
+
+    async def create_payment(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+        idempotence_key = request.headers.get('Idempotence-Key')
+        if idempotence_key in self.idempotence_keys:
+            payment = self.payments[self.idempotence_keys[idempotence_key]]
+            return web.json_response(payment)
+
+        payment = self._build_payment(await request.json())
+        self.payments[payment['id']] = payment
+        if idempotence_key:
+            self.idempotence_keys[idempotence_key] = payment['id']
+
+        if self.notify_url:
+            task = asyncio.create_task(self._notify(payment['id']))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return web.json_response(payment)
+
+    async def get_payment(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+        payment = self.payments.get(request.match_info['payment_id'])
+        if payment is None:
+            return web.json_response(
+                {'type': 'error', 'code': 'not_found'}, status=404)
+        return web.json_response(payment)
+
+    def notification(self, payment_id: str,
+                     status: str = 'succeeded') -> dict:
+        """
+        Переводит платеж в status и возвращает тело вебхука о нем.
+        """
+        payment = self.payments[payment_id]
+        payment['status'] = status
+        payment['paid'] = status == 'succeeded'
+        return {
+            'type': 'notification',
+            'event': f'payment.{status}',
+            'object': payment,
+        }
+
+    async def _notify(self, payment_id: str) -> None:
+        await asyncio.sleep(self.notify_delay)
+        event = self.notification(payment_id)
+        try:
+            async with self._session.post(self.notify_url, json=event) as response:
+                await response.read()
+        except aiohttp.ClientError as err:
+            logger.error('Failed to notify billing_api: %r', err)
+
+    async def on_startup(self, app: web.Application) -> None:
+        self._session = aiohttp.ClientSession()
+
+    async def on_cleanup(self, app: web.Application) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await self._session.close()
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/v3/payments', self.create_payment)
+        app.router.add_get('/v3/payments/{payment_id}', self.get_payment)
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='YooKassa API stub')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Задержка ответа кассы, секунды')
+    parser.add_argument('--notify-url', default=None,
+                        help='Адрес /notify billing_api для вебхуков')
+    parser.add_argument('--notify-delay', type=float, default=0.0,
+                        help='Задержка отправки вебхука, секунды')
+    args = parser.parse_args()
+
+    stub = YookassaStub(
+        latency=args.latency,
+        notify_url=args.notify_url,
+        notify_delay=args.notify_delay,
+    )
+    web.run_app(stub.make_app(), host=args.host, port=args.port,
+                access_log=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,9 @@ class Settings(BaseSettings):
     project_name: str = "Some project name"
     redis_host: str = '127.0.0.1'
     auth_url: str = ''
+    auth_jwks_cache_seconds: int = 300
+    auth_jwks_min_refresh_seconds: int = 10
+    auth_revoked_before_key: str = 'auth:revoked_before'
     redis_port: Union[str, int] = 6379
     elastic_host: str = 'elastic'
     elastic_port: Union[str, int] = 9200
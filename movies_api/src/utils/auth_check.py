@@ -1,24 +1,109 @@
+import asyncio
+import logging
+import time
 from functools import wraps
 from http import HTTPStatus
+from typing import Union
 
 import aiohttp
 from fastapi import HTTPException, Request
+from jose import jwk, jwt, JWTError
+from jose.backends.base import Key
+
 from core.config import cfg
+from db import redis
+
+logger = logging.getLogger('movies_api')
+
+
+class JwksKeys:
+    """
+    Открытые ключи auth_api из JWKS, кэшируются на cache_seconds.
+    Токен с неизвестным kid вызывает внеочередное обновление, но не чаще
+    раза в min_refresh_seconds. Если auth_api недоступен, работают ранее
+    полученные ключи.
+    """
+
+    algorithm = 'RS256'
+
+    def __init__(
+            self,
+            url: str = f'{cfg.auth_url}/.well-known/jwks.json',
+            cache_seconds: int = cfg.auth_jwks_cache_seconds,
+            min_refresh_seconds: int = cfg.auth_jwks_min_refresh_seconds,
+    ) -> None:
+        self.url = url
+        self.cache_seconds = cache_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self._keys: dict[str, Key] = {}
+        self._fetched_at: Union[None, float] = None
+        self._lock = asyncio.Lock()
 
+    def _due(self, kid: str) -> bool:
+        if self._fetched_at is None:
+            return True
+        age = time.monotonic() - self._fetched_at
+        if kid not in self._keys:
+            return age >= self.min_refresh_seconds
+        return age >= self.cache_seconds
 
-async def request_post(url, headers=None, query_params=None):
-    async with aiohttp.ClientSession(headers=headers) as session:
+    async def refresh(self) -> None:
+        self._fetched_at = time.monotonic()
+        timeout = aiohttp.ClientTimeout(total=5)
         try:
-            async with session.post(url, params=query_params) as response:
-                if response.status != HTTPStatus.OK:
-                    message = await response.json()
-                    raise HTTPException(
-                        status_code=HTTPStatus.UNAUTHORIZED,
-                        detail=message,
-                    )
-                return await response.json()
-        except aiohttp.ServerConnectionError:
-            return HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.get(self.url) as response:
+                    response.raise_for_status()
+                    jwks = await response.json()
+            self._keys = {
+                key['kid']: jwk.construct(key, self.algorithm)
+                for key in jwks['keys']
+            }
+        except (aiohttp.ClientError, asyncio.TimeoutError, JWTError,
+                KeyError, ValueError) as err:
+            logger.error('Failed to fetch JWKS from %s: %r', self.url, err)
+
+    async def get(self, kid: str) -> Union[None, Key]:
+        if self._due(kid):
+            async with self._lock:
+                if self._due(kid):
+                    await self.refresh()
+        return self._keys.get(kid)
+
+    async def decode(self, token: str) -> dict:
+        key = await self.get(jwt.get_unverified_header(token).get('kid'))
+        if key is None:
+            raise JWTError('Unknown key id')
+        return jwt.decode(token, key, algorithms=[self.algorithm])
+
+
+jwks_keys = JwksKeys()
+
+
+async def check_access_token(token: str) -> dict:
+    """
+    Подпись и срок проверяются по ключам из JWKS, отзыв - по ключу jti
+    в Redis, который auth_api ставит при выходе, и по времени выхода
+    пользователя со всех устройств - одним запросом в Redis.
+    """
+    error = HTTPException(status_code=HTTPStatus.UNAUTHORIZED,
+                          detail='access not valid')
+    try:
+        payload = await jwks_keys.decode(token)
+    except JWTError:
+        raise error
+    if payload.get('token_type') != 'access':
+        raise error
+    async with redis.redis_service.redis.pipeline(transaction=False) as pipe:
+        pipe.exists(payload['jti'])
+        pipe.zscore(cfg.auth_revoked_before_key, payload['user_id'])
+        denied, revoked_before = await pipe.execute()
+    if denied:
+        raise error
+    # Токены без iat выданы до появления отзыва по времени
+    if revoked_before is not None and payload.get('iat', 0) < revoked_before:
+        raise error
+    return payload
 
 
 def auth_required(func):
@@ -30,8 +115,7 @@ def auth_required(func):
                 status_code=HTTPStatus.UNAUTHORIZED,
                 detail="Authorization token is not provide",
             )
-        query_params = {'access_token': auth_header.split()[1]}
-        await request_post(f'{cfg.auth_url}/api/v1/auth/validate_token', query_params=query_params)
+        await check_access_token(auth_header.split()[-1])
 
         result = await func(*args, request=request, **kwargs)
         return result